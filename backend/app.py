@@ -1,28 +1,238 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
-from werkzeug.utils import secure_filename
+from flask import (Flask, Request, render_template, request, jsonify, send_from_directory, Response,
+                   stream_with_context, g, abort)
+from werkzeug.utils import secure_filename, safe_join
+import io
+import importlib
 import os
 import json
 import sys
 from flask_cors import CORS
 import uuid
+import time
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 # Add the parent directory to the path to import from ml module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from ml.image_comparison import compare_images
-from ml.figma_service import fetch_figma_design, FigmaService
+# The comparison and Figma modules (OpenCV, numpy, scikit-image, Pillow, requests)
+# are imported by the functions using them, so the app starts without them
+from ml.deferred_render import defer_rendering, render_pending
+from ml.baseline_store import BaselineStore
+from ml.issue_templates import render_issue_details
+from ml.result_cache import ResultCache
+from ml.stage_timing import stage, set_stage_observer, start_recording, stop_recording
+from backend.jobs import JobQueue, public_job, FINISHED_STATUSES
+from backend.selection_store import SelectionStore
+from backend.results_db import ResultsDB
+from backend.storage import StorageManager
+from backend.metrics import MetricsRegistry
+from backend.profiling import ProfileStore, SUMMARY_SORTS
+
+class InMemoryRequest(Request):
+    """Keep uploaded files in memory (bounded by MAX_CONTENT_LENGTH) instead of spooling large ones to temp files"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
 
 app = Flask(__name__, 
             template_folder='../frontend/templates',
             static_folder='../frontend/static')
+app.request_class = InMemoryRequest
 CORS(app)
 
 # Configuration
 app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max-limit
-
-# Global storage for issue selections (in production, use a proper database)
-issue_selections = {}
+# Number of worker processes used to compare screens of a bulk upload in parallel
+app.config['BULK_MAX_WORKERS'] = int(os.environ.get('BULK_MAX_WORKERS', os.cpu_count() or 1))
+# Number of threads running queued comparison jobs (submitted with async=true)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+# Seconds between job status checks when streaming progress events
+app.config['JOB_EVENTS_POLL_INTERVAL'] = 0.5
+# Content-addressed cache of comparison results, evicted LRU beyond the size limit
+app.config['RESULT_CACHE_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'cache', 'results')
+app.config['RESULT_CACHE_MAX_BYTES'] = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# Last comparison of each session's screens, reused by incremental re-comparisons
+app.config['BASELINE_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'baselines')
+# Figma file metadata and rendered frames, keyed by the file version
+app.config['FIGMA_CACHE_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'cache', 'figma')
+# Seconds a successful Figma token validation is reused
+app.config['FIGMA_TOKEN_TTL'] = int(os.environ.get('FIGMA_TOKEN_TTL', 300))
+# Issue selections of each session, shared by all server processes
+app.config['SELECTION_DB'] = os.path.join(app.config['UPLOAD_FOLDER'], 'db', 'selections.sqlite3')
+# Seconds a session's selections are kept after their last update
+app.config['SELECTION_TTL'] = int(os.environ.get('SELECTION_TTL', 7 * 24 * 3600))
+# Comparisons, screens and detected differences of every session
+app.config['RESULTS_DB'] = os.path.join(app.config['UPLOAD_FOLDER'], 'db', 'results.sqlite3')
+# Upload folder quotas: all session, bulk, baseline and Figma image files, and each session's directory
+app.config['STORAGE_MAX_BYTES'] = int(os.environ.get('STORAGE_MAX_BYTES', 5 * 1024 ** 3))
+app.config['STORAGE_SESSION_MAX_BYTES'] = int(os.environ.get('STORAGE_SESSION_MAX_BYTES', 256 * 1024 ** 2))
+# Seconds before unused session files, finished job records and stored comparison
+# history are deleted, and between garbage collection passes
+app.config['STORAGE_MAX_AGE'] = int(os.environ.get('STORAGE_MAX_AGE', 7 * 24 * 3600))
+app.config['STORAGE_GC_INTERVAL'] = int(os.environ.get('STORAGE_GC_INTERVAL', 600))
+# Requests slower than this many milliseconds are profiled and their profile kept (0 disables it);
+# requests sending an X-Debug-Profile header are always profiled
+app.config['PROFILE_THRESHOLD_MS'] = int(os.environ.get('PROFILE_THRESHOLD_MS', 0))
+app.config['PROFILE_DIR'] = os.path.join(app.config['UPLOAD_FOLDER'], 'profiles')
+# Number of most recent profiles kept
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 200))
+# Empty directory shared by the server's worker processes, so /metrics reports their sum
+# (python main.py sets one up for gunicorn); unset, /metrics reports the answering process
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR') or None
+# Seconds between writes of each process's metrics to METRICS_DIR
+app.config['METRICS_FLUSH_INTERVAL'] = int(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+selection_store = SelectionStore(app.config['SELECTION_DB'], app.config['SELECTION_TTL'])
+results_db = ResultsDB(app.config['RESULTS_DB'])
+storage = StorageManager(
+    app.config['UPLOAD_FOLDER'], app.config['STORAGE_MAX_BYTES'],
+    app.config['STORAGE_SESSION_MAX_BYTES'], app.config['STORAGE_MAX_AGE'],
+    app.config['STORAGE_GC_INTERVAL'])
+result_cache = ResultCache(app.config['RESULT_CACHE_DIR'], app.config['RESULT_CACHE_MAX_BYTES'])
+baseline_store = BaselineStore(app.config['BASELINE_DIR'])
+profile_store = ProfileStore(app.config['PROFILE_DIR'], app.config['PROFILE_KEEP'])
+
+# Writes uploaded originals to disk after the comparison, off the request's critical path
+persist_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='persist')
+
+# Request, stage and comparison metrics, served by /metrics
+metrics = MetricsRegistry(app.config['METRICS_DIR'], app.config['METRICS_FLUSH_INTERVAL'])
+http_requests = metrics.counter(
+    'http_requests_total', 'HTTP requests handled, by route and status', ('method', 'route', 'status'))
+http_duration = metrics.histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests', ('method', 'route'))
+stage_duration = metrics.histogram(
+    'stage_duration_seconds', 'Time spent in each comparison and Figma stage', ('stage',))
+comparisons_total = metrics.counter('comparisons_total', 'Screens compared, by upload kind', ('kind',))
+comparison_differences = metrics.histogram(
+    'comparison_differences', 'Differences (contours) detected per compared screen',
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000))
+metrics.callback_counter(
+    'result_cache_lookups_total', 'Comparison result cache lookups, by outcome', ('result',),
+    lambda: {('hit',): result_cache.hits, ('miss',): result_cache.misses})
+
+
+def _figma_api_errors():
+    transport_module = sys.modules.get('ml.figma_transport')
+    if transport_module is None:
+        # Nothing in this process has called Figma yet; scraping should not load requests
+        return {('network',): 0}
+    stats = transport_module.get_default_transport().stats()
+    errors = {(status,): count for status, count in stats['status_counts'].items() if int(status) >= 400}
+    errors[('network',)] = stats['network_errors']
+    return errors
+
+
+metrics.callback_counter(
+    'figma_api_errors_total', 'Failed Figma HTTP requests, by status code or network', ('status',),
+    _figma_api_errors)
+set_stage_observer(lambda name, seconds: stage_duration.observe(seconds, stage=name))
+
+
+def _count_comparison(kind, comparison_result):
+    comparisons_total.inc(kind=kind)
+    comparison_differences.observe(comparison_result['total_differences'])
+
+
+def _wants_timings():
+    """Whether the client asked for a per-stage timing breakdown in the JSON response"""
+    value = request.values.get('timings') or request.headers.get('X-Debug-Timings', '')
+    return value.lower() in ('1', 'true', 'yes')
+
+
+@app.before_request
+def start_background_workers():
+    # Started by the first request of each process rather than at import, so that
+    # server workers forked after importing the app run their own threads. This
+    # also recovers jobs a previous run left queued.
+    job_queue.start()
+    storage.start()
+    metrics.start()
+
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    if _wants_timings():
+        g.stage_timings, g.stage_token = start_recording()
+
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_requests.inc(method=request.method, route=route, status=response.status_code)
+    http_duration.observe(elapsed, method=request.method, route=route)
+
+    timings = g.get('stage_timings')
+    if timings is not None and response.is_json and not response.is_streamed:
+        data = response.get_json(silent=True)
+        if isinstance(data, dict):
+            data['timings'] = {
+                'total_ms': round(elapsed * 1000, 2),
+                'stages': {name: round(seconds * 1000, 2) for name, seconds in timings.items()}
+            }
+            response.set_data(app.json.dumps(data))
+    return response
+
+
+@app.teardown_request
+def stop_request_timing(_error):
+    if 'stage_token' in g:
+        stop_recording(g.pop('stage_token'))
+
+
+def _wants_profile():
+    """Whether the client asked for this request to be profiled whatever its duration"""
+    return request.headers.get('X-Debug-Profile', '').lower() in ('1', 'true', 'yes')
+
+
+@app.before_request
+def start_request_profile():
+    # Requests cannot be profiled after the fact, so with a threshold all of them are
+    # profiled and only the slow ones kept
+    if app.config['PROFILE_THRESHOLD_MS'] > 0 or _wants_profile():
+        g.profiler = profile_store.start()
+
+
+@app.after_request
+def save_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profile_store.stop(profiler)
+
+    elapsed_ms = (time.perf_counter() - g.request_start) * 1000
+    forced = _wants_profile()
+    if not forced and elapsed_ms < app.config['PROFILE_THRESHOLD_MS']:
+        return response
+
+    session_id = (request.view_args or {}).get('session_id') or request.values.get('session_id')
+    if session_id is None and response.is_json and not response.is_streamed:
+        data = response.get_json(silent=True)
+        session_id = data.get('session_id') if isinstance(data, dict) else None
+    profile_id = profile_store.save(profiler, {
+        'method': request.method,
+        'route': request.url_rule.rule if request.url_rule else 'unmatched',
+        'path': request.path,
+        'status': response.status_code,
+        'elapsed_ms': round(elapsed_ms, 2),
+        'session_id': session_id,
+        'reason': 'header' if forced else 'threshold'
+    })
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+@app.teardown_request
+def stop_request_profile(_error):
+    # A request that failed before its after_request hooks still frees the profiler
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profile_store.stop(profiler)
 
 
 @app.route('/')
@@ -45,6 +255,7 @@ def test_figma_connection():
             return jsonify({'error': 'Missing token or file key'}), 400
         
         # Initialize Figma service
+        from ml.figma_service import FigmaService
         figma_service = FigmaService(figma_token)
         
         # Test token
@@ -85,6 +296,413 @@ def test_figma_connection():
         }), 500
 
 
+def _wants_async():
+    """Whether the client asked for the comparison to run as a background job"""
+    return request.form.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def _wants_incremental():
+    """Whether the client asked for a re-comparison against the screen's stored baseline"""
+    return request.form.get('incremental', '').lower() in ('1', 'true', 'yes')
+
+
+def _wants_saved_originals():
+    """Whether the client asked for the uploaded originals to be kept on disk"""
+    return request.form.get('save_originals', '').lower() in ('1', 'true', 'yes')
+
+
+def _write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _persist_in_background(files):
+    """Write (path, bytes) pairs to disk on the persist executor"""
+    for path, data in files:
+        persist_executor.submit(_write_file, path, data)
+
+
+def _upload_reader():
+    """Return a function reading an uploaded file's bytes once, however often a field is referenced"""
+    contents = {}
+
+    def read(field_name):
+        if field_name not in contents:
+            contents[field_name] = request.files[field_name].read()
+        return contents[field_name]
+
+    return read
+
+
+def _job_accepted(job_id):
+    """Response returned by submit endpoints when the work was queued as a job"""
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/jobs/{job_id}',
+        'result_url': f'/jobs/{job_id}/result',
+        'events_url': f'/jobs/{job_id}/events'
+    }), 202
+
+
+def _comparison_options():
+    """Read the comparison parameters shared by all upload routes from the form"""
+    from ml.image_comparison import (
+        RESIZE_MODES, RENDER_MODES, SSIM_MODES, ENGINES, ALIGN_MODES, DEFAULT_MIN_CONTOUR_AREA)
+    from ml.prefilter import PREFILTER_MODES, DEFAULT_MAX_HASH_DISTANCE
+
+    resize_mode = request.form.get('resize_mode', 'stretch')
+    if resize_mode not in RESIZE_MODES:
+        raise ValueError(f"resize_mode must be one of: {', '.join(RESIZE_MODES)}")
+    render = request.form.get('render', 'full')
+    if render not in RENDER_MODES:
+        raise ValueError(f"render must be one of: {', '.join(RENDER_MODES)}")
+    ssim_mode = request.form.get('ssim_mode', 'full')
+    if ssim_mode not in SSIM_MODES:
+        raise ValueError(f"ssim_mode must be one of: {', '.join(SSIM_MODES)}")
+    engine = request.form.get('engine', 'frame')
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of: {', '.join(ENGINES)}")
+    if engine == 'tiled' and ssim_mode != 'full':
+        raise ValueError("The tiled engine only supports ssim_mode full")
+    align = request.form.get('align', 'none')
+    if align not in ALIGN_MODES:
+        raise ValueError(f"align must be one of: {', '.join(ALIGN_MODES)}")
+    prefilter = request.form.get('prefilter', 'none')
+    if prefilter not in PREFILTER_MODES:
+        raise ValueError(f"prefilter must be one of: {', '.join(PREFILTER_MODES)}")
+    prefilter_distance = int(request.form.get('prefilter_distance', DEFAULT_MAX_HASH_DISTANCE))
+    if prefilter_distance < 0:
+        raise ValueError("prefilter_distance must not be negative")
+    return {
+        'min_contour_area': int(request.form.get('min_contour_area', DEFAULT_MIN_CONTOUR_AREA)),
+        'resize_mode': resize_mode,
+        'render': render,
+        'ssim_mode': ssim_mode,
+        'engine': engine,
+        'align': align,
+        'prefilter': prefilter,
+        'prefilter_distance': prefilter_distance
+    }
+
+
+def _renders_later(options):
+    """Whether annotated images may be rendered after the request, from the originals on disk"""
+    # Pairs skipped by the prefilter leave all their images to the deferred renderer
+    return options['render'] != 'full' or options['prefilter'] != 'none'
+
+
+def _json_field(name, value):
+    """Decode a JSON form value; an empty or missing field means not given"""
+    if not isinstance(value, str):
+        return value
+    if not value.strip():
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        raise ValueError(f"{name} must be valid JSON")
+
+
+def _mask_options(roi, ignore_regions, ignore_mask=None):
+    """Validate a region of interest and ignore rectangles, given as JSON strings or lists"""
+    from ml.image_comparison import validate_box
+
+    roi = _json_field('roi', roi)
+    ignore_regions = _json_field('ignore_regions', ignore_regions)
+    if ignore_regions is not None and not isinstance(ignore_regions, list):
+        raise ValueError("ignore_regions must be a list of [x, y, width, height] rectangles")
+    return {
+        'roi': None if roi is None else list(validate_box(roi)),
+        'ignore_regions': [list(validate_box(region)) for region in ignore_regions]
+                          if ignore_regions else None,
+        'ignore_mask': ignore_mask
+    }
+
+
+def _is_mask_error(error):
+    """Whether a comparison failed on a region of interest or ignore mask that does not fit the image"""
+    comparison_module = sys.modules.get('ml.image_comparison')
+    # Only a loaded comparison module can have raised one
+    return comparison_module is not None and isinstance(error, comparison_module.MaskError)
+
+
+def _form_masks(comparison_dir):
+    """
+    Read the roi, ignore_regions and ignore_mask fields of an upload form.
+
+    An uploaded mask image is saved in comparison_dir so queued jobs can read it back.
+    """
+    masks = _mask_options(request.form.get('roi'), request.form.get('ignore_regions'))
+    mask_image = request.files.get('ignore_mask')
+    if mask_image and mask_image.filename:
+        masks['ignore_mask'] = os.path.join(
+            comparison_dir, secure_filename(f'ignore_mask_{mask_image.filename}'))
+        mask_image.save(masks['ignore_mask'])
+    return masks
+
+
+def _bulk_masks(comparison_dir, read_upload):
+    """
+    Read the masks of a bulk upload, reused by every screen of the same name.
+
+    The form-wide roi, ignore_regions and ignore_mask fields apply to all
+    screens. The optional masks field is a JSON object keyed by screen name
+    whose entries (roi, ignore_regions, and ignore_mask naming an uploaded
+    mask image) replace them for the screens of that name.
+
+    Returns:
+        tuple: (default_masks, masks_by_screen_name)
+    """
+    default_masks = _form_masks(comparison_dir)
+    masks_by_name = {}
+    entries = _json_field('masks', request.form.get('masks')) or {}
+    if not isinstance(entries, dict):
+        raise ValueError("masks must be a JSON object keyed by screen name")
+    for name, entry in entries.items():
+        if not isinstance(entry, dict):
+            raise ValueError(f"Masks of screen {name} must be a JSON object")
+        mask_path = None
+        if entry.get('ignore_mask'):
+            if entry['ignore_mask'] not in request.files:
+                raise ValueError(f"Missing mask image {entry['ignore_mask']} for screen {name}")
+            mask_path = os.path.join(comparison_dir, secure_filename(f'{name}_mask.png'))
+            _write_file(mask_path, read_upload(entry['ignore_mask']))
+        masks_by_name[name] = _mask_options(entry.get('roi'), entry.get('ignore_regions'), mask_path)
+    return default_masks, masks_by_name
+
+
+def cached_compare(figma_source, built_source, comparison_dir, options, name_prefix=''):
+    """
+    Compare two images, reusing the cached result of an identical earlier comparison.
+
+    Each image is a file path or the encoded bytes of an upload. When the
+    render option defers images, both must be file paths: the deferred
+    renderer reads them back on the first request for an image.
+    """
+    from ml.image_comparison import compare_images
+
+    cache_key = result_cache.make_key(figma_source, built_source, **options)
+    with stage('cache'):
+        comparison_result = result_cache.get(cache_key, comparison_dir, name_prefix)
+    if comparison_result is not None:
+        comparison_result['cache_hit'] = True
+    else:
+        comparison_result = compare_images(
+            figma_source, built_source, comparison_dir, name_prefix=name_prefix, **options)
+        result_cache.put(cache_key, comparison_result)
+        comparison_result['cache_hit'] = False
+    defer_rendering(comparison_result, figma_source, built_source)
+    return comparison_result
+
+
+def incremental_compare(session_id, screen_name, figma_source, built_source, comparison_dir, options):
+    """
+    Re-compare a screen against its stored baseline, then make this comparison its new baseline.
+
+    Bypasses the result cache: the reported resolved, persisted and
+    introduced issues depend on the baseline, not only on the inputs.
+    """
+    from ml.incremental_comparison import compare_incremental
+
+    session_key = secure_filename(session_id) or 'default'
+    # Concurrent re-comparisons of the screen would otherwise diff against the same baseline
+    with baseline_store.locked(session_key, screen_name):
+        baseline = baseline_store.load(session_key, screen_name)
+        comparison_result, new_baseline = compare_incremental(
+            figma_source, built_source, comparison_dir, baseline, **options)
+        baseline_store.save(session_key, screen_name, new_baseline)
+    defer_rendering(comparison_result, figma_source, built_source)
+    return comparison_result
+
+
+def _relative_image_paths(comparison_result):
+    """Convert absolute image paths to paths relative to the upload folder for the frontend"""
+    for key in ('figma_image', 'built_image', 'difference_image', 'comparison_image'):
+        comparison_result[key] = os.path.relpath(comparison_result[key], app.config['UPLOAD_FOLDER'])
+    return comparison_result
+
+
+def run_single_comparison(session_id, figma_source, built_source, comparison_dir, options,
+                          screen_name='default', incremental=False):
+    """
+    Compare two screenshots (paths or bytes) and record the differences for the session.
+
+    With incremental the comparison reuses the stored baseline of the screen.
+    """
+    if incremental:
+        comparison_result = incremental_compare(
+            session_id, screen_name, figma_source, built_source, comparison_dir, options)
+    else:
+        comparison_result = cached_compare(figma_source, built_source, comparison_dir, options)
+    _count_comparison('single', comparison_result)
+    comparison_result['session_id'] = session_id
+    comparison_result['comparison_id'] = results_db.record(
+        session_id, 'single', [(screen_name, comparison_result)])
+    return _relative_image_paths(comparison_result)
+
+
+def run_figma_comparison(session_id, figma_token, figma_file_key, figma_node_id, built_source,
+                         comparison_dir, options, screen_name='default'):
+    """Fetch a Figma design, compare it with a screenshot (path or bytes) and record the differences"""
+    from ml.figma_service import fetch_figma_design
+
+    with stage('figma'):
+        figma_success, figma_result = fetch_figma_design(
+            figma_token, 
+            figma_file_key, 
+            figma_node_id if figma_node_id else None,
+            comparison_dir,
+            cache_dir=app.config['FIGMA_CACHE_DIR'],
+            token_ttl=app.config['FIGMA_TOKEN_TTL']
+        )
+
+    if not figma_success:
+        raise RuntimeError(f'Failed to fetch Figma design: {figma_result}')
+
+    comparison_result = cached_compare(figma_result, built_source, comparison_dir, options)
+    _count_comparison('figma', comparison_result)
+    comparison_result['session_id'] = session_id
+    comparison_result['comparison_id'] = results_db.record(
+        session_id, 'figma', [(screen_name, comparison_result)])
+    return _relative_image_paths(comparison_result)
+
+
+def run_bulk_screens(session_id, results, tasks, task_indexes, progress_callback=None):
+    """
+    Compare the screens of a bulk upload, record their differences and build the bulk response.
+
+    Args:
+        session_id (str): Session the comparison is recorded under
+        results (list): One slot per screen, pre-filled with errors for invalid screens
+        tasks (list): Comparison tasks for the valid screens
+        task_indexes (list): Position in results of each task
+        progress_callback (callable, optional): Called as progress_callback(completed, total)
+    """
+    from ml.bulk_comparison import run_bulk_comparison, task_sources
+
+    total = len(results)
+    start = time.perf_counter()
+
+    # Serve unchanged screens from the result cache and only compare the rest
+    pending_tasks = []
+    pending = []
+    for index, task in zip(task_indexes, tasks):
+        lookup_start = time.perf_counter()
+        cache_key = result_cache.make_key(*task_sources(task), **task['options'])
+        with stage('cache'):
+            cached_result = result_cache.get(cache_key, task['output_dir'], task['name_prefix'])
+        if cached_result is None:
+            pending_tasks.append(task)
+            pending.append((index, cache_key))
+            continue
+        cached_result.update({
+            'status': 'success',
+            'cache_hit': True,
+            'screen_name': task['name'],
+            'elapsed_ms': round((time.perf_counter() - lookup_start) * 1000, 2)
+        })
+        defer_rendering(cached_result, task.get('figma_path'), task.get('built_path'))
+        results[index] = _relative_image_paths(cached_result)
+
+    done_before = total - len(pending_tasks)
+    if progress_callback:
+        progress_callback(done_before, total)
+
+    def on_screen_done(completed, _task_total, _result):
+        if progress_callback:
+            progress_callback(done_before + completed, total)
+
+    task_results = run_bulk_comparison(
+        pending_tasks, app.config['BULK_MAX_WORKERS'], progress_callback=on_screen_done)
+
+    for (index, cache_key), task, comparison_result in zip(pending, pending_tasks, task_results):
+        if comparison_result['status'] == 'success':
+            result_cache.put(cache_key, comparison_result)
+            comparison_result['cache_hit'] = False
+            defer_rendering(comparison_result, task.get('figma_path'), task.get('built_path'))
+            _relative_image_paths(comparison_result)
+        results[index] = comparison_result
+
+    for result in results:
+        if result['status'] == 'success':
+            _count_comparison('bulk', result)
+
+    failed = sum(1 for result in results if result['status'] != 'success')
+    comparison_id = results_db.record(
+        session_id, 'bulk',
+        [(result['screen_name'], result) for result in results if result['status'] == 'success'])
+
+    return {
+        'session_id': session_id,
+        'comparison_id': comparison_id,
+        'results': results,
+        'total_screens': total,
+        'successful': total - failed,
+        'failed': failed,
+        'cache_hits': sum(1 for result in results if result.get('cache_hit')),
+        'short_circuited': sum(1 for result in results if 'prefilter' in result),
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+    }
+
+
+def run_figma_bulk_screens(session_id, figma_token, figma_file_key, results, screens,
+                           bulk_comparison_dir, options, progress_callback=None):
+    """
+    Export the Figma frames of a bulk upload in one batch and compare each with its screenshot.
+
+    Args:
+        results (list): One slot per screen, pre-filled with errors for invalid screens
+        screens (list): Valid screens with index, name, figma_node_id, the
+            screenshot as built_path or built_bytes, and optionally their own options
+    """
+    from ml.figma_service import fetch_figma_designs
+
+    if not screens:
+        return run_bulk_screens(session_id, results, [], [], progress_callback)
+
+    with stage('figma'):
+        figma_success, designs = fetch_figma_designs(
+            figma_token,
+            figma_file_key,
+            [screen['figma_node_id'] for screen in screens],
+            bulk_comparison_dir,
+            cache_dir=app.config['FIGMA_CACHE_DIR'],
+            token_ttl=app.config['FIGMA_TOKEN_TTL']
+        )
+
+    if not figma_success:
+        raise RuntimeError(f'Failed to fetch Figma designs: {designs}')
+
+    tasks = []
+    task_indexes = []
+    for screen in screens:
+        design_success, design_result = designs[screen['figma_node_id']]
+        if not design_success:
+            results[screen['index']] = {
+                'status': 'error',
+                'error': f'Failed to fetch Figma design: {design_result}',
+                'screen_name': screen['name'],
+                'elapsed_ms': 0
+            }
+            continue
+        task = {
+            'name': screen['name'],
+            'figma_path': design_result,
+            'output_dir': bulk_comparison_dir,
+            'name_prefix': secure_filename(f"{screen['index']}_{screen['name']}") + '_',
+            'options': screen.get('options', options)
+        }
+        if 'built_bytes' in screen:
+            task['built_bytes'] = screen['built_bytes']
+        else:
+            task['built_path'] = screen['built_path']
+        tasks.append(task)
+        task_indexes.append(screen['index'])
+
+    return run_bulk_screens(session_id, results, tasks, task_indexes, progress_callback)
+
+
 @app.route('/upload', methods=['POST'])
 def upload_files():
     try:
@@ -92,9 +710,8 @@ def upload_files():
             return jsonify({'error': 'Missing session ID'}), 400
 
         session_id = request.form['session_id']
-        single_comparison_dir = os.path.join(
-            app.config['UPLOAD_FOLDER'], 'single_comparisons', session_id)
-        os.makedirs(single_comparison_dir, exist_ok=True)
+        single_comparison_dir = storage.session_dir(
+            'single_comparisons', secure_filename(session_id) or 'default')
 
         # Debug logging removed for production
 
@@ -119,31 +736,54 @@ def upload_files():
         figma_path = os.path.join(single_comparison_dir, figma_filename)
         built_path = os.path.join(single_comparison_dir, built_filename)
 
-        figma_image.save(figma_path)
-        built_image.save(built_path)
+        try:
+            options = _comparison_options()
+            options.update(_form_masks(single_comparison_dir))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        comparison_result = compare_images(
-            figma_path, built_path, single_comparison_dir)
+        screen_name = secure_filename(request.form.get('screen_name', '')) or 'default'
+        incremental = _wants_incremental()
+        if incremental and (options['engine'] != 'frame' or options['ssim_mode'] != 'full'):
+            return jsonify({'error': 'incremental comparisons use engine frame and ssim_mode full'}), 400
 
-        comparison_result['session_id'] = session_id
-        
-        # Save detected differences to JSON file for code correction
-        differences_file = os.path.join(single_comparison_dir, 'differences.json')
-        with open(differences_file, 'w') as f:
-            json.dump({
-                'detected_differences': comparison_result.get('detected_differences', []),
-                'total_differences': comparison_result.get('total_differences', 0)
-            }, f, indent=2)
-        
-        # Convert absolute paths to relative paths for the frontend
-        comparison_result['figma_image'] = os.path.relpath(comparison_result['figma_image'], app.config['UPLOAD_FOLDER'])
-        comparison_result['built_image'] = os.path.relpath(comparison_result['built_image'], app.config['UPLOAD_FOLDER'])
-        comparison_result['difference_image'] = os.path.relpath(comparison_result['difference_image'], app.config['UPLOAD_FOLDER'])
-        comparison_result['comparison_image'] = os.path.relpath(comparison_result['comparison_image'], app.config['UPLOAD_FOLDER'])
+        if _wants_async():
+            # Queued jobs outlive the request, so their inputs must be on disk
+            figma_image.save(figma_path)
+            built_image.save(built_path)
+            job_id = job_queue.submit('single', {
+                'session_id': session_id,
+                'figma_path': figma_path,
+                'built_path': built_path,
+                'comparison_dir': single_comparison_dir,
+                'options': options,
+                'screen_name': screen_name,
+                'incremental': incremental
+            })
+            return _job_accepted(job_id)
+
+        if _renders_later(options):
+            # The deferred renderer reads the originals back on first request
+            figma_image.save(figma_path)
+            built_image.save(built_path)
+            comparison_result = run_single_comparison(
+                session_id, figma_path, built_path, single_comparison_dir, options, screen_name, incremental)
+            return jsonify(comparison_result)
+
+        # Compare straight from the upload buffers, no disk round-trip
+        figma_bytes = figma_image.read()
+        built_bytes = built_image.read()
+        if _wants_saved_originals():
+            _persist_in_background([(figma_path, figma_bytes), (built_path, built_bytes)])
+
+        comparison_result = run_single_comparison(
+            session_id, figma_bytes, built_bytes, single_comparison_dir, options, screen_name, incremental)
 
         return jsonify(comparison_result)
 
     except Exception as e:
+        if _is_mask_error(e):
+            return jsonify({'error': str(e)}), 400
         # Error handling
         return jsonify({'error': str(e)}), 500
 
@@ -155,9 +795,8 @@ def figma_upload():
             return jsonify({'error': 'Missing session ID'}), 400
 
         session_id = request.form['session_id']
-        figma_comparison_dir = os.path.join(
-            app.config['UPLOAD_FOLDER'], 'figma_comparisons', session_id)
-        os.makedirs(figma_comparison_dir, exist_ok=True)
+        figma_comparison_dir = storage.session_dir(
+            'figma_comparisons', secure_filename(session_id) or 'default')
 
         # Get Figma credentials
         figma_token = request.form.get('figma_token')
@@ -175,45 +814,47 @@ def figma_upload():
         if built_image.filename == '':
             return jsonify({'error': 'Empty built image filename'}), 400
 
-        # Fetch Figma design
-        figma_success, figma_result = fetch_figma_design(
-            figma_token, 
-            figma_file_key, 
-            figma_node_id if figma_node_id else None,
-            figma_comparison_dir
-        )
-
-        if not figma_success:
-            return jsonify({'error': f'Failed to fetch Figma design: {figma_result}'}), 500
+        try:
+            options = _comparison_options()
+            options.update(_form_masks(figma_comparison_dir))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Save built image
         built_filename = secure_filename(built_image.filename)
         built_path = os.path.join(figma_comparison_dir, built_filename)
-        built_image.save(built_path)
+        screen_name = secure_filename(request.form.get('screen_name', '')) or 'default'
+
+        if _wants_async() or _renders_later(options):
+            # Queued jobs and the deferred renderer read the built image back later
+            built_image.save(built_path)
+        if _wants_async():
+            job_id = job_queue.submit('figma', {
+                'session_id': session_id,
+                'figma_file_key': figma_file_key,
+                'figma_node_id': figma_node_id,
+                'built_path': built_path,
+                'comparison_dir': figma_comparison_dir,
+                'options': options,
+                'screen_name': screen_name
+            }, secrets={'figma_token': figma_token})
+            return _job_accepted(job_id)
+
+        if _renders_later(options):
+            built_source = built_path
+        else:
+            built_source = built_image.read()
+            if _wants_saved_originals():
+                _persist_in_background([(built_path, built_source)])
 
-        # Compare images
-        comparison_result = compare_images(
-            figma_result, built_path, figma_comparison_dir)
-
-        comparison_result['session_id'] = session_id
-        
-        # Save detected differences to JSON file for code correction
-        differences_file = os.path.join(figma_comparison_dir, 'differences.json')
-        with open(differences_file, 'w') as f:
-            json.dump({
-                'detected_differences': comparison_result.get('detected_differences', []),
-                'total_differences': comparison_result.get('total_differences', 0)
-            }, f, indent=2)
-        
-        # Convert absolute paths to relative paths for the frontend
-        comparison_result['figma_image'] = os.path.relpath(comparison_result['figma_image'], app.config['UPLOAD_FOLDER'])
-        comparison_result['built_image'] = os.path.relpath(comparison_result['built_image'], app.config['UPLOAD_FOLDER'])
-        comparison_result['difference_image'] = os.path.relpath(comparison_result['difference_image'], app.config['UPLOAD_FOLDER'])
-        comparison_result['comparison_image'] = os.path.relpath(comparison_result['comparison_image'], app.config['UPLOAD_FOLDER'])
+        comparison_result = run_figma_comparison(
+            session_id, figma_token, figma_file_key, figma_node_id,
+            built_source, figma_comparison_dir, options, screen_name)
 
         return jsonify(comparison_result)
 
     except Exception as e:
+        if _is_mask_error(e):
+            return jsonify({'error': str(e)}), 400
         # Error handling
         return jsonify({'error': str(e)}), 500
 
@@ -225,19 +866,41 @@ def bulk_upload_files():
             return jsonify({'error': 'Missing screens data'}), 400
 
         screens = json.loads(request.form['screens'])
-        now = datetime.now()
-        bulk_comparison_dir = os.path.join(
-            app.config['UPLOAD_FOLDER'], 'bulk_comparisons', now.strftime("%Y%m%d_%H%M%S"))
-        os.makedirs(bulk_comparison_dir, exist_ok=True)
 
-        results = []
+        try:
+            options = _comparison_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        for screen in screens:
+        now = datetime.now()
+        bulk_comparison_dir = storage.session_dir('bulk_comparisons', now.strftime("%Y%m%d_%H%M%S"))
+        session_id = request.form.get('session_id') or f'bulk_{os.path.basename(bulk_comparison_dir)}'
+
+        results = [None] * len(screens)
+        tasks = []
+        task_indexes = []
+        run_async = _wants_async()
+        # Queued jobs and deferred rendering read the inputs back later
+        inputs_on_disk = run_async or _renders_later(options)
+        save_originals = _wants_saved_originals()
+        read_upload = _upload_reader()
+        try:
+            default_masks, screen_masks = _bulk_masks(bulk_comparison_dir, read_upload)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        for index, screen in enumerate(screens):
             figma_image = request.files.get(screen['figma_screenshot'])
             app_image = request.files.get(screen['app_screenshot'])
 
             if not figma_image or not app_image:
-                return jsonify({'error': f"Missing image for screen {screen['name']}"}), 400
+                results[index] = {
+                    'status': 'error',
+                    'error': f"Missing image for screen {screen['name']}",
+                    'screen_name': screen['name'],
+                    'elapsed_ms': 0
+                }
+                continue
 
             figma_filename = secure_filename(f"{screen['name']}_figma.png")
             app_filename = secure_filename(f"{screen['name']}_app.png")
@@ -245,27 +908,222 @@ def bulk_upload_files():
             figma_path = os.path.join(bulk_comparison_dir, figma_filename)
             app_path = os.path.join(bulk_comparison_dir, app_filename)
 
-            figma_image.save(figma_path)
-            app_image.save(app_path)
+            figma_bytes = read_upload(screen['figma_screenshot'])
+            app_bytes = read_upload(screen['app_screenshot'])
+
+            task = {
+                'name': screen['name'],
+                'output_dir': bulk_comparison_dir,
+                'name_prefix': secure_filename(f"{index}_{screen['name']}") + '_',
+                'options': {**options, **screen_masks.get(screen['name'], default_masks)}
+            }
+            if inputs_on_disk:
+                _write_file(figma_path, figma_bytes)
+                _write_file(app_path, app_bytes)
+                task['figma_path'] = figma_path
+                task['built_path'] = app_path
+            else:
+                task['figma_bytes'] = figma_bytes
+                task['built_bytes'] = app_bytes
+                if save_originals:
+                    _persist_in_background([(figma_path, figma_bytes), (app_path, app_bytes)])
+            tasks.append(task)
+            task_indexes.append(index)
+
+        if run_async:
+            job_id = job_queue.submit('bulk', {
+                'session_id': session_id,
+                'results': results,
+                'tasks': tasks,
+                'task_indexes': task_indexes
+            })
+            return _job_accepted(job_id)
+
+        return jsonify(run_bulk_screens(session_id, results, tasks, task_indexes))
 
-            comparison_result = compare_images(
-                figma_path, app_path, bulk_comparison_dir)
-            comparison_result['screen_name'] = screen['name']
-            
-            # Convert absolute paths to relative paths for the frontend
-            comparison_result['figma_image'] = os.path.relpath(comparison_result['figma_image'], app.config['UPLOAD_FOLDER'])
-            comparison_result['built_image'] = os.path.relpath(comparison_result['built_image'], app.config['UPLOAD_FOLDER'])
-            comparison_result['difference_image'] = os.path.relpath(comparison_result['difference_image'], app.config['UPLOAD_FOLDER'])
-            comparison_result['comparison_image'] = os.path.relpath(comparison_result['comparison_image'], app.config['UPLOAD_FOLDER'])
-            
-            results.append(comparison_result)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/figma_bulk_upload', methods=['POST'])
+def figma_bulk_upload():
+    """Compare many Figma frames of one file with their app screenshots"""
+    try:
+        figma_token = request.form.get('figma_token')
+        figma_file_key = request.form.get('figma_file_key')
+
+        if not figma_token or not figma_file_key:
+            return jsonify({'error': 'Missing Figma token or file key'}), 400
+
+        if 'screens' not in request.form:
+            return jsonify({'error': 'Missing screens data'}), 400
+
+        screens = json.loads(request.form['screens'])
 
-        return jsonify(results)
+        try:
+            options = _comparison_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        now = datetime.now()
+        bulk_comparison_dir = storage.session_dir('bulk_comparisons', now.strftime("%Y%m%d_%H%M%S"))
+        session_id = request.form.get('session_id') or f'bulk_{os.path.basename(bulk_comparison_dir)}'
+
+        results = [None] * len(screens)
+        valid_screens = []
+        run_async = _wants_async()
+        # Queued jobs and deferred rendering read the inputs back later
+        inputs_on_disk = run_async or _renders_later(options)
+        save_originals = _wants_saved_originals()
+        read_upload = _upload_reader()
+        try:
+            default_masks, screen_masks = _bulk_masks(bulk_comparison_dir, read_upload)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        for index, screen in enumerate(screens):
+            app_image = request.files.get(screen.get('app_screenshot', ''))
+            figma_node_id = (screen.get('figma_node_id') or '').strip()
+
+            if not app_image or not figma_node_id:
+                results[index] = {
+                    'status': 'error',
+                    'error': f"Missing image or Figma node ID for screen {screen['name']}",
+                    'screen_name': screen['name'],
+                    'elapsed_ms': 0
+                }
+                continue
+
+            app_filename = secure_filename(f"{index}_{screen['name']}_app.png")
+            app_path = os.path.join(bulk_comparison_dir, app_filename)
+            app_bytes = read_upload(screen['app_screenshot'])
+
+            valid_screen = {
+                'index': index,
+                'name': screen['name'],
+                'figma_node_id': figma_node_id,
+                'options': {**options, **screen_masks.get(screen['name'], default_masks)}
+            }
+            if inputs_on_disk:
+                _write_file(app_path, app_bytes)
+                valid_screen['built_path'] = app_path
+            else:
+                valid_screen['built_bytes'] = app_bytes
+                if save_originals:
+                    _persist_in_background([(app_path, app_bytes)])
+            valid_screens.append(valid_screen)
+
+        if run_async:
+            job_id = job_queue.submit('figma_bulk', {
+                'session_id': session_id,
+                'figma_file_key': figma_file_key,
+                'results': results,
+                'screens': valid_screens,
+                'bulk_comparison_dir': bulk_comparison_dir,
+                'options': options
+            }, secrets={'figma_token': figma_token})
+            return _job_accepted(job_id)
+
+        return jsonify(run_figma_bulk_screens(
+            session_id, figma_token, figma_file_key, results, valid_screens, bulk_comparison_dir,
+            options))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get the status and progress of a background comparison job"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(public_job(job))
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Get the result of a finished background comparison job"""
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error'], 'job_id': job_id}), 500
+    if job['status'] != 'completed':
+        return jsonify(public_job(job)), 202
+    return jsonify(job['result'])
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Stream job progress as server-sent events until the job finishes"""
+    if not job_queue.get(job_id):
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        last_state = None
+        while True:
+            job = job_queue.get(job_id)
+            if not job:
+                yield 'event: error\ndata: {"error": "Job not found"}\n\n'
+                return
+            state = public_job(job)
+            if state != last_state:
+                event = 'done' if job['status'] in FINISHED_STATUSES else 'progress'
+                yield f'event: {event}\ndata: {json.dumps(state)}\n\n'
+                last_state = state
+            if job['status'] in FINISHED_STATUSES:
+                return
+            time.sleep(app.config['JOB_EVENTS_POLL_INTERVAL'])
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _single_job(payload, progress):
+    progress(0, 1)
+    result = run_single_comparison(
+        payload['session_id'], payload['figma_path'], payload['built_path'],
+        payload['comparison_dir'], payload['options'], payload['screen_name'],
+        payload['incremental'])
+    progress(1, 1)
+    return result
+
+
+def _figma_job(payload, progress):
+    progress(0, 1)
+    result = run_figma_comparison(
+        payload['session_id'], payload['figma_token'], payload['figma_file_key'],
+        payload['figma_node_id'], payload['built_path'], payload['comparison_dir'],
+        payload['options'], payload['screen_name'])
+    progress(1, 1)
+    return result
+
+
+def _bulk_job(payload, progress):
+    return run_bulk_screens(
+        payload['session_id'], payload['results'], payload['tasks'], payload['task_indexes'],
+        progress_callback=progress)
+
+
+def _figma_bulk_job(payload, progress):
+    return run_figma_bulk_screens(
+        payload['session_id'], payload['figma_token'], payload['figma_file_key'], payload['results'],
+        payload['screens'], payload['bulk_comparison_dir'], payload['options'],
+        progress_callback=progress)
+
+
+job_queue = JobQueue(os.path.join(app.config['UPLOAD_FOLDER'], 'jobs'), app.config['JOB_WORKERS'])
+job_queue.register('single', _single_job)
+job_queue.register('figma', _figma_job)
+job_queue.register('bulk', _bulk_job)
+job_queue.register('figma_bulk', _figma_bulk_job)
+
+# Job records and comparison history live outside the collected upload folders
+storage.add_collector('jobs', lambda: job_queue.purge(app.config['STORAGE_MAX_AGE']))
+storage.add_collector('comparisons', lambda: results_db.purge(app.config['STORAGE_MAX_AGE']))
+
+
 @app.route('/generate_code', methods=['POST'])
 def generate_code():
     """Generate complete code based on Figma design and selected language"""
@@ -283,16 +1141,7 @@ def generate_code():
             return jsonify({'error': 'Missing session ID'}), 400
         
         # Get the latest comparison data for this session
-        # Check both single_comparisons and figma_comparisons directories
-        single_comparison_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'single_comparisons', session_id)
-        figma_comparison_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'figma_comparisons', session_id)
-        
-        comparison_dir = None
-        if os.path.exists(single_comparison_dir):
-            comparison_dir = single_comparison_dir
-        elif os.path.exists(figma_comparison_dir):
-            comparison_dir = figma_comparison_dir
-        else:
+        if results_db.latest_comparison(session_id) is None:
             return jsonify({'error': 'No comparison data found for this session'}), 400
         
         # Generate code based on language
@@ -330,16 +1179,7 @@ def correct_code():
             return jsonify({'error': 'No existing code provided'}), 400
         
         # Get the detected differences for this session
-        # Check both single_comparisons and figma_comparisons directories
-        single_comparison_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'single_comparisons', session_id)
-        figma_comparison_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'figma_comparisons', session_id)
-        
-        comparison_dir = None
-        if os.path.exists(single_comparison_dir):
-            comparison_dir = single_comparison_dir
-        elif os.path.exists(figma_comparison_dir):
-            comparison_dir = figma_comparison_dir
-        else:
+        if results_db.latest_comparison(session_id) is None:
             return jsonify({'error': 'No comparison data found for this session'}), 400
         
         # Correct the code based on detected issues
@@ -810,92 +1650,81 @@ Please adapt this template to your specific {language} framework requirements.
 */'''
 
 
+def _neglected_ids(session_id):
+    """Ids of the issues the user neglected in a session"""
+    return [int(issue_id) for issue_id, selection in selection_store.get(session_id).items()
+            if selection == 'neglect' and issue_id.isdigit()]
+
+
 def correct_code_based_on_issues(language, existing_code, notes, session_id):
     """Correct existing code based on detected issues"""
     
-    # Get detected differences from the session
-    # Check both single_comparisons and figma_comparisons directories
-    single_comparison_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'single_comparisons', session_id)
-    figma_comparison_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'figma_comparisons', session_id)
-    
-    differences_file = None
-    if os.path.exists(single_comparison_dir):
-        differences_file = os.path.join(single_comparison_dir, 'differences.json')
-    elif os.path.exists(figma_comparison_dir):
-        differences_file = os.path.join(figma_comparison_dir, 'differences.json')
-    
     changes = []
     corrected_code = existing_code
     
     try:
-        if differences_file and os.path.exists(differences_file):
-            with open(differences_file, 'r') as f:
-                differences_data = json.load(f)
-                all_differences = differences_data.get('detected_differences', [])
-                
-                # Get user selections for this session
-                selections = issue_selections.get(session_id, {})
-                
-                # Filter out neglected issues
-                detected_differences = []
-                for diff in all_differences:
-                    diff_id = str(diff.get('id'))
-                    if selections.get(diff_id) != 'neglect':
-                        detected_differences.append(diff)
-                
-                if not detected_differences:
-                    if all_differences:
-                        changes.append(f"No issues selected for correction. {len(all_differences)} issues were neglected by the user.")
-                        corrected_code += f'''
+        # Detected differences of the session's latest comparison
+        comparison_id = results_db.latest_comparison(session_id)
+        if comparison_id is not None:
+            total_differences = results_db.count_differences(comparison_id)
+            
+            # Leave out the issues the user neglected
+            detected_differences = results_db.differences(
+                comparison_id, exclude_ids=_neglected_ids(session_id))
+            
+            if not detected_differences:
+                if total_differences:
+                    changes.append(f"No issues selected for correction. {total_differences} issues were neglected by the user.")
+                    corrected_code += f'''
 
 <!-- Code Review Complete -->
-<!-- {len(all_differences)} issues were detected but all were neglected by the user -->
+<!-- {total_differences} issues were detected but all were neglected by the user -->
 <!-- No corrections applied based on user preferences -->
 {notes if notes else '<!-- Consider reviewing the neglected issues if needed -->'}'''
-                    else:
-                        changes.append("No specific issues detected in the comparison. Your code appears to match the design well!")
-                        corrected_code += f'''
+                else:
+                    changes.append("No specific issues detected in the comparison. Your code appears to match the design well!")
+                    corrected_code += f'''
 
 <!-- Code Review Complete -->
 <!-- No specific issues were detected in the comparison -->
 <!-- Your implementation appears to match the design requirements -->
 {notes if notes else '<!-- Consider adding any additional improvements based on your requirements -->'}'''
-                else:
-                    changes.append(f"Applying corrections for {len(detected_differences)} selected issues (neglected {len(all_differences) - len(detected_differences)} issues)")
+            else:
+                changes.append(f"Applying corrections for {len(detected_differences)} selected issues (neglected {total_differences - len(detected_differences)} issues)")
+                
+                for diff in detected_differences:
+                    analysis = diff.get('issue_analysis', {})
+                    issue_type = analysis.get('issue_type', 'Unknown Issue')
                     
-                    for diff in detected_differences:
-                        analysis = diff.get('issue_analysis', {})
-                        issue_type = analysis.get('issue_type', 'Unknown Issue')
-                        
-                        if 'Missing' in issue_type:
-                            changes.append(f"Added missing {issue_type.lower()} at position {diff.get('location', 'unknown')}")
-                            # Add placeholder for missing element
-                            if language in ['html-css', 'react', 'vue', 'angular']:
-                                placeholder = f'''
+                    if 'Missing' in issue_type:
+                        changes.append(f"Added missing {issue_type.lower()} at position {diff.get('location', 'unknown')}")
+                        # Add placeholder for missing element
+                        if language in ['html-css', 'react', 'vue', 'angular']:
+                            placeholder = f'''
 
 <!-- Add missing {issue_type.lower()} here -->
 <div class="missing-{diff['id']}" style="width: {diff['coordinates']['width']}px; height: {diff['coordinates']['height']}px;">
     <!-- Replace with actual {issue_type.lower()} content -->
 </div>'''
-                                corrected_code += placeholder
-                        
-                        elif 'Extra' in issue_type:
-                            changes.append(f"Marked extra {issue_type.lower()} for removal at position {diff.get('location', 'unknown')}")
-                            # Add comment for extra element
-                            if language in ['html-css', 'react', 'vue', 'angular']:
-                                comment = f'''
+                            corrected_code += placeholder
+                    
+                    elif 'Extra' in issue_type:
+                        changes.append(f"Marked extra {issue_type.lower()} for removal at position {diff.get('location', 'unknown')}")
+                        # Add comment for extra element
+                        if language in ['html-css', 'react', 'vue', 'angular']:
+                            comment = f'''
 
 <!-- Remove or hide extra {issue_type.lower()} -->
 <!-- <div class="extra-{diff['id']}" style="display: none;"> -->
     <!-- This element should be removed or hidden -->
 <!-- </div> -->'''
-                                corrected_code += comment
-                        
-                        elif 'Layout' in issue_type:
-                            changes.append(f"Fixed layout/positioning issue at position {diff.get('location', 'unknown')}")
-                            # Add CSS fix
-                            if language in ['html-css', 'react', 'vue', 'angular']:
-                                css_fix = f'''
+                            corrected_code += comment
+                    
+                    elif 'Layout' in issue_type:
+                        changes.append(f"Fixed layout/positioning issue at position {diff.get('location', 'unknown')}")
+                        # Add CSS fix
+                        if language in ['html-css', 'react', 'vue', 'angular']:
+                            css_fix = f'''
 
 /* Fix for layout issue {diff['id']} */
 .layout-fix-{diff['id']} {{
@@ -906,7 +1735,7 @@ def correct_code_based_on_issues(language, existing_code, notes, session_id):
     height: {diff['coordinates']['height']}px;
     z-index: 1;
 }}'''
-                                corrected_code += css_fix
+                            corrected_code += css_fix
         else:
             changes.append("No comparison data found. Please perform a comparison first to get specific corrections.")
             corrected_code += f'''
@@ -947,9 +1776,11 @@ def select_issues():
         
         if not session_id:
             return jsonify({'error': 'Missing session ID'}), 400
+        if not isinstance(selections, dict):
+            return jsonify({'error': 'selections must be an object of issue id to selection'}), 400
         
         # Store selections for this session
-        issue_selections[session_id] = selections
+        selection_store.replace(session_id, selections)
         
         return jsonify({
             'success': True,
@@ -965,7 +1796,7 @@ def select_issues():
 def get_issue_selections(session_id):
     """Get issue selections for a session"""
     try:
-        selections = issue_selections.get(session_id, {})
+        selections = selection_store.get(session_id)
         return jsonify({
             'success': True,
             'selections': selections
@@ -977,50 +1808,212 @@ def get_issue_selections(session_id):
 
 @app.route('/get_filtered_issues/<session_id>', methods=['GET'])
 def get_filtered_issues(session_id):
-    """Get only selected (non-neglected) issues for a session"""
+    """
+    Get only selected (non-neglected) issues of a session's latest comparison.
+
+    Optional screen_name, severity and issue_type query parameters narrow the issues further.
+    """
     try:
-        # Get the differences file for this session
-        differences_file = os.path.join(
-            app.config['UPLOAD_FOLDER'], 
-            'single_comparisons', 
-            session_id, 
-            'differences.json'
-        )
-        
-        if not os.path.exists(differences_file):
+        filters = {name: request.args[name] for name in ('screen_name', 'severity', 'issue_type')
+                   if request.args.get(name)}
+        comparison_id = results_db.latest_comparison(session_id, filters.get('screen_name'))
+        if comparison_id is None:
             return jsonify({'error': 'No comparison data found for this session'}), 404
         
-        # Load all differences
-        with open(differences_file, 'r') as f:
-            differences_data = json.load(f)
-            all_differences = differences_data.get('detected_differences', [])
-        
-        # Get selections for this session
-        selections = issue_selections.get(session_id, {})
+        total_original = results_db.count_differences(comparison_id, **filters)
         
-        # Filter out neglected issues
-        filtered_differences = []
-        for diff in all_differences:
-            diff_id = str(diff.get('id'))
-            if selections.get(diff_id) != 'neglect':
-                filtered_differences.append(diff)
+        # Leave out the issues the user neglected
+        filtered_differences = results_db.differences(
+            comparison_id, exclude_ids=_neglected_ids(session_id), **filters)
         
         return jsonify({
             'success': True,
+            'comparison_id': comparison_id,
             'filtered_differences': filtered_differences,
-            'total_original': len(all_differences),
+            'total_original': total_original,
             'total_filtered': len(filtered_differences),
-            'neglected_count': len(all_differences) - len(filtered_differences)
+            'neglected_count': total_original - len(filtered_differences)
         })
         
     except Exception as e:
         return jsonify({'error': f'Failed to get filtered issues: {str(e)}'}), 500
 
 
+@app.route('/issue_details/<session_id>/<int:issue_id>', methods=['GET'])
+def get_issue_details(session_id, issue_id):
+    """
+    Get the explanation, fix code snippet and fix steps of one detected issue.
+
+    Issue ids are numbered per screen; a screen_name query parameter picks the
+    screen of a bulk comparison.
+    """
+    try:
+        screen_name = request.args.get('screen_name') or None
+        comparison_id = results_db.latest_comparison(session_id, screen_name)
+        if comparison_id is None:
+            return jsonify({'error': 'No comparison data found for this session'}), 404
+
+        for diff in results_db.differences(comparison_id, screen_name=screen_name,
+                                           difference_id=issue_id):
+            coordinates = diff['coordinates']
+            return jsonify({
+                'success': True,
+                'issue_id': issue_id,
+                'issue_analysis': render_issue_details(
+                    diff['issue_analysis']['issue_code'], diff['area'],
+                    coordinates['x'], coordinates['y'], coordinates['width'], coordinates['height'])
+            })
+
+        return jsonify({'error': 'Issue not found'}), 404
+
+    except Exception as e:
+        return jsonify({'error': f'Failed to get issue details: {str(e)}'}), 500
+
+
+@app.route('/results/<session_id>/history', methods=['GET'])
+def get_results_history(session_id):
+    """List a session's comparisons, newest first, with each screen's similarity and issue count"""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be positive'}), 400
+
+    comparisons = results_db.history(session_id, request.args.get('screen_name') or None, limit)
+    return jsonify({
+        'success': True,
+        'session_id': session_id,
+        'comparisons': comparisons
+    })
+
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Get hit/miss counters and size of the comparison result cache"""
+    return jsonify(result_cache.stats())
+
+
+@app.route('/figma/stats', methods=['GET'])
+def get_figma_stats():
+    """Get request, retry, connection and latency metrics of the Figma HTTP transport"""
+    from ml.figma_transport import get_default_transport
+    return jsonify(get_default_transport().stats())
+
+
+@app.route('/storage/stats', methods=['GET'])
+def get_storage_stats():
+    """Get the bytes stored per upload folder category and the outcome of the last garbage collection"""
+    return jsonify(storage.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Get the request, stage, comparison, cache and Figma metrics of the server in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    """List the slowest stored request profiles (?limit=, default 10, and ?session_id=)"""
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    profiles = profile_store.slowest(limit, request.args.get('session_id'))
+    for profile in profiles:
+        profile['download_url'] = f"/profiles/{profile['id']}"
+        profile['summary_url'] = f"/profiles/{profile['id']}?format=text"
+    return jsonify({
+        'threshold_ms': app.config['PROFILE_THRESHOLD_MS'],
+        'profiles': profiles
+    })
+
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """Download a profile as a pstats file, or with ?format=text its top functions (?sort=)"""
+    if request.args.get('format') == 'text':
+        sort = request.args.get('sort', 'cumulative')
+        if sort not in SUMMARY_SORTS:
+            return jsonify({'error': f"sort must be one of {', '.join(SUMMARY_SORTS)}"}), 400
+        summary = profile_store.summary(profile_id, sort)
+        if summary is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        return Response(summary, mimetype='text/plain')
+
+    if profile_store.stats_path(profile_id) is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_from_directory(app.config['PROFILE_DIR'], f'{profile_id}.prof', as_attachment=True)
+
+
+# Modules the comparison and Figma routes import on first use
+WARM_MODULES = ('ml.image_comparison', 'ml.tiled_comparison', 'ml.incremental_comparison',
+                'ml.bulk_comparison', 'ml.figma_service')
+
+_warmup = {'thread': None, 'elapsed_ms': None, 'error': None}
+_warmup_lock = threading.Lock()
+
+
+def warm_modules():
+    """Import the comparison and Figma modules now instead of in the first request using them"""
+    start = time.perf_counter()
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def _run_warmup():
+    try:
+        _warmup['elapsed_ms'] = warm_modules()
+    except Exception as e:
+        _warmup['error'] = str(e)
+
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """
+    Readiness probe: 200 once the comparison modules are loaded, 503 while they load.
+
+    The first call starts loading them in the background; ?wait=true waits
+    for that to finish.
+    """
+    with _warmup_lock:
+        if _warmup['thread'] is None:
+            _warmup['thread'] = threading.Thread(target=_run_warmup, name='warmup', daemon=True)
+            _warmup['thread'].start()
+        thread = _warmup['thread']
+    if request.args.get('wait', '').lower() in ('1', 'true', 'yes'):
+        thread.join()
+
+    if _warmup['error'] is not None:
+        return jsonify({'ready': False, 'error': _warmup['error']}), 503
+    if thread.is_alive():
+        return jsonify({'ready': False, 'status': 'warming'}), 503
+    return jsonify({'ready': True, 'warm_ms': _warmup['elapsed_ms']})
+
+
+# Upload folder subdirectories holding comparison images, the only ones served by /uploads/.
+# Jobs (with their credentials), databases, caches, baselines and profiles stay private.
+SERVED_UPLOAD_FOLDERS = ('single_comparisons', 'figma_comparisons', 'bulk_comparisons')
+
+
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
+    image_path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if image_path is None:
+        abort(404)
+    relative_path = os.path.relpath(image_path, app.config['UPLOAD_FOLDER'])
+    if relative_path.split(os.sep, 1)[0] not in SERVED_UPLOAD_FOLDERS:
+        abort(404)
+
+    # Annotated images skipped by the render option are drawn on first request
+    render_pending(image_path)
+    storage.touch(image_path)
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5002)
+    # Development server only; python main.py serves with gunicorn or waitress
+    app.run(debug=True, port=int(os.environ.get('PORT', 5000)))
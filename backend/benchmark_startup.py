@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark how long a fresh process takes to import the app and to warm the comparison modules.
+
+Usage:
+    python -m backend.benchmark_startup [--repeat 5] [--top 15] [--max-import-ms 1000]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules the app must not load at import time; the comparison and Figma routes load them on first use
+HEAVY_MODULES = ('cv2', 'numpy', 'scipy', 'skimage', 'PIL', 'requests')
+
+# Run in a fresh interpreter: times importing the app, then warm_modules()
+_PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import backend.app
+imported = time.perf_counter()
+loaded = [name for name in {HEAVY_MODULES!r} if name in sys.modules]
+backend.app.warm_modules()
+warmed = time.perf_counter()
+print(json.dumps({{'import_ms': (imported - start) * 1000, 'warm_ms': (warmed - imported) * 1000,
+                  'heavy_loaded': loaded}}))
+"""
+
+
+def _run(args, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True,
+                          text=True, check=True)
+
+
+def measure(repeat=5):
+    """
+    Import the app in repeat fresh processes.
+
+    Each process runs in its own empty directory, so it also creates the
+    upload folder and databases as a newly started instance does.
+
+    Returns:
+        dict: Best import_ms and warm_ms, and the heavy modules loaded by the import
+    """
+    runs = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cwd:
+            runs.append(json.loads(_run(['-c', _PROBE], cwd).stdout.strip().splitlines()[-1]))
+    return {
+        'import_ms': round(min(run['import_ms'] for run in runs), 1),
+        'warm_ms': round(min(run['warm_ms'] for run in runs), 1),
+        'heavy_loaded': sorted(set().union(*(run['heavy_loaded'] for run in runs)))
+    }
+
+
+def slowest_imports(top=15):
+    """Return the (cumulative ms, self ms, module) of the slowest imports under the app, per -X importtime"""
+    with tempfile.TemporaryDirectory() as cwd:
+        stderr = _run(['-X', 'importtime', '-c', 'import backend.app'], cwd).stderr
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        entries.append((int(cumulative_us) / 1000, int(self_us) / 1000, module.rstrip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports to list')
+    parser.add_argument('--max-import-ms', type=float,
+                        help='Exit with status 1 when importing the app takes longer')
+    args = parser.parse_args()
+
+    results = measure(args.repeat)
+    print(f'best of {args.repeat} fresh processes')
+    print(f"import backend.app    {results['import_ms']:>8.1f} ms")
+    print(f"warm_modules()        {results['warm_ms']:>8.1f} ms")
+    print(f"heavy modules at import: {', '.join(results['heavy_loaded']) or 'none'}")
+
+    if args.top:
+        print(f"\n{'cumulative ms':>14}{'self ms':>10}  module")
+        for cumulative_ms, self_ms, module in slowest_imports(args.top):
+            print(f'{cumulative_ms:>14.1f}{self_ms:>10.1f}  {module}')
+
+    if results['heavy_loaded']:
+        return 1
+    if args.max_import_ms is not None and results['import_ms'] > args.max_import_ms:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+import json
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime
+
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+FINISHED_STATUSES = ('completed', 'failed')
+
+
+class JobQueue:
+    """
+    Persistent background job queue backed by one JSON file per job.
+
+    Job files are the source of truth, so any process sharing the jobs
+    directory can report a job's status. Workers claim a job by creating
+    its lock file exclusively, which keeps a job from running twice when
+    several server processes recover the same queue after a restart.
+
+    Secrets such as credentials are never written to the job file; they are
+    kept in the memory of the submitting process only. A job that needs
+    secrets fails when that process is gone before it ran.
+    """
+
+    def __init__(self, jobs_dir, num_workers=2):
+        self.jobs_dir = jobs_dir
+        self.num_workers = num_workers
+        self.handlers = {}
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._secrets = {}
+        if hasattr(os, 'register_at_fork'):
+            # Worker threads do not survive fork(); a forked server worker starts its own
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def register(self, kind, handler):
+        """
+        Register the function that runs jobs of the given kind.
+
+        The handler is called as handler(payload, progress) where progress is a
+        callable progress(completed, total) and must return a JSON-serializable result.
+        """
+        self.handlers[kind] = handler
+
+    def submit(self, kind, payload, secrets=None):
+        """
+        Persist a new job and queue it for the worker pool. Returns the job id.
+
+        Args:
+            secrets (dict, optional): Values merged into the payload when the job
+                runs, e.g. a Figma token, that must not be stored on disk
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        self.start()
+
+        job_id = uuid.uuid4().hex
+        if secrets:
+            self._secrets[job_id] = dict(secrets)
+        self._write(job_id, {
+            'job_id': job_id,
+            'kind': kind,
+            'status': 'queued',
+            'payload': payload,
+            'secret_keys': sorted(secrets or ()),
+            'submitted_by': os.getpid(),
+            'progress': {'completed': 0, 'total': 0},
+            'result': None,
+            'error': None,
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        })
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        """Load a job record, or None if the id is unknown or malformed."""
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        try:
+            with open(self._job_path(job_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def start(self):
+        """Start the worker threads and recover jobs left queued by a previous run."""
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            self._recover()
+            for i in range(self.num_workers):
+                worker = threading.Thread(
+                    target=self._worker, name=f'job-worker-{i}', daemon=True)
+                worker.start()
+            self._started = True
+
+    def purge(self, max_age):
+        """
+        Delete the records of jobs that finished more than max_age seconds ago.
+
+        Lock files whose job record is gone, and stale temporary files, are
+        deleted too. Returns how many job records were deleted.
+        """
+        cutoff = time.time() - max_age
+        try:
+            filenames = os.listdir(self.jobs_dir)
+        except OSError:
+            return 0
+        deleted = 0
+        for filename in filenames:
+            job_id, ext = os.path.splitext(filename)
+            path = os.path.join(self.jobs_dir, filename)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+                if ext == '.json':
+                    # A finished record is not written again, so its mtime is when it finished
+                    job = self.get(job_id)
+                    if not job or job['status'] not in FINISHED_STATUSES:
+                        continue
+                    os.remove(path)
+                    deleted += 1
+                    if os.path.exists(self._lock_path(job_id)):
+                        os.remove(self._lock_path(job_id))
+                elif ext == '.lock' and not os.path.exists(self._job_path(job_id)):
+                    os.remove(path)
+                elif ext == '.tmp':
+                    # Left by a process that died while writing a record
+                    os.remove(path)
+            except OSError:
+                continue
+        return deleted
+
+    def _reset_after_fork(self):
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._secrets = {}
+
+    def _recover(self):
+        for filename in os.listdir(self.jobs_dir):
+            job_id, ext = os.path.splitext(filename)
+            if ext != '.json':
+                continue
+            job = self.get(job_id)
+            if not job:
+                continue
+            if job['status'] == 'queued':
+                if not job.get('secret_keys'):
+                    self._queue.put(job_id)
+                elif self._secrets_lost(job_id, job):
+                    self._fail(job_id, job, 'Job was interrupted by a server restart; submit it again')
+                # Otherwise its submitting process, which holds the secrets, runs it
+            elif job['status'] == 'running' and not self._owner_alive(job_id):
+                self._fail(job_id, job, 'Job was interrupted by a server restart')
+
+    def _secrets_lost(self, job_id, job):
+        # Secrets live only in the submitting process; a pid equal to ours but
+        # without them is a previous server that had the same pid
+        submitter = job.get('submitted_by')
+        if submitter == os.getpid():
+            return job_id not in self._secrets
+        return not _pid_alive(submitter)
+
+    def _fail(self, job_id, job, error):
+        job['status'] = 'failed'
+        job['error'] = error
+        job['payload'] = None
+        job['finished_at'] = datetime.now().isoformat()
+        self._write(job_id, job)
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                if self._claim(job_id):
+                    self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        job = self.get(job_id)
+        if not job or job['status'] != 'queued':
+            return
+
+        payload = job['payload']
+        if job.get('secret_keys'):
+            secrets = self._secrets.pop(job_id, None)
+            if secrets is None:
+                self._fail(job_id, job, 'Job was interrupted by a server restart; submit it again')
+                return
+            payload = {**payload, **secrets}
+
+        job['status'] = 'running'
+        job['started_at'] = datetime.now().isoformat()
+        self._write(job_id, job)
+
+        def progress(completed, total):
+            job['progress'] = {'completed': completed, 'total': total}
+            self._write(job_id, job)
+
+        try:
+            job['result'] = self.handlers[job['kind']](payload, progress)
+            job['status'] = 'completed'
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            job['traceback'] = traceback.format_exc()
+        # Payloads can hold credentials (e.g. Figma tokens); drop them once used
+        job['payload'] = None
+        job['finished_at'] = datetime.now().isoformat()
+        self._write(job_id, job)
+
+    def _claim(self, job_id):
+        try:
+            fd = os.open(self._lock_path(job_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        return True
+
+    def _owner_alive(self, job_id):
+        try:
+            with open(self._lock_path(job_id), 'r') as f:
+                pid = int(f.read().strip())
+        except (OSError, ValueError):
+            return False
+        return pid != os.getpid() and _pid_alive(pid)
+
+    def _write(self, job_id, job):
+        # Write to a temporary file first so readers never see a partial record
+        tmp_path = f"{self._job_path(job_id)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job_id))
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f'{job_id}.json')
+
+    def _lock_path(self, job_id):
+        return os.path.join(self.jobs_dir, f'{job_id}.lock')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(int(pid), 0)
+    except (TypeError, ValueError, OSError):
+        return False
+    return True
+
+
+def public_job(job):
+    """Return the client-facing view of a job record (no payload or traceback)."""
+    return {
+        'job_id': job['job_id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at']
+    }
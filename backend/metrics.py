@@ -0,0 +1,273 @@
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+
+
+# Upper bounds, in seconds, of the default histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """Return the current values as {label value tuple: value}"""
+        raise NotImplementedError
+
+    def merge(self, value, other):
+        """Combine two processes' values of the same label set"""
+        return value + other
+
+    def reset(self):
+        pass
+
+    def render(self, values=None):
+        """Return the metric's lines, for the given values or else its own"""
+        values = self.snapshot() if values is None else values
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(values.items()):
+            lines.extend(self._lines(key, value))
+        return lines
+
+    def _lines(self, key, value):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}']
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes the labels {', '.join(self.labels) or 'none'}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+
+class Counter(_Metric):
+    """A monotonically increasing count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+
+class CallbackCounter(_Metric):
+    """A counter whose values are read from elsewhere when scraped, e.g. a component's own stats"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels, callback):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+        self._offsets = {}
+
+    def snapshot(self):
+        return {key: count - self._offsets.get(key, 0) for key, count in self._read().items()}
+
+    def reset(self):
+        # The source keeps counting, so counts from before the reset are subtracted from then on
+        self._offsets = self._read()
+
+    def _read(self):
+        return {tuple(str(value) for value in key): count for key, count in self.callback().items()}
+
+
+class Histogram(_Metric):
+    """Observations counted into buckets per label set, with their sum; values are [bucket counts, sum]"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: [list(counts), total] for key, (counts, total) in self._values.items()}
+
+    def merge(self, value, other):
+        return [[a + b for a, b in zip(value[0], other[0])], value[1] + other[1]]
+
+    def reset(self):
+        with self._lock:
+            self._values = {}
+
+    def _lines(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labels, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics rendered in the Prometheus text exposition format.
+
+    Without a multiprocess_dir the values are those of this process. With
+    one, every process sharing the directory writes a snapshot of its values
+    there every flush_interval seconds once started, and at exit. render then
+    reports the sum of all snapshots, so any worker of a multi-process server
+    can answer a scrape. The sum lags the live values by up to flush_interval,
+    but never goes backwards, whichever process answers: each process's part
+    is always its latest snapshot. Snapshots of exited processes are kept for
+    the same reason, so the directory should start empty with each server run.
+    """
+
+    def __init__(self, multiprocess_dir=None, flush_interval=5):
+        self.multiprocess_dir = multiprocess_dir
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._snapshot_name = f'{os.getpid()}_{uuid.uuid4().hex[:8]}.json'
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+            atexit.register(self.flush)
+            if hasattr(os, 'register_at_fork'):
+                # A forked worker starts from zero; the values it inherited stay the parent's
+                os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def callback_counter(self, name, documentation, labels, callback):
+        """Register a counter read from callback(), which returns {label value tuple: count}"""
+        return self._register(CallbackCounter(name, documentation, labels, callback))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def start(self):
+        """Start flushing this process's snapshot periodically, once per process"""
+        if self._started or not self.multiprocess_dir:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+            self._started = True
+
+    def flush(self):
+        """Write this process's snapshot to the multiprocess directory"""
+        if not self.multiprocess_dir:
+            return
+        snapshot = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()]
+                    for metric in self._metrics}
+        path = os.path.join(self.multiprocess_dir, self._snapshot_name)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def render(self):
+        """Return every metric in the text exposition format"""
+        if self.multiprocess_dir:
+            values = self._collect()
+        else:
+            values = {metric.name: metric.snapshot() for metric in self._metrics}
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(values[metric.name]))
+        return '\n'.join(lines) + '\n'
+
+    def _collect(self):
+        """Sum the snapshots of all processes"""
+        values = {metric.name: {} for metric in self._metrics}
+        metrics = {metric.name: metric for metric in self._metrics}
+        try:
+            names = os.listdir(self.multiprocess_dir)
+        except OSError:
+            return values
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, name), 'r') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric_name, entries in snapshot.items():
+                metric = metrics.get(metric_name)
+                if metric is None:
+                    continue
+                merged = values[metric_name]
+                for key, value in entries:
+                    key = tuple(key)
+                    merged[key] = metric.merge(merged[key], value) if key in merged else value
+        return values
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _reset_after_fork(self):
+        for metric in self._metrics:
+            # A thread of the parent may have held the lock when it forked
+            metric._lock = threading.Lock()
+            metric.reset()
+        self._snapshot_name = f'{os.getpid()}_{uuid.uuid4().hex[:8]}.json'
+        self._start_lock = threading.Lock()
+        self._started = False
+
+    def _register(self, metric):
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics.append(metric)
+        return metric
@@ -0,0 +1,130 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import uuid
+from datetime import datetime
+
+
+# Profile ids are a timestamp to the microsecond and a random suffix, so sorting them sorts by age
+PROFILE_ID_PATTERN = re.compile(r'^\d{8}_\d{6}_\d{6}_[0-9a-f]{6}$')
+
+# Orders accepted by ProfileStore.summary, as pstats sort keys
+SUMMARY_SORTS = ('cumulative', 'tottime', 'calls')
+
+
+class ProfileStore:
+    """
+    cProfile captures of slow requests, shared by all server processes.
+
+    Each profile is stored as a pstats file next to a JSON summary of its
+    request (route, status, elapsed time, session). Only the newest `keep`
+    profiles are kept.
+
+    cProfile traces one thread at a time, so each process profiles a
+    single request at a time; requests arriving meanwhile run unprofiled.
+    """
+
+    def __init__(self, root, keep=200):
+        self.root = root
+        self.keep = keep
+        self._busy = threading.Lock()
+
+    def start(self):
+        """Start profiling the calling thread, or return None while another request is profiled"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiling tool (e.g. a debugger) already holds the interpreter hook
+            self._busy.release()
+            return None
+        return profiler
+
+    def stop(self, profiler):
+        """Stop a profiler returned by start, making room for the next request"""
+        profiler.disable()
+        self._busy.release()
+
+    def save(self, profiler, info):
+        """
+        Store a stopped profile with a summary of its request.
+
+        Args:
+            info (dict): JSON-serializable request details, e.g. route and elapsed_ms
+
+        Returns:
+            str: The profile id
+        """
+        os.makedirs(self.root, exist_ok=True)
+        profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{uuid.uuid4().hex[:6]}"
+        stats_path, info_path = self._paths(profile_id)
+
+        tmp_path = f'{stats_path}.tmp'
+        profiler.dump_stats(tmp_path)
+        os.replace(tmp_path, stats_path)
+        tmp_path = f'{info_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'id': profile_id, 'created_at': datetime.now().isoformat(), **info}, f)
+        os.replace(tmp_path, info_path)
+
+        self._trim()
+        return profile_id
+
+    def slowest(self, limit=10, session_id=None):
+        """Return the summaries of the slowest stored profiles, slowest first"""
+        profiles = []
+        for profile_id in self._ids():
+            try:
+                with open(self._paths(profile_id)[1], 'r') as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                # Trimmed by another process, or still being written
+                continue
+            if session_id is None or info.get('session_id') == session_id:
+                profiles.append(info)
+        profiles.sort(key=lambda info: info.get('elapsed_ms', 0), reverse=True)
+        return profiles[:limit]
+
+    def stats_path(self, profile_id):
+        """Return the pstats file of a profile, or None if there is no such profile"""
+        if not PROFILE_ID_PATTERN.match(profile_id):
+            return None
+        path = self._paths(profile_id)[0]
+        return path if os.path.exists(path) else None
+
+    def summary(self, profile_id, sort='cumulative', lines=50):
+        """Return the top functions of a profile as pstats text, or None if there is no such profile"""
+        path = self.stats_path(profile_id)
+        if path is None:
+            return None
+        output = io.StringIO()
+        stats = pstats.Stats(path, stream=output)
+        stats.strip_dirs().sort_stats(sort).print_stats(lines)
+        return output.getvalue()
+
+    def _paths(self, profile_id):
+        base = os.path.join(self.root, profile_id)
+        return f'{base}.prof', f'{base}.json'
+
+    def _ids(self):
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return sorted(name[:-len('.json')] for name in names
+                      if name.endswith('.json') and PROFILE_ID_PATTERN.match(name[:-len('.json')]))
+
+    def _trim(self):
+        ids = self._ids()
+        for profile_id in ids[:max(0, len(ids) - self.keep)]:
+            for path in self._paths(profile_id):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
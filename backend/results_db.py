@@ -0,0 +1,182 @@
+import json
+import time
+
+from backend.sqlite_store import SQLiteStore
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS comparisons (
+    comparison_id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS comparisons_session ON comparisons (session_id, created_at);
+CREATE TABLE IF NOT EXISTS screens (
+    screen_id INTEGER PRIMARY KEY,
+    comparison_id INTEGER NOT NULL REFERENCES comparisons (comparison_id) ON DELETE CASCADE,
+    screen_name TEXT NOT NULL,
+    similarity REAL,
+    total_differences INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS screens_comparison ON screens (comparison_id);
+CREATE INDEX IF NOT EXISTS screens_name ON screens (screen_name);
+CREATE TABLE IF NOT EXISTS differences (
+    screen_id INTEGER NOT NULL REFERENCES screens (screen_id) ON DELETE CASCADE,
+    difference_id INTEGER NOT NULL,
+    severity TEXT,
+    issue_type TEXT,
+    issue_code TEXT,
+    record TEXT NOT NULL,
+    PRIMARY KEY (screen_id, difference_id)
+);
+CREATE INDEX IF NOT EXISTS differences_severity ON differences (severity);
+CREATE INDEX IF NOT EXISTS differences_issue_type ON differences (issue_type);
+"""
+
+
+class ResultsDB(SQLiteStore):
+    """
+    History of the comparisons of every session, kept in an SQLite database.
+
+    A comparison (one upload) holds one screen per compared pair, and each
+    screen holds its detected differences. Differences keep their full record
+    as JSON next to indexed severity and issue type columns, so filtered
+    lookups never reload whole result files. Queries without a comparison id
+    read the session's latest comparison.
+    """
+
+    def __init__(self, db_path):
+        super().__init__(db_path, _SCHEMA)
+
+    def record(self, session_id, kind, screens):
+        """
+        Store a comparison and its screens' differences.
+
+        Args:
+            session_id (str): Session the comparison belongs to
+            kind (str): What was compared, e.g. 'single', 'figma' or 'bulk'
+            screens (list): (screen_name, result) pairs, the results as returned by compare_images
+
+        Returns:
+            int: The new comparison id
+        """
+        with self._transaction() as connection:
+            comparison_id = connection.execute(
+                'INSERT INTO comparisons (session_id, kind, created_at) VALUES (?, ?, ?)',
+                (session_id, kind, time.time())).lastrowid
+            for screen_name, result in screens:
+                differences = result.get('detected_differences', [])
+                screen_id = connection.execute(
+                    """INSERT INTO screens (comparison_id, screen_name, similarity, total_differences)
+                       VALUES (?, ?, ?, ?)""",
+                    (comparison_id, screen_name, float(result['similarity']), len(differences))).lastrowid
+                connection.executemany(
+                    """INSERT INTO differences
+                       (screen_id, difference_id, severity, issue_type, issue_code, record)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    [(screen_id, difference['id'], difference.get('severity'),
+                      difference.get('issue_analysis', {}).get('issue_type'),
+                      difference.get('issue_analysis', {}).get('issue_code'),
+                      json.dumps(difference))
+                     for difference in differences])
+        return comparison_id
+
+    def purge(self, max_age):
+        """
+        Delete the comparisons older than max_age seconds, with their screens and differences.
+
+        Returns:
+            int: Number of comparisons deleted
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'DELETE FROM comparisons WHERE created_at < ?', (time.time() - max_age,))
+        return cursor.rowcount
+
+    def latest_comparison(self, session_id, screen_name=None):
+        """Return the id of the session's latest comparison (having that screen, if given), or None"""
+        query = """SELECT comparisons.comparison_id FROM comparisons
+                   JOIN screens USING (comparison_id) WHERE session_id = ?"""
+        params = [session_id]
+        if screen_name is not None:
+            query += ' AND screen_name = ?'
+            params.append(screen_name)
+        query += ' ORDER BY created_at DESC, comparisons.comparison_id DESC LIMIT 1'
+        row = self._connection().execute(query, params).fetchone()
+        return row[0] if row else None
+
+    def differences(self, comparison_id, screen_name=None, severity=None, issue_type=None,
+                    difference_id=None, exclude_ids=()):
+        """
+        Query the detected differences of a comparison.
+
+        Args:
+            comparison_id (int): As returned by record or latest_comparison
+            screen_name, severity, issue_type, difference_id (optional): Exact-match filters
+            exclude_ids (iterable, optional): Difference ids to leave out, e.g. neglected issues
+
+        Returns:
+            list: Difference records, by screen then id
+        """
+        query, params = self._differences_query('d.record', comparison_id, screen_name, severity,
+                                                issue_type, difference_id, exclude_ids)
+        rows = self._connection().execute(query + ' ORDER BY s.screen_id, d.difference_id', params)
+        return [json.loads(record) for record, in rows]
+
+    def count_differences(self, comparison_id, **filters):
+        """Count the differences differences() would return for the same arguments"""
+        query, params = self._differences_query('COUNT(*)', comparison_id, **filters)
+        return self._connection().execute(query, params).fetchone()[0]
+
+    def history(self, session_id, screen_name=None, limit=50):
+        """
+        List a session's comparisons, newest first, with each screen's similarity and difference count.
+
+        Args:
+            screen_name (str, optional): Only list this screen
+            limit (int, optional): Most comparisons returned
+        """
+        query = """SELECT c.comparison_id, c.kind, c.created_at, s.screen_name,
+                          s.similarity, s.total_differences
+                   FROM comparisons c JOIN screens s USING (comparison_id)
+                   WHERE c.comparison_id IN (
+                       SELECT comparison_id FROM comparisons WHERE session_id = ?
+                       ORDER BY created_at DESC, comparison_id DESC LIMIT ?)"""
+        params = [session_id, limit]
+        if screen_name is not None:
+            query += ' AND s.screen_name = ?'
+            params.append(screen_name)
+        query += ' ORDER BY c.created_at DESC, c.comparison_id DESC, s.screen_id'
+
+        comparisons = []
+        for comparison_id, kind, created_at, name, similarity, total in self._connection().execute(query, params):
+            if not comparisons or comparisons[-1]['comparison_id'] != comparison_id:
+                comparisons.append({
+                    'comparison_id': comparison_id,
+                    'kind': kind,
+                    'created_at': created_at,
+                    'screens': []
+                })
+            comparisons[-1]['screens'].append({
+                'screen_name': name,
+                'similarity': similarity,
+                'total_differences': total
+            })
+        return comparisons
+
+    def _differences_query(self, columns, comparison_id, screen_name=None, severity=None,
+                           issue_type=None, difference_id=None, exclude_ids=()):
+        query = f"""SELECT {columns} FROM differences d JOIN screens s USING (screen_id)
+                    WHERE s.comparison_id = ?"""
+        params = [comparison_id]
+        for column, value in (('s.screen_name', screen_name), ('d.severity', severity),
+                              ('d.issue_type', issue_type), ('d.difference_id', difference_id)):
+            if value is not None:
+                query += f' AND {column} = ?'
+                params.append(value)
+        exclude_ids = list(exclude_ids)
+        if exclude_ids:
+            query += f" AND d.difference_id NOT IN ({', '.join('?' * len(exclude_ids))})"
+            params.extend(exclude_ids)
+        return query, params
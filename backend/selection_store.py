@@ -0,0 +1,77 @@
+import threading
+import time
+
+from backend.sqlite_store import SQLiteStore
+
+
+# Seconds between purges of expired sessions, per process
+PURGE_INTERVAL = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS issue_selections (
+    session_id TEXT NOT NULL REFERENCES sessions (session_id) ON DELETE CASCADE,
+    issue_id TEXT NOT NULL,
+    selection TEXT NOT NULL,
+    PRIMARY KEY (session_id, issue_id)
+) WITHOUT ROWID;
+"""
+
+
+class SelectionStore(SQLiteStore):
+    """
+    Issue selections of each session, kept in an SQLite database.
+
+    Every server process and thread shares the database, and selections
+    survive restarts. Selections are keyed by session id. A session expires
+    ttl seconds after it was last updated, and expired sessions are purged
+    on writes.
+    """
+
+    def __init__(self, db_path, ttl=7 * 24 * 3600):
+        super().__init__(db_path, _SCHEMA)
+        self.ttl = ttl
+        self._purge_lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def get(self, session_id):
+        """Return a session's selections as {issue_id: selection}, empty if unknown or expired"""
+        rows = self._connection().execute(
+            """SELECT issue_id, selection FROM issue_selections
+               JOIN sessions USING (session_id)
+               WHERE session_id = ? AND updated_at >= ?""",
+            (session_id, time.time() - self.ttl)).fetchall()
+        return dict(rows)
+
+    def replace(self, session_id, selections):
+        """Atomically replace a session's selections and restart its TTL"""
+        with self._transaction() as connection:
+            connection.execute(
+                """INSERT INTO sessions (session_id, updated_at) VALUES (?, ?)
+                   ON CONFLICT (session_id) DO UPDATE SET updated_at = excluded.updated_at""",
+                (session_id, time.time()))
+            connection.execute('DELETE FROM issue_selections WHERE session_id = ?', (session_id,))
+            connection.executemany(
+                'INSERT INTO issue_selections (session_id, issue_id, selection) VALUES (?, ?, ?)',
+                [(session_id, str(issue_id), str(selection))
+                 for issue_id, selection in selections.items()])
+        self._maybe_purge()
+
+    def purge_expired(self):
+        """Delete the sessions whose TTL has run out. Returns how many were deleted."""
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                'DELETE FROM sessions WHERE updated_at < ?', (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def _maybe_purge(self):
+        with self._purge_lock:
+            now = time.monotonic()
+            if now - self._last_purge < PURGE_INTERVAL:
+                return
+            self._last_purge = now
+        self.purge_expired()
@@ -0,0 +1,48 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Base of the stores kept in an SQLite database shared by all server processes.
+
+    The database runs in WAL mode, so readers never block the writer, and
+    each thread gets its own connection since sqlite3 connections must not be
+    shared between threads.
+    """
+
+    def __init__(self, db_path, schema):
+        self.db_path = db_path
+        self._local = threading.local()
+        if hasattr(os, 'register_at_fork'):
+            # A connection must not be used across fork(), e.g. by workers of a
+            # server that imported the app before forking; children open their own
+            os.register_at_fork(after_in_child=self._forget_connections)
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        with self._connection() as connection:
+            connection.executescript(schema)
+
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent writers
+        # wait on the busy timeout instead of failing halfway through. Use as
+        # "with self._transaction() as connection:" to commit or roll back.
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def _forget_connections(self):
+        # Closing the inherited connections would touch the parent's database
+        # state too, so they are kept open and unused
+        self._inherited = self._local
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('PRAGMA foreign_keys=ON')
+            self._local.connection = connection
+        return connection
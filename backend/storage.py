@@ -0,0 +1,368 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+# Directories under the upload folder whose entries are garbage collected.
+# Each entry (a session's or bulk upload's directory, or a cached file) is a
+# unit; units of trimmed categories that outgrow the session quota lose their
+# oldest files first. The result cache keeps its own size limit.
+COLLECTED_CATEGORIES = {
+    'single_comparisons': True,
+    'figma_comparisons': True,
+    'bulk_comparisons': True,
+    'baselines': False,
+    os.path.join('cache', 'figma', 'images'): False
+}
+
+# Units used this recently are never collected, so running comparisons keep their files
+GC_GRACE_SECONDS = 300
+
+# Shard directories are named by the first two hex digits of the hash of their units' names
+SHARD_PATTERN = re.compile(r'^[0-9a-f]{2}$')
+
+_LOCK_NAME = '.gc.lock'
+_STATS_NAME = '.storage_stats.json'
+
+
+def _shard(name):
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()[:2]
+
+
+def _tree_usage(path):
+    """
+    Return (bytes, files, last use) of a file or directory tree.
+
+    A tree was last used when its newest file was written or its root was touched.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0, 0, 0.0
+    if not os.path.isdir(path):
+        return stat.st_size, 1, stat.st_mtime
+    size, files, newest = 0, 0, stat.st_mtime
+    for dir_path, _, file_names in os.walk(path):
+        for name in file_names:
+            try:
+                file_stat = os.stat(os.path.join(dir_path, name))
+            except OSError:
+                continue
+            size += file_stat.st_size
+            files += 1
+            newest = max(newest, file_stat.st_mtime)
+    return size, files, newest
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class StorageManager:
+    """
+    Lifecycle of everything the server writes under the upload folder.
+
+    Session and bulk upload directories are sharded into subdirectories by
+    the hash of their name, so no directory grows past a few hundred
+    entries. A background thread periodically deletes units unused for
+    longer than max_age, trims units beyond session_max_bytes, and deletes
+    the least recently used units until the collected categories fit in
+    max_bytes. Data kept outside these categories, such as job records and
+    database rows, is expired by collectors added with add_collector, which
+    run in the same pass. One process at a time collects; the stats of its
+    last pass are shared with the others through a file.
+    """
+
+    def __init__(self, root, max_bytes=5 * 1024 ** 3, session_max_bytes=256 * 1024 ** 2,
+                 max_age=7 * 24 * 3600, interval=600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self._collectors = {}
+        self._start_lock = threading.Lock()
+        self._started = False
+
+    def add_collector(self, name, collect):
+        """
+        Run collect() in every garbage collection pass.
+
+        Args:
+            name (str): Key of the collector's outcome in the pass's stats
+            collect (callable): Deletes expired data and returns how many items it deleted
+        """
+        self._collectors[name] = collect
+
+    def session_dir(self, category, name):
+        """
+        Create (if needed) and return the sharded directory of a session or bulk upload.
+
+        Also marks the directory as used and starts the background collector.
+
+        Args:
+            category (str): One of the sharded COLLECTED_CATEGORIES, e.g. 'single_comparisons'
+            name (str): Session id or bulk upload name, safe to use as a path component
+        """
+        path = os.path.join(self.root, category, _shard(name), name)
+        os.makedirs(path, exist_ok=True)
+        os.utime(path)
+        self.start()
+        return path
+
+    def touch(self, path):
+        """Mark the unit holding a file under the upload folder as recently used"""
+        unit = self._unit_of(path)
+        if unit:
+            try:
+                os.utime(unit)
+            except OSError:
+                pass
+
+    def start(self):
+        """Start the background collector thread, once per process"""
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            threading.Thread(target=self._run, name='storage-gc', daemon=True).start()
+            self._started = True
+
+    def collect(self):
+        """
+        Run one garbage collection pass, unless another process is running one.
+
+        Returns:
+            dict or None: The pass's stats, or None if the pass was skipped
+        """
+        if not self._acquire():
+            return None
+        try:
+            return self._collect()
+        finally:
+            try:
+                os.remove(os.path.join(self.root, _LOCK_NAME))
+            except OSError:
+                pass
+
+    def stats(self):
+        """Return the usage and outcome recorded by the last collection pass of any process"""
+        try:
+            with open(os.path.join(self.root, _STATS_NAME), 'r') as f:
+                recorded = json.load(f)
+        except (OSError, ValueError):
+            recorded = {'categories': {}, 'total_bytes': None, 'last_gc': None}
+        recorded.update({
+            'max_bytes': self.max_bytes,
+            'session_max_bytes': self.session_max_bytes,
+            'max_age': self.max_age,
+            'interval': self.interval
+        })
+        return recorded
+
+    def _run(self):
+        while True:
+            try:
+                self.collect()
+            except Exception:
+                # A failed pass is retried on the next interval
+                pass
+            time.sleep(self.interval)
+
+    def _acquire(self):
+        os.makedirs(self.root, exist_ok=True)
+        lock_path = os.path.join(self.root, _LOCK_NAME)
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                # The lock of a process that died mid-pass is taken over
+                if self._owner_alive(lock_path):
+                    return False
+                try:
+                    os.remove(lock_path)
+                except OSError:
+                    return False
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def _owner_alive(self, lock_path):
+        try:
+            with open(lock_path, 'r') as f:
+                pid = int(f.read().strip())
+            os.kill(pid, 0)
+        except (OSError, ValueError):
+            return False
+        return True
+
+    def _units(self, category):
+        category_dir = os.path.join(self.root, category)
+        try:
+            entries = list(os.scandir(category_dir))
+        except OSError:
+            return []
+        units = []
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if SHARD_PATTERN.match(entry.name) and entry.is_dir():
+                try:
+                    units.extend(os.path.join(entry.path, name) for name in os.listdir(entry.path)
+                                 if not name.startswith('.'))
+                except OSError:
+                    continue
+            else:
+                # Directories created before sharding
+                units.append(entry.path)
+        return units
+
+    def _unit_of(self, path):
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        parts = relative.split(os.sep)
+        for category in COLLECTED_CATEGORIES:
+            depth = len(category.split(os.sep))
+            if parts[:depth] != category.split(os.sep) or len(parts) <= depth:
+                continue
+            if SHARD_PATTERN.match(parts[depth]) and len(parts) > depth + 1:
+                depth += 1
+            return os.path.join(self.root, *parts[:depth + 1])
+        return None
+
+    def _collect(self):
+        start = time.perf_counter()
+        now = time.time()
+        deleted_units = trimmed_files = freed_bytes = 0
+
+        live_units = []
+        for category, trimmed in COLLECTED_CATEGORIES.items():
+            for unit in self._units(category):
+                size, _, last_used = _tree_usage(unit)
+                idle = now - last_used
+                if idle < GC_GRACE_SECONDS:
+                    live_units.append((last_used, size, unit, False))
+                    continue
+                if idle > self.max_age:
+                    _remove(unit)
+                    deleted_units += 1
+                    freed_bytes += size
+                    continue
+                if trimmed and size > self.session_max_bytes:
+                    files, freed = self._trim(unit, size - self.session_max_bytes, now)
+                    # Deleting files is not a use of the unit
+                    os.utime(unit, (last_used, last_used))
+                    trimmed_files += files
+                    freed_bytes += freed
+                    size -= freed
+                live_units.append((last_used, size, unit, True))
+
+        # Least recently used units go first once the total is over the quota
+        total = sum(size for _, size, _, _ in live_units)
+        for last_used, size, unit, collectable in sorted(live_units):
+            if total <= self.max_bytes:
+                break
+            if not collectable:
+                continue
+            _remove(unit)
+            deleted_units += 1
+            freed_bytes += size
+            total -= size
+
+        collected = {}
+        for name, collect in self._collectors.items():
+            try:
+                collected[name] = collect()
+            except Exception:
+                # One failing collector must not stop the others or the stats
+                collected[name] = None
+
+        recorded = {
+            'categories': self._usage(),
+            'last_gc': {
+                'finished_at': datetime.now().isoformat(),
+                'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+                'deleted_units': deleted_units,
+                'trimmed_files': trimmed_files,
+                'freed_bytes': freed_bytes,
+                'collected': collected
+            }
+        }
+        recorded['total_bytes'] = sum(usage['bytes'] for usage in recorded['categories'].values())
+        self._write_stats(recorded)
+        return recorded
+
+    def _trim(self, unit, excess, now):
+        """Delete a unit's oldest files, outside the grace period, until excess bytes are freed"""
+        files = []
+        for dir_path, _, file_names in os.walk(unit):
+            for name in file_names:
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if now - stat.st_mtime >= GC_GRACE_SECONDS:
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        removed = freed = 0
+        for _, size, path in sorted(files):
+            if freed >= excess:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            freed += size
+        return removed, freed
+
+    def _usage(self):
+        """Bytes and files stored under each top-level directory, with the caches split by kind"""
+        usage = {}
+
+        def add(category, path):
+            size, files, _ = _tree_usage(path)
+            entry = usage.setdefault(category, {'bytes': 0, 'files': 0})
+            entry['bytes'] += size
+            entry['files'] += files
+
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return usage
+        for entry in entries:
+            if entry.name in (_LOCK_NAME, _STATS_NAME):
+                continue
+            if entry.name == 'cache' and entry.is_dir():
+                for cache in os.scandir(entry.path):
+                    add(os.path.join('cache', cache.name), cache.path)
+            elif entry.is_dir():
+                add(entry.name, entry.path)
+            else:
+                add('other', entry.path)
+        return usage
+
+    def _write_stats(self, recorded):
+        stats_path = os.path.join(self.root, _STATS_NAME)
+        tmp_path = f'{stats_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(recorded, f)
+            os.replace(tmp_path, stats_path)
+        except OSError:
+            pass
@@ -215,6 +215,9 @@ document.addEventListener("DOMContentLoaded", () => {
     // Add session ID to form data
     formData.append("session_id", sessionId);
 
+    // Run the comparison as a background job and poll for its result
+    formData.append("async", "true");
+
     // Ensure files are added to FormData
     if (figmaInput.files.length > 0) {
       formData.append("figma_image", figmaInput.files[0]);
@@ -237,6 +240,7 @@ document.addEventListener("DOMContentLoaded", () => {
         console.log("Response headers:", response.headers);
         return response.json();
       })
+      .then((data) => (data.job_id ? waitForJob(data.job_id) : data))
       .then((data) => {
         if (data.error) {
           throw new Error(data.error);
@@ -280,6 +284,9 @@ document.addEventListener("DOMContentLoaded", () => {
     // Add session ID to form data
     formData.append("session_id", sessionId);
 
+    // Run the comparison as a background job and poll for its result
+    formData.append("async", "true");
+
     // Add Figma credentials
     formData.append("figma_token", document.getElementById("figma-token").value);
     formData.append("figma_file_key", document.getElementById("figma-file-key").value);
@@ -312,6 +319,7 @@ document.addEventListener("DOMContentLoaded", () => {
         console.log("Response headers:", response.headers);
         return response.json();
       })
+      .then((data) => (data.job_id ? waitForJob(data.job_id) : data))
       .then((data) => {
         if (data.error) {
           throw new Error(data.error);
@@ -483,7 +491,7 @@ document.addEventListener("DOMContentLoaded", () => {
           <div class="analysis-content" id="analysis-${difference.id}">
             <div class="issue-explanation">
               <strong>Issue Explanation:</strong><br>
-              ${analysis.explanation || 'Detailed analysis not available for this issue.'}
+              <span class="issue-explanation-text">${analysis.explanation || 'Loading analysis...'}</span>
             </div>
             
             <div class="code-snippet">
@@ -491,13 +499,13 @@ document.addEventListener("DOMContentLoaded", () => {
                 <span class="code-snippet-title">Fix Code Snippet</span>
                 <button class="copy-code-btn" onclick="copyCodeSnippet(${difference.id})">Copy Code</button>
               </div>
-              <div class="code-content" id="code-${difference.id}">${analysis.code_snippet || '// No code snippet available for this issue'}</div>
+              <div class="code-content" id="code-${difference.id}"></div>
             </div>
             
             <div class="fix-steps">
               <div class="fix-steps-title">Steps to Fix:</div>
               <ul class="fix-steps-list">
-                ${(analysis.fix_steps || ['No specific steps available']).map(step => `<li>${step}</li>`).join('')}
+                ${(analysis.fix_steps || []).map(step => `<li>${step}</li>`).join('')}
               </ul>
             </div>
           </div>
@@ -652,9 +660,46 @@ document.addEventListener("DOMContentLoaded", () => {
     } else {
       analysisContent.classList.add('active');
       toggleBtn.textContent = '📋 Hide Analysis';
+      loadIssueDetails(differenceId, analysisContent);
     }
   };
 
+  // Explanations, code snippets and fix steps are fetched when first opened
+  function loadIssueDetails(differenceId, analysisContent) {
+    if (analysisContent.dataset.detailsLoaded) {
+      return;
+    }
+    analysisContent.dataset.detailsLoaded = 'true';
+
+    const codeContent = document.getElementById(`code-${differenceId}`);
+    const difference = getDifferenceById(differenceId);
+    const analysis = (difference && difference.issue_analysis) || {};
+    if (analysis.code_snippet) {
+      codeContent.textContent = analysis.code_snippet;
+      return;
+    }
+
+    fetch(`/issue_details/${encodeURIComponent(window.currentSessionId)}/${differenceId}`)
+      .then((response) => response.json())
+      .then((data) => {
+        if (!data.success) {
+          throw new Error(data.error || 'Failed to load issue details');
+        }
+        const details = data.issue_analysis;
+        analysisContent.querySelector('.issue-explanation-text').textContent = details.explanation;
+        codeContent.textContent = details.code_snippet;
+        analysisContent.querySelector('.fix-steps-list').innerHTML =
+          details.fix_steps.map((step) => `<li>${step}</li>`).join('');
+      })
+      .catch((error) => {
+        console.error('Error loading issue details:', error);
+        analysisContent.querySelector('.issue-explanation-text').textContent =
+          'Detailed analysis not available for this issue.';
+        codeContent.textContent = '// No code snippet available for this issue';
+        delete analysisContent.dataset.detailsLoaded;
+      });
+  }
+
   window.copyCodeSnippet = function(differenceId) {
     const codeContent = document.getElementById(`code-${differenceId}`);
     const codeText = codeContent.textContent;
@@ -986,6 +1031,27 @@ function generateSessionId() {
   });
 }
 
+// Function to poll a background comparison job until it finishes and resolve with its result
+async function waitForJob(jobId, onProgress, intervalMs = 1000) {
+  while (true) {
+    const statusResponse = await fetch(`/jobs/${jobId}`);
+    const job = await statusResponse.json();
+
+    if (job.error && !job.status) {
+      return job;
+    }
+    if (onProgress) {
+      onProgress(job.progress);
+    }
+    if (job.status === 'completed' || job.status === 'failed') {
+      const resultResponse = await fetch(`/jobs/${jobId}/result`);
+      return resultResponse.json();
+    }
+
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+  }
+}
+
 // Issue Selection Functions
 function selectIssue(issueId, action) {
   issueSelections[issueId] = action;
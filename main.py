@@ -1,16 +1,155 @@
 #!/usr/bin/env python3
 """
 Main entry point for the Design Comparison Tool
+
+Serves the app with gunicorn (or waitress on Windows) across several worker
+processes; --server dev runs the Flask development server with the debugger.
+
+Usage:
+    python main.py [--server auto|gunicorn|waitress|dev] [--host 0.0.0.0] [--port 5000]
+                   [--workers N] [--threads N] [--timeout SECONDS] [--no-preload]
 """
 
-import sys
+import argparse
+import importlib.util
 import os
+import shutil
+import sys
+import tempfile
 
 # Add the current directory to the path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from backend.app import app
+SERVERS = ('auto', 'gunicorn', 'waitress', 'dev')
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def pick_server(requested):
+    """Resolve 'auto' to gunicorn on POSIX, else waitress, else the development server"""
+    if requested != 'auto':
+        return requested
+    if os.name == 'posix' and _installed('gunicorn'):
+        return 'gunicorn'
+    if _installed('waitress'):
+        return 'waitress'
+    return 'dev'
+
+
+def share_cores(workers):
+    """
+    Split the CPU cores between the server's worker processes.
+
+    Each worker runs its own bulk comparison process pool and job threads,
+    so unless BULK_MAX_WORKERS is set, every worker's pool gets its share of
+    the cores instead of all of them. Must run before the app is imported.
+    """
+    if 'BULK_MAX_WORKERS' not in os.environ:
+        os.environ['BULK_MAX_WORKERS'] = str(max(1, (os.cpu_count() or 1) // workers))
+
+
+def share_metrics():
+    """
+    Give the worker processes a fresh directory to pool their metrics in, unless METRICS_DIR is set.
+
+    Must run before the app is imported. Returns the directory to delete once
+    the server stops, or None.
+    """
+    if os.environ.get('METRICS_DIR'):
+        return None
+    os.environ['METRICS_DIR'] = tempfile.mkdtemp(prefix='design-comparison-metrics-')
+    return os.environ['METRICS_DIR']
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{args.host}:{args.port}',
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread',
+                # Workers unresponsive for longer than this (e.g. hung in native code) are restarted
+                'timeout': args.timeout,
+                'graceful_timeout': 30,
+                'keepalive': 5,
+                # Imports the app and the ML modules once, in the master
+                'preload_app': args.preload,
+                # Recycling workers bounds memory fragmented by large image buffers
+                'max_requests': args.max_requests,
+                'max_requests_jitter': args.max_requests // 10,
+                'accesslog': '-'
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if args.preload:
+                from wsgi import app
+            else:
+                from backend.app import app
+            return app
+
+    metrics_dir = share_metrics()
+    master_pid = os.getpid()
+    try:
+        Application().run()
+    finally:
+        # Workers leave run() through this block too when they exit
+        if metrics_dir and os.getpid() == master_pid:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+def run_waitress(args):
+    # Waitress runs one process, so all request threads share it; there is no fork to preload for
+    from waitress import serve
+    from wsgi import app
+    serve(app, host=args.host, port=args.port, threads=args.workers * args.threads,
+          channel_timeout=args.timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the Design Comparison Tool')
+    parser.add_argument('--server', choices=SERVERS, default=os.environ.get('WEB_SERVER', 'auto'))
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=_env_int('PORT', 5000))
+    parser.add_argument('--workers', type=int, default=_env_int('WEB_WORKERS', os.cpu_count() or 1),
+                        help='Worker processes (default: the CPU count)')
+    parser.add_argument('--threads', type=int, default=_env_int('WEB_THREADS', 4),
+                        help='Request threads per worker')
+    parser.add_argument('--timeout', type=int, default=_env_int('WEB_TIMEOUT', 120),
+                        help='Seconds a worker may stay unresponsive before it is restarted')
+    parser.add_argument('--max-requests', type=int, default=_env_int('WEB_MAX_REQUESTS', 0),
+                        help='Requests after which a worker is replaced, interrupting its running '
+                             'async jobs (default: never)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        help='Import the app in each worker, which loads the comparison modules '
+                             'on first use or through /ready')
+    args = parser.parse_args()
+
+    server = pick_server(args.server)
+    if server != 'dev':
+        share_cores(args.workers if server == 'gunicorn' else 1)
+
+    if server == 'gunicorn':
+        run_gunicorn(args)
+    elif server == 'waitress':
+        run_waitress(args)
+    else:
+        from backend.app import app
+        if args.server == 'auto':
+            print('gunicorn/waitress not installed, falling back to the development server', file=sys.stderr)
+        # Starting Design Comparison Tool
+        app.run(debug=args.server == 'dev', host=args.host, port=args.port, threaded=True)
+
 
 if __name__ == '__main__':
-    # Starting Design Comparison Tool
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    main()
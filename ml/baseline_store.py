@@ -0,0 +1,146 @@
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+
+# Arrays of a baseline, each stored as <name>.npy
+BASELINE_ARRAYS = ('figma_view', 'built_view', 'diff', 'tile_sums', 'tile_counts')
+
+# Seconds to wait for another process's comparison of the same screen, and between checks
+LOCK_TIMEOUT = 300
+LOCK_POLL_SECONDS = 0.05
+
+
+class BaselineStore:
+    """
+    Per-session, per-screen store of the last comparison, for incremental re-comparison.
+
+    Each baseline is a directory holding the compared grayscale views, the
+    uint8 SSIM map, the per-tile SSIM sums and a baseline.json with the
+    comparison key and the detected differences. A new baseline replaces the
+    previous one as a whole, so readers never see a mix of two runs.
+
+    A re-comparison loads, compares against and replaces a baseline while
+    holding locked() for its screen, so concurrent re-comparisons of the same
+    screen, in any server process, run one after the other.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+
+    @contextmanager
+    def locked(self, session_id, screen_name, timeout=LOCK_TIMEOUT):
+        """
+        Hold a screen's baseline for a load, compare and save sequence.
+
+        The lock is a file created exclusively, so it is shared by all server
+        processes; the lock of a process that died holding it is taken over.
+
+        Raises:
+            TimeoutError: If another comparison holds the lock for longer than timeout seconds
+        """
+        lock_path = self._baseline_dir(session_id, screen_name) + '.lock'
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if not _owner_alive(lock_path):
+                    try:
+                        os.remove(lock_path)
+                    except OSError:
+                        pass
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Baseline of screen {screen_name} is locked by another comparison")
+                time.sleep(LOCK_POLL_SECONDS)
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        try:
+            yield
+        finally:
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+    def load(self, session_id, screen_name):
+        """
+        Load the baseline of a screen.
+
+        Args:
+            session_id (str): Session the screen belongs to, safe to use as a path component
+            screen_name (str): Screen name, safe to use as a path component
+
+        Returns:
+            dict or None: key, differences and the BASELINE_ARRAYS, or None if there is none
+        """
+        import numpy as np
+
+        baseline_dir = self._baseline_dir(session_id, screen_name)
+        try:
+            with open(os.path.join(baseline_dir, 'baseline.json'), 'r') as f:
+                baseline = json.load(f)
+            for name in BASELINE_ARRAYS:
+                baseline[name] = np.load(os.path.join(baseline_dir, f'{name}.npy'))
+        except (OSError, ValueError, KeyError):
+            return None
+        return baseline
+
+    def save(self, session_id, screen_name, baseline):
+        """
+        Store a screen's baseline (as returned by compare_incremental), replacing the previous one.
+
+        Callers hold locked() for the screen from loading the previous baseline on.
+        """
+        import numpy as np
+
+        baseline_dir = self._baseline_dir(session_id, screen_name)
+        os.makedirs(os.path.dirname(baseline_dir), exist_ok=True)
+
+        # Write into a private directory, then swap it in
+        tmp_dir = os.path.join(os.path.dirname(baseline_dir), f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(tmp_dir)
+        try:
+            for name in BASELINE_ARRAYS:
+                np.save(os.path.join(tmp_dir, f'{name}.npy'), baseline[name])
+            with open(os.path.join(tmp_dir, 'baseline.json'), 'w') as f:
+                json.dump({key: value for key, value in baseline.items()
+                           if key not in BASELINE_ARRAYS}, f)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        old_dir = None
+        if os.path.isdir(baseline_dir):
+            old_dir = f'{tmp_dir}.old'
+            os.rename(baseline_dir, old_dir)
+        os.rename(tmp_dir, baseline_dir)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def _baseline_dir(self, session_id, screen_name):
+        return os.path.join(self.base_dir, session_id, screen_name)
+
+
+def _owner_alive(lock_path):
+    try:
+        with open(lock_path, 'r') as f:
+            content = f.read().strip()
+    except OSError:
+        # Released meanwhile
+        return False
+    if not content:
+        # Created, its pid not written yet
+        return True
+    try:
+        os.kill(int(content), 0)
+    except (OSError, ValueError):
+        return False
+    return True
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Benchmark compare_images on a deterministic synthetic corpus, stage by stage.
+
+Usage:
+    python -m ml.benchmark_comparison [--case 'mobile/*'] [--repeat 3] [--render full]
+                                      [--save-baseline FILE] [--compare FILE]
+"""
+
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.benchmark_ssim import synthetic_page
+from ml.image_comparison import ENGINES, RENDER_MODES, SSIM_MODES, compare_images
+from ml.stage_timing import STAGES, record_stages
+from ml.tiled_comparison import PeakMemory
+
+
+# Screen sizes of the corpus, from phones to 4K and full-page captures
+CORPUS_RESOLUTIONS = (
+    ('mobile', 390, 844),
+    ('tablet', 820, 1180),
+    ('desktop', 1440, 900),
+    ('4k', 3840, 2160),
+    ('full_page', 1440, 9000)
+)
+
+# Number of separate difference regions drawn on the built image
+CORPUS_DENSITIES = (
+    ('none', 0),
+    ('sparse', 10),
+    ('dense', 200),
+    ('extreme', 2000)
+)
+
+# A case regresses when it is this much slower than its baseline...
+DEFAULT_TOLERANCE = 0.15
+# ...and by at least this many milliseconds, so timer noise on fast cases is ignored
+MIN_REGRESSION_MS = 5.0
+
+
+def corpus_cases():
+    """Return the (name, width, height, regions) of every corpus case"""
+    return [(f'{resolution}/{density}', width, height, regions)
+            for resolution, width, height in CORPUS_RESOLUTIONS
+            for density, regions in CORPUS_DENSITIES]
+
+
+def synthetic_pair(width, height, regions, seed=0):
+    """
+    Build a page-like design and a built screen differing in a known number of regions.
+
+    Regions are spread over a grid whose cells are at least 16px, so
+    neighbours stay further apart than the SSIM window and small screens
+    get as many regions as fit. Each region inverts the design's pixels, so
+    it differs on any background, and is large enough to be reported. Both
+    images are PNG encoded, so the benchmark also covers decoding.
+
+    Returns:
+        tuple: (design_png, built_png) bytes
+    """
+    design, _ = synthetic_page(width, height, seed)
+    built = design.copy()
+    if regions:
+        rng = np.random.default_rng(seed + 1)
+        cell = max(16, int(np.sqrt(width * height / regions)))
+        size = max(8, cell // 2)
+        cells = [(x, y) for y in range(0, height - cell + 1, cell) for x in range(0, width - cell + 1, cell)]
+        for index in rng.permutation(len(cells))[:regions]:
+            x, y = cells[index]
+            x += int(rng.integers(0, cell - size + 1))
+            y += int(rng.integers(0, cell - size + 1))
+            built[y:y + size, x:x + size] = 255 - built[y:y + size, x:x + size]
+    return cv2.imencode('.png', design)[1].tobytes(), cv2.imencode('.png', built)[1].tobytes()
+
+
+def run_case(name, width, height, regions, repeat=3, **options):
+    """
+    Time one corpus case.
+
+    The fastest of repeat runs gives the total and per-stage timings; one
+    more run, traced, gives the peak memory of numpy buffers.
+
+    Args:
+        options: Passed to compare_images, e.g. render, engine, ssim_mode
+
+    Returns:
+        dict: Timings in milliseconds, peak_mb, megapixels_per_s and the
+            similarity and difference count, to check the output did not change
+    """
+    design, built = synthetic_pair(width, height, regions)
+    best = None
+    with tempfile.TemporaryDirectory() as output_dir:
+        for _ in range(repeat):
+            with record_stages() as timings:
+                start = time.perf_counter()
+                result = compare_images(design, built, output_dir, **options)
+                elapsed = time.perf_counter() - start
+            if best is None or elapsed < best[0]:
+                best = (elapsed, dict(timings), result)
+
+        with PeakMemory() as peak:
+            compare_images(design, built, output_dir, **options)
+
+    elapsed, timings, result = best
+    return {
+        'case': name,
+        'width': width,
+        'height': height,
+        'regions': regions,
+        'total_ms': round(elapsed * 1000, 2),
+        'stages': {key: round(timings[key] * 1000, 2) for key in STAGES if key in timings},
+        'peak_mb': round(peak.peak_bytes / (1024 * 1024), 2),
+        'megapixels_per_s': round(width * height / 1e6 / elapsed, 2),
+        'similarity': result['similarity'],
+        'differences': result['total_differences']
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Check benchmark results against a stored baseline.
+
+    Returns:
+        list: One report per case present in both, with the total time ratio,
+            whether it regressed, the stages that regressed and whether the
+            similarity or difference count changed
+    """
+    reports = []
+    for result in results:
+        previous = baseline['cases'].get(result['case'])
+        if previous is None:
+            continue
+
+        def regressed(current_ms, previous_ms):
+            return (current_ms > previous_ms * (1 + tolerance)
+                    and current_ms - previous_ms >= MIN_REGRESSION_MS)
+
+        reports.append({
+            'case': result['case'],
+            'ratio': round(result['total_ms'] / previous['total_ms'], 3) if previous['total_ms'] else None,
+            'regressed': regressed(result['total_ms'], previous['total_ms']),
+            'regressed_stages': [key for key, ms in result['stages'].items()
+                                 if regressed(ms, previous['stages'].get(key, 0.0))],
+            'output_changed': (result['similarity'], result['differences'])
+                              != (previous['similarity'], previous['differences'])
+        })
+    return reports
+
+
+def _print_results(results):
+    stages = [key for key in STAGES if any(key in result['stages'] for result in results)]
+    print(f"{'case':<20}{'total ms':>10}{'peak MB':>10}{'MP/s':>8}{'similarity':>12}{'differences':>13}")
+    for result in results:
+        print(f"{result['case']:<20}{result['total_ms']:>10.1f}{result['peak_mb']:>10.1f}"
+              f"{result['megapixels_per_s']:>8.1f}{result['similarity']:>12}{result['differences']:>13}")
+    print()
+    print(f"{'stage ms':<20}" + ''.join(f'{key:>10}' for key in stages))
+    for result in results:
+        print(f"{result['case']:<20}"
+              + ''.join(f"{result['stages'].get(key, 0.0):>10.1f}" for key in stages))
+
+
+def _print_comparison(reports):
+    print(f"{'case':<20}{'vs baseline':>12}  status")
+    for report in reports:
+        status = []
+        if report['regressed']:
+            status.append('REGRESSED')
+        if report['regressed_stages']:
+            status.append('slower stages: ' + ', '.join(report['regressed_stages']))
+        if report['output_changed']:
+            status.append('OUTPUT CHANGED')
+        ratio = f"{report['ratio']:.2f}x" if report['ratio'] is not None else '-'
+        print(f"{report['case']:<20}{ratio:>12}  {'; '.join(status) or 'ok'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--case', action='append',
+                        help="Cases to run, as names or shell patterns, e.g. 'mobile/*' (default: all)")
+    parser.add_argument('--list', action='store_true', help='List the corpus cases and exit')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--render', choices=RENDER_MODES, default='full')
+    parser.add_argument('--engine', choices=ENGINES, default='frame')
+    parser.add_argument('--ssim-mode', choices=SSIM_MODES, default='full')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Store the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare with a stored baseline; exits with status 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Slowdown ratio over the baseline counted as a regression')
+    args = parser.parse_args()
+
+    cases = corpus_cases()
+    if args.case:
+        cases = [case for case in cases
+                 if any(fnmatch.fnmatchcase(case[0], pattern) for pattern in args.case)]
+    if args.list or not cases:
+        for name, width, height, regions in cases:
+            print(f'{name:<20}{width}x{height}, {regions} regions')
+        return 0 if cases else 1
+
+    settings = {'repeat': args.repeat, 'render': args.render, 'engine': args.engine,
+                'ssim_mode': args.ssim_mode}
+    print(f"best of {args.repeat}, render={args.render}, engine={args.engine}, "
+          f"ssim_mode={args.ssim_mode} (peak memory of numpy allocations)")
+    results = [run_case(*case, repeat=args.repeat, render=args.render, engine=args.engine,
+                        ssim_mode=args.ssim_mode)
+               for case in cases]
+    _print_results(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(),
+                'machine': {'platform': platform.platform(), 'python': platform.python_version(),
+                            'opencv': cv2.__version__, 'cpus': os.cpu_count()},
+                'settings': settings,
+                'cases': {result['case']: result for result in results}
+            }, f, indent=2)
+        print(f'\nBaseline saved to {args.save_baseline}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        print()
+        if baseline.get('settings') != settings:
+            print(f"Warning: the baseline was run with {baseline.get('settings')}")
+        reports = compare_to_baseline(results, baseline, args.tolerance)
+        _print_comparison(reports)
+        if any(report['regressed'] or report['output_changed'] for report in reports):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
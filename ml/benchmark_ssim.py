@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark the SSIM modes and comparison engines on a synthetic full-page capture.
+
+Usage:
+    python -m ml.benchmark_ssim [--width 1440] [--height 9000] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.image_comparison import compare_images
+
+
+# (engine, ssim_mode) combinations to compare
+CONFIGURATIONS = (('frame', 'full'), ('frame', 'pyramid'), ('tiled', 'full'))
+
+
+def synthetic_page(width, height, seed=0):
+    """Build a page-like design image and a built image with a few localized differences"""
+    rng = np.random.default_rng(seed)
+    design = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    # Cards and text-like lines down the page
+    for top in range(40, height - 200, 240):
+        left = int(rng.integers(20, 120))
+        color = tuple(int(c) for c in rng.integers(150, 240, 3))
+        cv2.rectangle(design, (left, top), (width - left, top + 180), color, -1)
+        for line in range(4):
+            y = top + 30 + line * 35
+            length = int(rng.integers(200, max(width // 2, 201)))
+            cv2.rectangle(design, (left + 30, y), (left + 30 + length, y + 12), (40, 40, 40), -1)
+
+    built = design.copy()
+    for _ in range(6):
+        x = int(rng.integers(0, width - 200))
+        y = int(rng.integers(0, height - 100))
+        cv2.rectangle(built, (x, y), (x + 160, y + 60), (0, 0, 0), -1)
+    return design, built
+
+
+def run(design, built, engine, ssim_mode, repeat):
+    timings = []
+    peak_bytes = 0
+    result = None
+    with tempfile.TemporaryDirectory() as output_dir:
+        for _ in range(repeat):
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = compare_images(design, built, output_dir, render='none',
+                                    ssim_mode=ssim_mode, engine=engine)
+            timings.append(time.perf_counter() - start)
+            peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return {
+        'mode': f'{engine}/{ssim_mode}',
+        'best_ms': min(timings) * 1000,
+        'peak_mb': peak_bytes / (1024 * 1024),
+        'similarity': result['similarity'],
+        'differences': result['total_differences']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--width', type=int, default=1440)
+    parser.add_argument('--height', type=int, default=9000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    design, built = synthetic_page(args.width, args.height)
+    print(f'{args.width}x{args.height}, best of {args.repeat} (peak memory of numpy allocations)')
+    print(f"{'mode':<15}{'time ms':>10}{'peak MB':>10}{'similarity':>12}{'differences':>13}")
+    for engine, ssim_mode in CONFIGURATIONS:
+        stats = run(design, built, engine, ssim_mode, args.repeat)
+        print(f"{stats['mode']:<15}{stats['best_ms']:>10.0f}{stats['peak_mb']:>10.1f}"
+              f"{stats['similarity']:>12}{stats['differences']:>13}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from ml.image_comparison import compare_images
+from ml.stage_timing import add_stage_time, record_stages
+
+
+# Shared process pool, created lazily on the first bulk run
+_executor = None
+_executor_workers = None
+# Request threads and job workers run bulk comparisons concurrently; guards creating and dropping the pool
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    """Keep each worker single-threaded so N workers use N cores, not N * cores."""
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def get_executor(max_workers):
+    """
+    Return the shared process pool, (re)creating it when the size changes.
+
+    The pool uses the spawn start method because OpenCV's internal thread
+    pools are not safe to fork from a threaded Flask server.
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker)
+            _executor_workers = max_workers
+        return _executor
+
+
+def _reset_executor(broken):
+    """Drop a broken pool so the next bulk run starts a fresh one."""
+    global _executor, _executor_workers
+    with _executor_lock:
+        # Another run may have replaced it already
+        if _executor is not broken:
+            return
+        _executor.shutdown(wait=False)
+        _executor = None
+        _executor_workers = None
+
+
+def task_sources(task):
+    """Return the (figma, built) images of a task: in-memory bytes when present, else file paths"""
+    return (task['figma_bytes'] if 'figma_bytes' in task else task['figma_path'],
+            task['built_bytes'] if 'built_bytes' in task else task['built_path'])
+
+
+def compare_screen(task):
+    """
+    Compare one screen of a bulk run. Never raises: failures are reported in the result.
+
+    Args:
+        task (dict): Screen task with name, output_dir, the images as
+            figma_path/built_path or figma_bytes/built_bytes, and optional
+            name_prefix and options (compare_images keyword arguments)
+
+    Returns:
+        dict: Comparison result with screen_name, status and elapsed_ms added
+    """
+    start = time.perf_counter()
+    try:
+        figma_source, built_source = task_sources(task)
+        result = compare_images(
+            figma_source, built_source, task['output_dir'],
+            name_prefix=task.get('name_prefix', ''), **task.get('options', {}))
+        result['status'] = 'success'
+    except Exception as e:
+        result = {'status': 'error', 'error': str(e)}
+    result['screen_name'] = task['name']
+    result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+
+def _pooled_compare_screen(task):
+    # Stage timings of a worker process are sent back with its result, so the
+    # parent can account them
+    with record_stages() as timings:
+        result = compare_screen(task)
+    return result, timings
+
+
+def run_bulk_comparison(tasks, max_workers=None, progress_callback=None):
+    """
+    Compare many screens in parallel across a process pool.
+
+    Args:
+        tasks (list): Screen task dicts as accepted by compare_screen
+        max_workers (int, optional): Pool size, defaults to the CPU count
+        progress_callback (callable, optional): Called as
+            progress_callback(completed, total, result) each time a screen finishes
+
+    Returns:
+        list: One result per task, in the same order as the tasks
+    """
+    if not tasks:
+        return []
+
+    max_workers = max(1, max_workers or os.cpu_count() or 1)
+    total = len(tasks)
+
+    # A pool is not worth starting for a single screen or a single worker
+    if max_workers == 1 or total == 1:
+        results = []
+        for task in tasks:
+            results.append(compare_screen(task))
+            if progress_callback:
+                progress_callback(len(results), total, results[-1])
+        return results
+
+    executor = get_executor(max_workers)
+    futures = {executor.submit(_pooled_compare_screen, task): index
+               for index, task in enumerate(tasks)}
+
+    results = [None] * total
+    completed = 0
+    pool_broken = False
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            results[index], timings = future.result()
+            for name, seconds in timings.items():
+                add_stage_time(name, seconds)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed by the OOM killer); only its screens fail
+            pool_broken = True
+            results[index] = {
+                'status': 'error',
+                'error': 'Comparison worker process terminated unexpectedly',
+                'screen_name': tasks[index]['name'],
+                'elapsed_ms': 0
+            }
+        completed += 1
+        if progress_callback:
+            progress_callback(completed, total, results[index])
+
+    if pool_broken:
+        _reset_executor(executor)
+
+    return results
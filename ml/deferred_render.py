@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+
+
+# A pending annotated image has this sidecar next to its (not yet written) path
+PENDING_SUFFIX = '.pending.json'
+
+_render_lock = threading.Lock()
+
+
+def defer_rendering(result, figma_path, built_path):
+    """
+    Record how to render the images a comparison skipped, so they can be produced on first request.
+
+    Removes the render spec from the result and writes a sidecar next to each
+    pending image path. The original images must stay at figma_path and
+    built_path until the images are rendered.
+
+    Args:
+        result (dict): Comparison result as returned by compare_images
+        figma_path (str): Figma image file the comparison was run on
+        built_path (str): Built image file the comparison was run on
+    """
+    from ml.image_comparison import ARTIFACT_KEYS
+
+    spec = result.pop('render', None)
+    pending_images = result.get('pending_images')
+    if spec is None or not pending_images:
+        return
+
+    spec = dict(spec)
+    spec.update({
+        'figma_path': os.path.abspath(figma_path),
+        'built_path': os.path.abspath(built_path),
+        'artifact_paths': {key: os.path.abspath(result[key]) for key in ARTIFACT_KEYS},
+        'pending_images': pending_images
+    })
+    for key in pending_images:
+        with open(result[key] + PENDING_SUFFIX, 'w') as f:
+            json.dump(spec, f)
+
+
+def render_pending(image_path):
+    """
+    Render a deferred annotated image if it has not been written yet.
+
+    All still-pending images of the same comparison are rendered together,
+    since decoding and resizing the originals is the expensive part.
+
+    If the originals can no longer be read (e.g. the storage collector
+    trimmed them), the comparison's pending sidecars are deleted, so the
+    images are reported missing from then on.
+
+    Returns:
+        bool: True if the image was rendered by this call
+    """
+    sidecar_path = image_path + PENDING_SUFFIX
+    if os.path.exists(image_path) or not os.path.exists(sidecar_path):
+        return False
+
+    with _render_lock:
+        # Another request may have rendered it while we waited
+        if os.path.exists(image_path):
+            return False
+        try:
+            with open(sidecar_path, 'r') as f:
+                spec = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        # Imported only now: every file served from the upload folder is checked
+        # here, and most have nothing pending
+        import numpy as np
+        from ml.image_comparison import apply_alignment, load_image, render_artifacts, resize_to_match
+
+        artifact_paths = spec['artifact_paths']
+        keys = [key for key in spec['pending_images']
+                if not os.path.exists(artifact_paths[key])]
+
+        try:
+            built_img = load_image(spec['built_path'])
+            figma_img = resize_to_match(load_image(spec['figma_path']), built_img, spec['resize_mode'])
+            figma_img = apply_alignment(figma_img, built_img, spec.get('alignment'))
+            regions = [(np.array(region['contour'], dtype=np.int32).reshape(-1, 1, 2), region['missing'])
+                       for region in spec['regions']]
+            render_artifacts(figma_img, built_img, regions, artifact_paths, keys)
+            rendered = True
+        except Exception:
+            # Missing or unreadable originals fail the same way on every retry
+            keys = spec['pending_images']
+            rendered = False
+
+        for key in keys:
+            try:
+                os.remove(artifact_paths[key] + PENDING_SUFFIX)
+            except OSError:
+                pass
+    return rendered
@@ -1,27 +1,92 @@
 import requests
 import base64
+import hashlib
 import io
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import os
 from datetime import datetime
 
+from ml.figma_transport import get_default_transport, API_TIMEOUT, RENDER_TIMEOUT, DOWNLOAD_TIMEOUT
+from ml.result_cache import link_or_copy
+from ml.stage_timing import stage
+
+
+# Figma REST API root; override (e.g. with a local stub server) via FIGMA_API_URL
+DEFAULT_BASE_URL = os.environ.get('FIGMA_API_URL', 'https://api.figma.com/v1')
+
+# Node ids per /images request, keeps the query string well under URL length limits
+EXPORT_BATCH_SIZE = 50
+
+# Largest rendered image accepted from the Figma CDN
+MAX_IMAGE_BYTES = 64 * 1024 * 1024
+
+# Chunk size used when streaming downloads to disk
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Leading bytes of the raster formats Figma exports
+IMAGE_SIGNATURES = {
+    'png': b'\x89PNG\r\n\x1a\n',
+    'jpg': b'\xff\xd8\xff'
+}
+
+
+def _first_frame_id(document):
+    """Find the id of the first frame on the first page of a file document"""
+    if 'children' not in (document or {}):
+        return False, "Invalid file structure"
+    pages = document['children']
+    if not pages:
+        return False, "No pages found in the file"
+    first_page = pages[0]
+    if 'children' in first_page and first_page['children']:
+        return True, first_page['children'][0]['id']
+    return False, "No frames found in the first page"
+
 
 class FigmaService:
     """Service class to interact with Figma API"""
+
+    # Successful token validations shared by all instances, keyed by token hash
+    _token_cache = {}
+    _token_cache_lock = threading.Lock()
     
-    def __init__(self, access_token):
+    def __init__(self, access_token, cache_dir=None, token_ttl=300, transport=None, base_url=None,
+                 max_image_bytes=MAX_IMAGE_BYTES):
         self.access_token = access_token
-        self.base_url = "https://api.figma.com/v1"
+        self.base_url = base_url or DEFAULT_BASE_URL
         self.headers = {
             "X-Figma-Token": access_token
         }
+        # Directory for cached file metadata and rendered images (None disables it)
+        self.cache_dir = cache_dir
+        # Seconds a successful token validation is reused (0 disables it)
+        self.token_ttl = token_ttl
+        # Shared keep-alive, retrying HTTP transport (see ml/figma_transport.py)
+        self.transport = transport or get_default_transport()
+        # Downloads larger than this are aborted
+        self.max_image_bytes = max_image_bytes
     
     def validate_token(self):
-        """Validate the Figma access token"""
+        """Validate the Figma access token, reusing a recent successful validation"""
+        token_key = hashlib.sha256(self.access_token.encode('utf-8')).hexdigest()
+        with self._token_cache_lock:
+            cached = self._token_cache.get(token_key)
+        if cached and cached[0] > time.time():
+            return True, cached[1]
+
         try:
-            response = requests.get(f"{self.base_url}/me", headers=self.headers)
+            response = self._api_get(f"{self.base_url}/me", headers=self.headers, timeout=API_TIMEOUT)
             if response.status_code == 200:
-                return True, response.json()
+                user_info = response.json()
+                if self.token_ttl > 0:
+                    with self._token_cache_lock:
+                        self._token_cache[token_key] = (time.time() + self.token_ttl, user_info)
+                return True, user_info
             else:
                 return False, f"Invalid token: {response.status_code} - {response.text}"
         except Exception as e:
@@ -30,7 +95,7 @@ class FigmaService:
     def get_file_info(self, file_key):
         """Get information about a Figma file"""
         try:
-            response = requests.get(f"{self.base_url}/files/{file_key}", headers=self.headers)
+            response = self._api_get(f"{self.base_url}/files/{file_key}", headers=self.headers, timeout=API_TIMEOUT)
             if response.status_code == 200:
                 return True, response.json()
             else:
@@ -38,10 +103,111 @@ class FigmaService:
         except Exception as e:
             return False, f"Error getting file info: {str(e)}"
     
+    def get_file_version(self, file_key, depth=1):
+        """
+        Get a file's version and top-level structure without the full document.
+
+        With depth=1 only the pages are returned; depth=2 also lists each page's
+        top-level frames. The result is cached on disk and revalidated with the
+        stored ETag, so an unchanged file costs one small conditional request.
+
+        Returns:
+            tuple: (success: bool, result: dict with version, last_modified, name,
+                pages_count and first_frame_id, or an error message)
+        """
+        try:
+            cached = self._load_file_meta(file_key)
+            headers = dict(self.headers)
+            if cached and cached.get('depth') == depth and cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+
+            response = self._api_get(
+                f"{self.base_url}/files/{file_key}?depth={depth}", headers=headers, timeout=API_TIMEOUT)
+
+            if response.status_code == 304 and cached:
+                return True, cached
+            if response.status_code != 200:
+                return False, f"Error fetching file: {response.status_code} - {response.text}"
+
+            data = response.json()
+            document = data.get('document', {})
+            frame_found, first_frame = _first_frame_id(document) if depth >= 2 else (False, None)
+            meta = {
+                'file_key': file_key,
+                'name': data.get('name'),
+                'version': data.get('version'),
+                'last_modified': data.get('lastModified'),
+                'pages_count': len(document.get('children', [])),
+                'first_frame_id': first_frame if frame_found else None,
+                'first_frame_error': None if frame_found else first_frame,
+                'depth': depth,
+                'etag': response.headers.get('ETag')
+            }
+            self._save_file_meta(file_key, meta)
+            return True, meta
+        except Exception as e:
+            return False, f"Error getting file version: {str(e)}"
+
+    def _api_get(self, url, **kwargs):
+        """GET a Figma API URL through the transport, timed as the figma_api stage"""
+        with stage('figma_api'):
+            return self.transport.get(url, **kwargs)
+
+    def get_cached_image(self, file_key, node_id, format, scale, version):
+        """Return the path of a cached render of this exact file version, or None"""
+        path = self._image_cache_path(file_key, node_id, format, scale, version)
+        if path and os.path.exists(path):
+            return path
+        return None
+
+    def cache_image(self, image_path, file_key, node_id, format, scale, version):
+        """Store a rendered image in the cache for this file version"""
+        path = self._image_cache_path(file_key, node_id, format, scale, version)
+        if not path or not version:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            link_or_copy(image_path, path)
+        except OSError:
+            pass
+
+    def _image_cache_path(self, file_key, node_id, format, scale, version):
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha256(
+            json.dumps([file_key, node_id, format, scale, version]).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'images', f"{key}.{format}")
+
+    def _file_meta_path(self, file_key):
+        safe_key = hashlib.sha256(file_key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, 'files', f"{safe_key}.json")
+
+    def _load_file_meta(self, file_key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._file_meta_path(file_key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_file_meta(self, file_key, meta):
+        if not self.cache_dir:
+            return
+        path = self._file_meta_path(file_key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
     def get_node_info(self, file_key, node_id):
         """Get information about a specific node in the file"""
         try:
-            response = requests.get(f"{self.base_url}/files/{file_key}/nodes?ids={node_id}", headers=self.headers)
+            response = self._api_get(f"{self.base_url}/files/{file_key}/nodes?ids={node_id}", headers=self.headers, timeout=API_TIMEOUT)
             if response.status_code == 200:
                 return True, response.json()
             else:
@@ -65,31 +231,20 @@ class FigmaService:
                 url = f"{self.base_url}/images/{file_key}?ids={node_id}&format={format}&scale={scale}"
                 # Exporting node
             else:
-                # For entire file export, we need to get the main frame first
-                # Exporting entire file
-                file_success, file_info = self.get_file_info(file_key)
+                # For entire file export, we need to get the main frame first.
+                # Pages and their top-level frames are enough, not the full document.
+                file_success, file_meta = self.get_file_version(file_key, depth=2)
                 if not file_success:
-                    return False, f"Could not access file: {file_info}"
+                    return False, f"Could not access file: {file_meta}"
                 
                 # Get the first page and its first frame
-                if 'document' in file_info and 'children' in file_info['document']:
-                    pages = file_info['document']['children']
-                    if pages:
-                        first_page = pages[0]
-                        if 'children' in first_page and first_page['children']:
-                            first_frame = first_page['children'][0]
-                            node_id = first_frame['id']
-                            url = f"{self.base_url}/images/{file_key}?ids={node_id}&format={format}&scale={scale}"
-                            # Using first frame
-                        else:
-                            return False, "No frames found in the first page"
-                    else:
-                        return False, "No pages found in the file"
-                else:
-                    return False, "Invalid file structure"
+                if not file_meta['first_frame_id']:
+                    return False, file_meta['first_frame_error']
+                node_id = file_meta['first_frame_id']
+                url = f"{self.base_url}/images/{file_key}?ids={node_id}&format={format}&scale={scale}"
             
             # Making API request
-            response = requests.get(url, headers=self.headers, timeout=30)
+            response = self._api_get(url, headers=self.headers, timeout=RENDER_TIMEOUT)
             
             if response.status_code == 200:
                 try:
@@ -117,11 +272,166 @@ class FigmaService:
         except Exception as e:
             return False, f"Error exporting image: {str(e)}"
     
+    def get_image_urls(self, file_key, node_ids, format="png", scale=2):
+        """
+        Render several nodes with one /images request per batch.
+
+        Returns:
+            tuple: (success: bool, result: dict mapping node id to its image URL,
+                or None when the node could not be rendered, or an error message)
+        """
+        image_urls = {}
+        for start in range(0, len(node_ids), EXPORT_BATCH_SIZE):
+            batch = node_ids[start:start + EXPORT_BATCH_SIZE]
+            url = f"{self.base_url}/images/{file_key}?ids={','.join(batch)}&format={format}&scale={scale}"
+            response = self._api_get(url, headers=self.headers, timeout=RENDER_TIMEOUT)
+
+            if response.status_code != 200:
+                try:
+                    error_data = response.json()
+                    error_msg = error_data.get('message', error_data.get('err', 'Unknown error'))
+                except Exception:
+                    error_msg = response.text if response.text else "No error details"
+                return False, f"Error exporting images: HTTP {response.status_code} - {error_msg}"
+
+            data = response.json()
+            if data.get('err'):
+                return False, f"Figma API error: {data['err']}"
+
+            images = data.get('images') or {}
+            for node_id in batch:
+                image_urls[node_id] = images.get(node_id) or None
+        return True, image_urls
+
+    def export_images(self, file_key, node_ids, format="png", scale=2, max_downloads=8):
+        """
+        Export several nodes with one render request per batch and download them concurrently.
+
+        Args:
+            file_key (str): Figma file key
+            node_ids (list): Node ids to export
+            format (str): Export format
+            scale (int): Export scale
+            max_downloads (int): Number of images downloaded in parallel
+
+        Returns:
+            tuple: (success: bool, result: dict mapping node id to a
+                (success, PIL.Image or error message) tuple, or an error message)
+        """
+        return self._export_many(
+            file_key, node_ids, format, scale, max_downloads,
+            lambda node_id, image_url: self._download_image(image_url))
+
+    def export_images_to_files(self, file_key, output_paths, format="png", scale=2, max_downloads=8):
+        """
+        Export several nodes and stream each rendered image straight to its file.
+
+        Unlike export_images, nothing is decoded or re-encoded: the bytes from
+        the CDN are written to disk as they arrive.
+
+        Args:
+            file_key (str): Figma file key
+            output_paths (dict): Destination path for each node id
+            format (str): Export format
+            scale (int): Export scale
+            max_downloads (int): Number of images downloaded in parallel
+
+        Returns:
+            tuple: (success: bool, result: dict mapping node id to a
+                (success, image path or error message) tuple, or an error message)
+        """
+        return self._export_many(
+            file_key, list(output_paths), format, scale, max_downloads,
+            lambda node_id, image_url: self.download_image_to_file(
+                image_url, output_paths[node_id], format))
+
+    def _export_many(self, file_key, node_ids, format, scale, max_downloads, download):
+        try:
+            file_key = file_key.strip()
+            if not file_key:
+                return False, "File key is empty"
+
+            node_ids = list(dict.fromkeys(node_id.strip() for node_id in node_ids if node_id.strip()))
+            if not node_ids:
+                return False, "No node IDs to export"
+
+            urls_success, image_urls = self.get_image_urls(file_key, node_ids, format, scale)
+            if not urls_success:
+                return False, image_urls
+
+            results = {node_id: (False, "No image URL returned - the node might not be exportable")
+                       for node_id, image_url in image_urls.items() if not image_url}
+            to_download = {node_id: image_url for node_id, image_url in image_urls.items() if image_url}
+
+            with ThreadPoolExecutor(max_workers=max(1, min(max_downloads, len(to_download) or 1))) as executor:
+                downloads = {node_id: executor.submit(download, node_id, image_url)
+                             for node_id, image_url in to_download.items()}
+                for node_id, future in downloads.items():
+                    results[node_id] = future.result()
+
+            return True, results
+        except Exception as e:
+            return False, f"Error exporting images: {str(e)}"
+
+    def download_image_to_file(self, image_url, output_path, format="png"):
+        """
+        Stream an image from URL straight to a file, enforcing max_image_bytes.
+
+        The file appears at output_path only once the download is complete.
+
+        Returns:
+            tuple: (success: bool, result: output path or error message)
+        """
+        tmp_path = f"{output_path}.{uuid.uuid4().hex}.part"
+        try:
+            # Headers and body, as the body streams in after get() returns
+            with stage('figma_download'):
+                response = self.transport.get(image_url, timeout=DOWNLOAD_TIMEOUT, stream=True)
+                with response:
+                    if response.status_code != 200:
+                        return False, f"Error downloading image: HTTP {response.status_code}"
+
+                    content_length = int(response.headers.get('content-length') or 0)
+                    if content_length > self.max_image_bytes:
+                        return False, f"Image is too large ({content_length} bytes, limit {self.max_image_bytes})"
+
+                    written = 0
+                    header = b''
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            if not chunk:
+                                continue
+                            written += len(chunk)
+                            if written > self.max_image_bytes:
+                                raise ValueError(f"Image exceeds the {self.max_image_bytes} byte limit")
+                            if len(header) < 16:
+                                header += chunk[:16 - len(header)]
+                            f.write(chunk)
+
+            if written == 0:
+                raise ValueError("Downloaded image is empty (0 bytes)")
+            signature = IMAGE_SIGNATURES.get(format)
+            if signature and not header.startswith(signature):
+                raise ValueError(f"Downloaded content is not a {format.upper()} image")
+
+            os.replace(tmp_path, output_path)
+            return True, output_path
+        except requests.exceptions.Timeout:
+            return False, "Timeout while downloading image"
+        except requests.exceptions.RequestException as e:
+            return False, f"Network error downloading image: {str(e)}"
+        except Exception as e:
+            return False, f"Error downloading image: {str(e)}"
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
     def _download_image(self, image_url):
         """Download image from URL and convert to PIL Image"""
         try:
             # Downloading image
-            response = requests.get(image_url, timeout=30)
+            with stage('figma_download'):
+                response = self.transport.get(image_url, timeout=DOWNLOAD_TIMEOUT)
             
             if response.status_code == 200:
                 # Check content type
@@ -145,13 +455,6 @@ class FigmaService:
                     image.load()
                     return True, image
                 except Exception as img_error:
-                    # Try to save the raw content for debugging
-                    try:
-                        debug_path = "debug_downloaded_image.bin"
-                        with open(debug_path, 'wb') as f:
-                            f.write(response.content)
-                    except:
-                        pass
                     return False, f"Error opening image with PIL: {str(img_error)}"
             else:
                 error_text = response.text if response.text else "No error details"
@@ -172,7 +475,8 @@ class FigmaService:
             return False, f"Error saving image: {str(e)}"
 
 
-def fetch_figma_design(access_token, file_key, node_id=None, output_dir=None):
+def fetch_figma_design(access_token, file_key, node_id=None, output_dir=None, cache_dir=None,
+                       token_ttl=300):
     """
     Fetch a design from Figma and save it as an image
     
@@ -181,23 +485,61 @@ def fetch_figma_design(access_token, file_key, node_id=None, output_dir=None):
         file_key (str): Figma file key
         node_id (str, optional): Specific node ID to export
         output_dir (str, optional): Directory to save the image
+        cache_dir (str, optional): Directory caching file metadata and renders;
+            an unchanged design is then served from disk after one version check
+        token_ttl (int, optional): Seconds a successful token validation is reused
         
     Returns:
         tuple: (success: bool, result: str or PIL.Image)
     """
     try:
         # Initialize Figma service
-        figma_service = FigmaService(access_token)
+        figma_service = FigmaService(access_token, cache_dir=cache_dir, token_ttl=token_ttl)
         
         # Validate token
         is_valid, token_result = figma_service.validate_token()
         if not is_valid:
             return False, f"Token validation failed: {token_result}"
         
-        # Get file info
-        file_success, file_info = figma_service.get_file_info(file_key)
+        # Get file version (and the first frame when exporting the whole file)
+        file_key = file_key.strip()
+        node_id = node_id.strip() if node_id else None
+        file_success, file_meta = figma_service.get_file_version(
+            file_key, depth=1 if node_id else 2)
         if not file_success:
-            return False, f"File access failed: {file_info}"
+            return False, f"File access failed: {file_meta}"
+
+        if not node_id:
+            if not file_meta['first_frame_id']:
+                return False, f"Image export failed: {file_meta['first_frame_error']}"
+            node_id = file_meta['first_frame_id']
+
+        # Serve an unchanged design from the render cache
+        version = file_meta['version']
+        cached_path = figma_service.get_cached_image(file_key, node_id, 'png', 2, version)
+        if cached_path:
+            if not output_dir:
+                image = Image.open(cached_path)
+                image.load()
+                return True, image
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_path = os.path.join(output_dir, f"figma_design_{timestamp}.png")
+            link_or_copy(cached_path, output_path)
+            return True, output_path
+
+        # Stream the render straight to disk when the caller wants a file
+        if output_dir:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_path = os.path.join(output_dir, f"figma_design_{timestamp}.png")
+            export_success, exported = figma_service.export_images_to_files(
+                file_key, {node_id: output_path})
+            if not export_success:
+                return False, f"Image export failed: {exported}"
+            image_success, image_result = exported[node_id]
+            if not image_success:
+                return False, f"Image export failed: {image_result}"
+            figma_service.cache_image(output_path, file_key, node_id, 'png', 2, version)
+            return True, output_path
         
         # Export image
         export_success, export_result = figma_service.export_image(file_key, node_id)
@@ -210,20 +552,78 @@ def fetch_figma_design(access_token, file_key, node_id=None, output_dir=None):
             error_msg = f"Invalid export result type: {type(export_result)}. Expected PIL.Image"
             return False, error_msg
         
-        # Save image if output directory is provided
-        if output_dir:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"figma_design_{timestamp}.png"
-            output_path = os.path.join(output_dir, filename)
-            
-            save_success, save_result = figma_service.save_image(export_result, output_path)
-            if save_success:
-                return True, output_path
-            else:
-                error_msg = f"Failed to save image: {save_result}"
-                return False, error_msg
-        
         return True, export_result
         
     except Exception as e:
-        return False, f"Error fetching Figma design: {str(e)}" 
\ No newline at end of file
+        return False, f"Error fetching Figma design: {str(e)}"
+
+
+def fetch_figma_designs(access_token, file_key, node_ids, output_dir, cache_dir=None,
+                        token_ttl=300):
+    """
+    Fetch several frames of one Figma file and save them as images
+
+    Frames already rendered for the current file version come from the cache;
+    the rest are exported in batched render requests and downloaded concurrently.
+    
+    Args:
+        access_token (str): Figma access token
+        file_key (str): Figma file key
+        node_ids (list): Node IDs of the frames to export
+        output_dir (str): Directory to save the images
+        cache_dir (str, optional): Directory caching file metadata and renders
+        token_ttl (int, optional): Seconds a successful token validation is reused
+        
+    Returns:
+        tuple: (success: bool, result: dict mapping node id to a
+            (success, image path or error message) tuple, or an error message)
+    """
+    try:
+        figma_service = FigmaService(access_token, cache_dir=cache_dir, token_ttl=token_ttl)
+
+        is_valid, token_result = figma_service.validate_token()
+        if not is_valid:
+            return False, f"Token validation failed: {token_result}"
+
+        file_key = file_key.strip()
+        file_success, file_meta = figma_service.get_file_version(file_key, depth=1)
+        if not file_success:
+            return False, f"File access failed: {file_meta}"
+        version = file_meta['version']
+
+        node_ids = list(dict.fromkeys(node_id.strip() for node_id in node_ids if node_id.strip()))
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        def output_path_for(node_id):
+            safe_node_id = ''.join(c if c.isalnum() else '_' for c in node_id)
+            return os.path.join(output_dir, f"figma_design_{safe_node_id}_{timestamp}.png")
+
+        results = {}
+        to_export = []
+        for node_id in node_ids:
+            cached_path = figma_service.get_cached_image(file_key, node_id, 'png', 2, version)
+            if cached_path:
+                output_path = output_path_for(node_id)
+                link_or_copy(cached_path, output_path)
+                results[node_id] = (True, output_path)
+            else:
+                to_export.append(node_id)
+
+        if to_export:
+            export_success, exported = figma_service.export_images_to_files(
+                file_key, {node_id: output_path_for(node_id) for node_id in to_export})
+            if not export_success:
+                return False, f"Image export failed: {exported}"
+
+            for node_id in to_export:
+                image_success, image_result = exported[node_id]
+                if not image_success:
+                    results[node_id] = (False, f"Image export failed: {image_result}")
+                    continue
+                figma_service.cache_image(image_result, file_key, node_id, 'png', 2, version)
+                results[node_id] = (True, image_result)
+
+        return True, results
+
+    except Exception as e:
+        return False, f"Error fetching Figma designs: {str(e)}"
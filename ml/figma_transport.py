@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+# Responses worth retrying: rate limiting and transient gateway/server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# (connect, read) timeouts in seconds
+API_TIMEOUT = (5, 30)
+RENDER_TIMEOUT = (5, 60)
+DOWNLOAD_TIMEOUT = (5, 60)
+
+
+class _CountingAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools report every new connection (TCP + TLS handshake)"""
+
+    def __init__(self, on_new_connection, **kwargs):
+        self._on_new_connection = on_new_connection
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        on_new_connection = self._on_new_connection
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                on_new_connection(self.host)
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                on_new_connection(self.host)
+                return super()._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class FigmaTransport:
+    """
+    Shared HTTP transport for the Figma API and image CDN.
+
+    Keeps connections alive across FigmaService instances, applies default
+    timeouts, retries rate-limited and transient failures with exponential
+    backoff (honouring Retry-After) and records request metrics.
+    """
+
+    def __init__(self, max_retries=3, backoff_base=0.5, max_backoff=30,
+                 pool_connections=4, pool_maxsize=16):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = _CountingAdapter(
+            self._record_connection,
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._metrics = self._empty_metrics()
+
+    def get(self, url, headers=None, timeout=API_TIMEOUT, **kwargs):
+        """GET a URL with retries; returns the final response or raises the last network error"""
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, headers=headers, timeout=timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._record_request(None, time.perf_counter() - start)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                self._record_request(response.status_code, time.perf_counter() - start)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if retry_after is not None and retry_after > self.max_backoff:
+                    # Waiting that long would hold a worker; let the caller fail fast
+                    return response
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                response.close()
+
+            attempt += 1
+            with self._lock:
+                self._metrics['retries'] += 1
+            time.sleep(delay)
+
+    def stats(self):
+        """Return a snapshot of the request metrics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['status_counts'] = dict(self._metrics['status_counts'])
+            metrics['connections_by_host'] = dict(self._metrics['connections_by_host'])
+        requests_count = metrics['requests']
+        metrics['latency_avg_ms'] = round(metrics['latency_total_ms'] / requests_count, 2) if requests_count else 0.0
+        metrics['latency_total_ms'] = round(metrics['latency_total_ms'], 2)
+        metrics['latency_max_ms'] = round(metrics['latency_max_ms'], 2)
+        return metrics
+
+    def reset_stats(self):
+        with self._lock:
+            self._metrics = self._empty_metrics()
+
+    def _backoff(self, attempt):
+        delay = self.backoff_base * (2 ** attempt)
+        # Jitter spreads out retries from concurrent workers
+        return min(self.max_backoff, delay + random.uniform(0, delay / 2))
+
+    def _record_connection(self, host):
+        with self._lock:
+            self._metrics['connections_opened'] += 1
+            by_host = self._metrics['connections_by_host']
+            by_host[host] = by_host.get(host, 0) + 1
+
+    def _record_request(self, status_code, elapsed):
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            self._metrics['requests'] += 1
+            self._metrics['latency_total_ms'] += elapsed_ms
+            self._metrics['latency_max_ms'] = max(self._metrics['latency_max_ms'], elapsed_ms)
+            if status_code is None:
+                self._metrics['network_errors'] += 1
+                return
+            if status_code == 429:
+                self._metrics['rate_limited'] += 1
+            status_counts = self._metrics['status_counts']
+            status_counts[str(status_code)] = status_counts.get(str(status_code), 0) + 1
+
+    @staticmethod
+    def _empty_metrics():
+        return {
+            'requests': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'network_errors': 0,
+            'connections_opened': 0,
+            'connections_by_host': {},
+            'status_counts': {},
+            'latency_total_ms': 0.0,
+            'latency_max_ms': 0.0
+        }
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport():
+    """Return the process-wide transport shared by all FigmaService instances"""
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = FigmaTransport()
+        return _default_transport
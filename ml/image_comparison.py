@@ -4,351 +4,869 @@ from skimage.metrics import structural_similarity as ssim
 from datetime import datetime
 import os
 
+from ml.issue_templates import issue_record
+from ml.prefilter import DEFAULT_MAX_HASH_DISTANCE, PREFILTER_MODES, perceptual_match, source_digest
+from ml.stage_timing import stage
 
-def analyze_issue_type(figma_region, built_region, area, x, y, w, h):
+
+# Contours smaller than this many pixels are treated as noise
+DEFAULT_MIN_CONTOUR_AREA = 40
+
+# How the Figma image is fitted to the built image size:
+#   stretch   - resize to the exact built size, ignoring aspect ratio
+#   fit_width - scale to the built width keeping aspect ratio, then crop or
+#               pad the bottom to the built height (suits full-page captures)
+RESIZE_MODES = ('stretch', 'fit_width')
+
+# Which annotated images compare_images writes:
+#   full        - all four (boxed Figma and built images, difference map, side-by-side)
+#   differences - only the difference map
+#   none        - no images, just the similarity score and difference list
+# Images that are not written can be rendered later from the result's render spec.
+RENDER_MODES = ('none', 'differences', 'full')
+
+ARTIFACT_KEYS = ('figma_image', 'built_image', 'difference_image', 'comparison_image')
+
+# How the SSIM map is computed:
+#   full    - one pass over the full-resolution images
+#   pyramid - a pass over a downscaled copy, then full resolution only on the
+#             tiles whose coarse score shows a difference (suits tall captures)
+SSIM_MODES = ('full', 'pyramid')
+PYRAMID_DOWNSCALE = 4
+PYRAMID_TILE_SIZE = 256
+# Tiles whose lowest coarse SSIM is at least this are treated as unchanged
+PYRAMID_TILE_THRESHOLD = 0.97
+# Context around each tile, wider than the 7px SSIM window, so tile values
+# match those of a full-frame pass
+PYRAMID_TILE_MARGIN = 8
+
+# Comparison engines:
+#   frame - whole images in memory, one pass
+#   tiled - grayscale only, SSIM and contours computed band by band, for
+#           full-page captures whose full-frame buffers would not fit
+ENGINES = ('frame', 'tiled')
+
+# Tallest band of rows whose summed-area tables region_stats builds at once
+REGION_STATS_ROWS = 1024
+
+# How the resized Figma image is registered to the built image before SSIM:
+#   none        - compare as resized
+#   translation - estimate a shift (scroll offset, status bar height) by phase
+#                 correlation and move the Figma image by it
+ALIGN_MODES = ('none', 'translation')
+# Pixel budget of the downscaled copies used for the coarse shift estimate
+ALIGN_COARSE_PIXELS = 512 * 512
+# Largest full-resolution window used to refine the coarse estimate
+ALIGN_REFINE_SIZE = 1024
+# Refinement passes, each re-centring the window on the improved estimate
+ALIGN_REFINE_PASSES = 3
+# Correlation peaks weaker than this are not trusted
+ALIGN_MIN_RESPONSE = 0.2
+# Share of the unshifted pixel error a shift must remove to be applied
+ALIGN_MIN_IMPROVEMENT = 0.5
+# Largest shift applied, as a fraction of the image size
+ALIGN_MAX_SHIFT = 0.25
+
+# Smallest side of a region of interest, the size of skimage's SSIM window
+MIN_ROI_SIZE = 7
+# skimage excludes this border of the SSIM map from the mean score
+SSIM_BORDER = 3
+
+# Fill colors of the difference map, by whether the element is missing or extra
+MISSING_COLOR = (0, 255, 0)
+EXTRA_COLOR = (0, 0, 255)
+
+
+def analyze_issue_type(figma_mean, built_mean, figma_std, built_std, area, x, y, w, h):
     """
-    Analyze the type of issue and provide detailed explanation and fix suggestions.
+    Classify the issue behind a difference.
+
+    Only a compact record is returned; the explanation, fix code snippet and
+    fix steps are rendered on demand with ml.issue_templates.render_issue_details.
     
     Args:
-        figma_region: Grayscale region from Figma image
-        built_region: Grayscale region from built image
+        figma_mean, built_mean: Mean grayscale value of the region in each image
+        figma_std, built_std: Grayscale standard deviation of the region in each image
         area: Area of the difference
         x, y, w, h: Coordinates and dimensions
         
     Returns:
-        dict: Issue analysis with explanation and code snippets
+        dict: Issue code, type, category and severity
     """
-    figma_mean = np.mean(figma_region)
-    built_mean = np.mean(built_region)
-    
-    # Calculate additional metrics
-    figma_std = np.std(figma_region)
-    built_std = np.std(built_region)
-    
-    # Determine issue type and provide detailed analysis
+    # Determine issue type
     if figma_mean > built_mean + 30:  # Much brighter in Figma
-        if area > 1000:
-            return {
-                'issue_type': 'Missing UI Component',
-                'issue_category': 'Content Issues',
-                'explanation': f'A large UI component (area: {area}px²) is present in the design but missing in the implementation. This could be a button, card, section, or other major UI element.',
-                'severity': 'High',
-                'code_snippet': f'''<!-- Add the missing component at position ({x}, {y}) -->
-<div class="missing-component" style="width: {w}px; height: {h}px;">
-    <!-- Replace with actual component content -->
-    <button class="btn btn-primary">Missing Button</button>
-</div>
-
-/* CSS for the missing component */
-.missing-component {{
-    position: absolute;
-    left: {x}px;
-    top: {y}px;
-    width: {w}px;
-    height: {h}px;
-}}''',
-                'fix_steps': [
-                    'Identify the missing component from the design',
-                    'Add the component to the HTML structure',
-                    'Apply appropriate styling to match the design',
-                    'Ensure proper positioning and dimensions'
-                ]
-            }
-        else:
-            return {
-                'issue_type': 'Missing Small Element',
-                'issue_category': 'Content Issues',
-                'explanation': f'A small UI element (area: {area}px²) is missing from the implementation. This could be an icon, text, or decorative element.',
-                'severity': 'Medium',
-                'code_snippet': f'''<!-- Add the missing small element -->
-<span class="missing-element" style="width: {w}px; height: {h}px;">
-    <!-- Replace with actual element (icon, text, etc.) -->
-    <i class="icon-missing"></i>
-</span>
-
-/* CSS for the missing element */
-.missing-element {{
-    position: absolute;
-    left: {x}px;
-    top: {y}px;
-    width: {w}px;
-    height: {h}px;
-    display: flex;
-    align-items: center;
-    justify-content: center;
-}}''',
-                'fix_steps': [
-                    'Identify the missing element from the design',
-                    'Add the element to the appropriate container',
-                    'Apply correct positioning and styling',
-                    'Ensure the element is visible and accessible'
-                ]
-            }
+        issue_code = 'missing_component' if area > 1000 else 'missing_element'
     elif built_mean > figma_mean + 30:  # Much brighter in built
-        if area > 1000:
-            return {
-                'issue_type': 'Extra UI Component',
-                'issue_category': 'Content Issues',
-                'explanation': f'An extra UI component (area: {area}px²) is present in the implementation but not in the design. This should be removed or hidden.',
-                'severity': 'High',
-                'code_snippet': f'''<!-- Remove or hide the extra component -->
-<!-- Find and remove this component from your HTML -->
-<div class="extra-component" style="display: none;">
-    <!-- This component should not be here -->
-</div>
-
-/* CSS to hide the extra component */
-.extra-component {{
-    display: none !important;
-    /* Or use: visibility: hidden; */
-}}''',
-                'fix_steps': [
-                    'Identify the extra component in the implementation',
-                    'Remove it from the HTML structure if not needed',
-                    'Or hide it with CSS if it might be needed later',
-                    'Update any related JavaScript functionality'
-                ]
-            }
-        else:
-            return {
-                'issue_type': 'Extra Small Element',
-                'issue_category': 'Content Issues',
-                'explanation': f'An extra small element (area: {area}px²) is present in the implementation but not in the design.',
-                'severity': 'Medium',
-                'code_snippet': f'''<!-- Remove or hide the extra element -->
-<!-- Find and remove this element -->
-<span class="extra-element" style="display: none;">
-    <!-- This element should not be here -->
-</span>
-
-/* CSS to hide the extra element */
-.extra-element {{
-    display: none !important;
-}}''',
-                'fix_steps': [
-                    'Identify the extra element in the implementation',
-                    'Remove it from the HTML if not needed',
-                    'Or hide it with CSS',
-                    'Check if it affects layout or functionality'
-                ]
-            }
-    else:  # Similar brightness but different structure
-        # Determine if it's a metadata issue based on area and position
-        if area < 500 and (w < 50 or h < 50):
-            # Small differences are likely metadata issues (spacing, alignment, etc.)
-            return {
-                'issue_type': 'Spacing/Alignment Issue',
-                'issue_category': 'Metadata Issues',
-                'explanation': f'A spacing or alignment issue detected (area: {area}px²). This is likely a minor positioning or spacing problem.',
-                'severity': 'Low',
-                'code_snippet': f'''/* Fix spacing/alignment issue */
-.element {{
-    margin: 0;
-    padding: 0;
-    /* Adjust spacing as needed */
-    margin-left: {x}px;
-    margin-top: {y}px;
-}}
-
-/* Or use flexbox for better alignment */
-.container {{
-    display: flex;
-    align-items: center;
-    justify-content: space-between;
-    gap: 10px;
-}}''',
-                'fix_steps': [
-                    'Check spacing between elements',
-                    'Adjust margins and padding',
-                    'Use flexbox or grid for alignment',
-                    'Ensure consistent spacing throughout'
-                ]
-            }
-        elif area > 2000 and abs(figma_std - built_std) > 10:
-            # Large differences with high variance are likely layout issues
-            return {
-                'issue_type': 'Layout/Positioning Issue',
-                'issue_category': 'Metadata Issues',
-                'explanation': f'A layout or positioning issue detected (area: {area}px²). The element exists but is positioned or sized incorrectly.',
-                'severity': 'Medium',
-                'code_snippet': f'''/* Fix the positioning/sizing issue */
-.component {{
-    position: absolute;
-    left: {x}px;
-    top: {y}px;
-    width: {w}px;
-    height: {h}px;
-    /* Ensure proper positioning */
-    z-index: 1;
-}}
-
-/* Alternative: Use flexbox/grid for better layout */
-.container {{
-    display: flex;
-    align-items: center;
-    justify-content: center;
-}}''',
-                'fix_steps': [
-                    'Check the element\'s positioning in the design',
-                    'Update CSS positioning properties',
-                    'Verify dimensions match the design',
-                    'Test on different screen sizes'
-                ]
-            }
-        else:
-            # Default case for other structural differences
-            return {
-                'issue_type': 'Visual Inconsistency',
-                'issue_category': 'Metadata Issues',
-                'explanation': f'A visual inconsistency detected (area: {area}px²). The element may have different styling, colors, or visual properties.',
-                'severity': 'Medium',
-                'code_snippet': f'''/* Fix visual inconsistency */
-.element {{
-    /* Check and update these properties */
-    background-color: #correct-color;
-    border-radius: 4px;
-    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-    font-size: 14px;
-    line-height: 1.5;
-}}''',
-                'fix_steps': [
-                    'Compare visual properties with design',
-                    'Update colors, fonts, and styling',
-                    'Check for missing CSS properties',
-                    'Ensure consistent visual appearance'
-                ]
-            }
-
-
-def compare_images(figma_path, built_path, output_dir):
+        issue_code = 'extra_component' if area > 1000 else 'extra_element'
+    # Similar brightness but different structure
+    elif area < 500 and (w < 50 or h < 50):
+        # Small differences are likely metadata issues (spacing, alignment, etc.)
+        issue_code = 'spacing_alignment'
+    elif area > 2000 and abs(figma_std - built_std) > 10:
+        # Large differences with high variance are likely layout issues
+        issue_code = 'layout_positioning'
+    else:
+        # Default case for other structural differences
+        issue_code = 'visual_inconsistency'
+    return issue_record(issue_code)
+
+
+def load_image(source):
     """
-    Compare two images and generate a comparison result with similarity score.
-    
+    Decode an image given as a file path, encoded bytes or an already decoded array.
+
     Args:
-        figma_path (str): Path to the Figma design image
-        built_path (str): Path to the built screen image
-        output_dir (str): Directory to save the comparison image
-        
+        source (str, bytes or numpy.ndarray): Image file path, encoded image
+            bytes (e.g. an upload stream) or a BGR array
+
     Returns:
-        dict: Comparison result with similarity score, message, comparison image path, and detected differences
+        numpy.ndarray: BGR image
     """
-    # Read images
-    figma_img = cv2.imread(figma_path)
-    built_img = cv2.imread(built_path)
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        image = cv2.imread(source)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
 
-    # Ensure images are the same size
-    figma_img = cv2.resize(figma_img, (built_img.shape[1], built_img.shape[0]))
 
-    # Convert images to grayscale
-    figma_gray = cv2.cvtColor(figma_img, cv2.COLOR_BGR2GRAY)
-    built_gray = cv2.cvtColor(built_img, cv2.COLOR_BGR2GRAY)
+def load_gray(source):
+    """
+    Decode an image straight to grayscale, skipping the BGR buffer where the decoder allows.
 
-    # Compute SSIM between the two images
-    (score, diff) = ssim(figma_gray, built_gray, full=True)
+    Args:
+        source (str, bytes or numpy.ndarray): As accepted by load_image
 
-    # The diff image contains the actual image differences
-    diff = (diff * 255).astype("uint8")
+    Returns:
+        numpy.ndarray: Grayscale image
+    """
+    if isinstance(source, np.ndarray):
+        return source if source.ndim == 2 else cv2.cvtColor(source, cv2.COLOR_BGR2GRAY)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    else:
+        image = cv2.imread(source, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
 
-    # Threshold the difference image, followed by finding contours
-    thresh = cv2.threshold(
-        diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
-    contours = cv2.findContours(
-        thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    contours = contours[0] if len(contours) == 2 else contours[1]
 
-    # Create a mask image that we will use to visualize the differences
-    mask = np.zeros(figma_img.shape, dtype='uint8')
-    filled_after = figma_img.copy()
+def resize_to_match(figma_img, built_img, resize_mode='stretch'):
+    """
+    Resize the Figma image to the built image size.
+
+    Args:
+        figma_img: BGR or grayscale Figma image
+        built_img: Built image whose size is the target
+        resize_mode (str): One of RESIZE_MODES
+
+    Returns:
+        numpy.ndarray: Figma image with the same height and width as built_img
+    """
+    height, width = built_img.shape[:2]
+
+    if resize_mode == 'stretch':
+        return cv2.resize(figma_img, (width, height))
+
+    if resize_mode == 'fit_width':
+        scaled_height = max(1, round(figma_img.shape[0] * width / figma_img.shape[1]))
+        scaled = cv2.resize(figma_img, (width, scaled_height))
+        if scaled_height >= height:
+            return scaled[:height]
+        # Pad with white, the usual page background
+        return cv2.copyMakeBorder(
+            scaled, 0, height - scaled_height, 0, 0,
+            cv2.BORDER_CONSTANT, value=(255, 255, 255))
+
+    raise ValueError(f"Unknown resize mode: {resize_mode}")
+
+
+def _even_dft_size(size):
+    # Largest even size up to size that the DFT does not pad; phaseCorrelate
+    # pads to the optimal DFT size and is off by half a pixel when that is odd
+    while size > 2 and (size % 2 or cv2.getOptimalDFTSize(size) != size):
+        size -= 1
+    return size
+
+
+def _phase_shift(figma_gray, built_gray):
+    # Shift (dx, dy) that moves the Figma image onto the built image, with the peak strength
+    height, width = _even_dft_size(built_gray.shape[0]), _even_dft_size(built_gray.shape[1])
+    figma_gray = figma_gray[:height, :width]
+    built_gray = built_gray[:height, :width]
+    window = cv2.createHanningWindow((built_gray.shape[1], built_gray.shape[0]), cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(
+        np.float32(figma_gray), np.float32(built_gray), window)
+    return dx, dy, response
+
+
+def _shift_error(figma_gray, built_gray, dx, dy, background):
+    # Squared error of the built image against the Figma image moved by (dx, dy).
+    # The strips the moved design leaves uncovered count against the design's
+    # background, so a shift cannot hide built content by pushing it out of
+    # the compared area.
+    height, width = built_gray.shape
+    error = cv2.norm(
+        figma_gray[max(0, -dy):height - max(0, dy), max(0, -dx):width - max(0, dx)],
+        built_gray[max(0, dy):height + min(0, dy), max(0, dx):width + min(0, dx)], cv2.NORM_L2SQR)
+    for strip in (built_gray[:max(0, dy)], built_gray[height + min(0, dy):],
+                  built_gray[max(0, dy):height + min(0, dy), :max(0, dx)],
+                  built_gray[max(0, dy):height + min(0, dy), width + min(0, dx):]):
+        if strip.size:
+            error += cv2.norm(strip, np.full_like(strip, background), cv2.NORM_L2SQR)
+    return error
+
+
+def estimate_alignment(figma_gray, built_gray):
+    """
+    Estimate the translation that registers the Figma image to the built image.
+
+    The shift is estimated by phase correlation on downscaled copies, then
+    refined at full resolution on the most textured window of the page. It
+    is only applied if it removes at least ALIGN_MIN_IMPROVEMENT of the
+    pixel error of comparing the images unshifted, so a repeated element or
+    a plain page does not pass for an offset.
+
+    Args:
+        figma_gray: Grayscale Figma image, already resized to the built image
+        built_gray: Grayscale built image
+
+    Returns:
+        dict: mode, dx and dy in pixels, the correlation response, and whether
+            the shift is trusted enough to be applied
+    """
+    height, width = built_gray.shape
+    scale = min(1.0, (ALIGN_COARSE_PIXELS / (height * width)) ** 0.5)
+    coarse_size = (max(8, round(width * scale)), max(8, round(height * scale)))
+    if coarse_size != (width, height):
+        coarse_figma = cv2.resize(figma_gray, coarse_size, interpolation=cv2.INTER_AREA)
+        coarse_built = cv2.resize(built_gray, coarse_size, interpolation=cv2.INTER_AREA)
+    else:
+        coarse_figma, coarse_built = figma_gray, built_gray
+
+    dx, dy, response = _phase_shift(coarse_figma, coarse_built)
+    dx *= width / coarse_size[0]
+    dy *= height / coarse_size[1]
+
+    if coarse_size != (width, height):
+        # Refine on the window of rows with the most edges, where the coarse
+        # estimate is off by at most a few downscaled pixels
+        edges = np.abs(cv2.Laplacian(coarse_built, cv2.CV_32F)).sum(axis=1)
+        for _ in range(ALIGN_REFINE_PASSES):
+            dx, dy = round(dx), round(dy)
+            window_width = min(width, ALIGN_REFINE_SIZE) - abs(dx)
+            window_height = min(height, ALIGN_REFINE_SIZE) - abs(dy)
+            if window_width < 32 or window_height < 32:
+                break
+            band = max(1, round(window_height * coarse_size[1] / height))
+            energy = np.convolve(edges, np.ones(band), mode='valid')
+            top = round(int(np.argmax(energy)) * height / coarse_size[1])
+            top = min(max(top, max(0, dy)), height - window_height + min(0, dy))
+            left = max(0, dx) + (width - abs(dx) - window_width) // 2
+            refine_dx, refine_dy, response = _phase_shift(
+                figma_gray[top - dy:top - dy + window_height, left - dx:left - dx + window_width],
+                built_gray[top:top + window_height, left:left + window_width])
+            dx += refine_dx
+            dy += refine_dy
+            if abs(refine_dx) < 0.5 and abs(refine_dy) < 0.5:
+                break
+
+    dx, dy = int(round(dx)), int(round(dy))
+    applied = (response >= ALIGN_MIN_RESPONSE and (dx or dy)
+               and abs(dx) <= ALIGN_MAX_SHIFT * width and abs(dy) <= ALIGN_MAX_SHIFT * height)
+    if applied:
+        background = int(np.argmax(cv2.calcHist([figma_gray], [0], None, [256], [0, 256])))
+        unshifted = _shift_error(figma_gray, built_gray, 0, 0, background)
+        applied = _shift_error(figma_gray, built_gray, dx, dy, background) <= \
+            (1 - ALIGN_MIN_IMPROVEMENT) * unshifted
+    return {
+        'mode': 'translation',
+        'dx': dx,
+        'dy': dy,
+        'response': round(float(response), 4),
+        'applied': bool(applied)
+    }
+
+
+def apply_alignment(figma_img, built_img, alignment):
+    """
+    Move the Figma image by an estimated shift.
+
+    The strips the shifted design no longer covers are taken from the built
+    image, so they are excluded from the comparison instead of showing up as
+    differences.
+
+    Args:
+        figma_img: Figma image (BGR or grayscale), the size of built_img
+        built_img: Built image
+        alignment (dict or None): As returned by estimate_alignment
+
+    Returns:
+        numpy.ndarray: The aligned Figma image
+    """
+    if not alignment or not alignment['applied']:
+        return figma_img
+    dx, dy = alignment['dx'], alignment['dy']
+    height, width = built_img.shape[:2]
+    aligned = built_img.copy()
+    aligned[max(0, dy):height + min(0, dy), max(0, dx):width + min(0, dx)] = \
+        figma_img[max(0, -dy):height - max(0, dy), max(0, -dx):width - max(0, dx)]
+    return aligned
+
+
+class MaskError(ValueError):
+    """A region of interest or ignore mask that does not fit the compared image"""
+
+
+def validate_box(box):
+    """Return an [x, y, width, height] rectangle as a tuple of ints, raising ValueError if malformed"""
+    try:
+        x, y, w, h = (int(value) for value in box)
+    except (TypeError, ValueError):
+        raise ValueError(f"Expected an [x, y, width, height] rectangle, got {box!r}")
+    if w <= 0 or h <= 0:
+        raise ValueError(f"Rectangle must have a positive width and height, got {box!r}")
+    return x, y, w, h
+
+
+def build_masks(shape, roi=None, ignore_regions=None, ignore_mask=None):
+    """
+    Resolve the region of interest and the ignored pixels of a comparison.
+
+    All masks are given in the built image's pixel coordinates.
+
+    Args:
+        shape (tuple): (height, width) of the built image
+        roi (list, optional): [x, y, width, height] rectangle to compare, the whole image by default
+        ignore_regions (list, optional): [x, y, width, height] rectangles to leave out
+        ignore_mask (str, bytes or numpy.ndarray, optional): Mask image whose non-zero
+            pixels are left out, stretched to the built image size
+
+    Returns:
+        tuple: (box, ignored) where box is the (x, y, w, h) rectangle compared and
+            ignored is a boolean array of the box's size, or None when no pixel is ignored
+
+    Raises:
+        MaskError: If the region of interest falls outside the image or the mask image cannot be read
+    """
+    height, width = shape
+    if roi is None:
+        box = (0, 0, width, height)
+    else:
+        x, y, w, h = validate_box(roi)
+        left, top = max(0, x), max(0, y)
+        right, bottom = min(width, x + w), min(height, y + h)
+        if right - left < MIN_ROI_SIZE or bottom - top < MIN_ROI_SIZE:
+            raise MaskError(f"The region of interest must cover at least "
+                            f"{MIN_ROI_SIZE}x{MIN_ROI_SIZE} pixels of the built image")
+        box = (left, top, right - left, bottom - top)
+
+    if not ignore_regions and ignore_mask is None:
+        return box, None
+
+    left, top, w, h = box
+    ignored = np.zeros((h, w), dtype=bool)
+    for region in ignore_regions or ():
+        x, y, rw, rh = validate_box(region)
+        ignored[max(0, y - top):max(0, y + rh - top), max(0, x - left):max(0, x + rw - left)] = True
+    if ignore_mask is not None:
+        try:
+            mask = load_gray(ignore_mask)
+        except ValueError:
+            raise MaskError("Could not decode the ignore mask image")
+        mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        ignored |= mask[top:top + h, left:left + w] > 0
+    return box, (ignored if ignored.any() else None)
+
+
+def apply_masks(figma_gray, built_gray, box, ignored):
+    """
+    Restrict a comparison to its region of interest.
+
+    The ignored pixels of the Figma image are overwritten in place with the
+    built image's, so they can never form a difference.
+
+    Returns:
+        tuple: (figma_view, built_view) cropped to box
+    """
+    x, y, w, h = box
+    figma_view = figma_gray[y:y + h, x:x + w]
+    built_view = built_gray[y:y + h, x:x + w]
+    if ignored is not None:
+        np.copyto(figma_view, built_view, where=ignored)
+    return figma_view, built_view
+
+
+def masked_ssim_score(ssim_map, ignored):
+    """Mean of an SSIM map over the pixels that are not ignored, without the border skimage leaves out"""
+    inner = ssim_map[SSIM_BORDER:-SSIM_BORDER, SSIM_BORDER:-SSIM_BORDER]
+    kept = ~ignored[SSIM_BORDER:-SSIM_BORDER, SSIM_BORDER:-SSIM_BORDER]
+    return float(inner[kept].mean()) if kept.any() else 1.0
+
+
+def mask_summary(roi, box, ignored):
+    """Describe the masks a comparison used for its result, or None if it used none"""
+    if roi is None and ignored is None:
+        return None
+    return {
+        'roi': list(box),
+        'ignored_pixels': 0 if ignored is None else int(ignored.sum())
+    }
+
+
+def build_artifact_paths(output_dir, name_prefix=''):
+    """
+    Build the timestamped paths of the four annotated images of a comparison.
+
+    Returns:
+        dict: Paths keyed like the comparison result (figma_image, built_image,
+            difference_image, comparison_image)
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return {
+        'figma_image': os.path.join(output_dir, f'{name_prefix}figma_annotated_{timestamp}.jpg'),
+        'built_image': os.path.join(output_dir, f'{name_prefix}built_annotated_{timestamp}.jpg'),
+        'difference_image': os.path.join(output_dir, f'{name_prefix}difference_map_{timestamp}.jpg'),
+        'comparison_image': os.path.join(output_dir, f'{name_prefix}comparison_{timestamp}.jpg')
+    }
+
+
+def _pyramid_ssim(figma_gray, built_gray):
+    height, width = built_gray.shape
+    coarse_size = (width // PYRAMID_DOWNSCALE, height // PYRAMID_DOWNSCALE)
+
+    # Too small for a coarse pass to pay off
+    if min(coarse_size) < 7 or height * width <= 4 * PYRAMID_TILE_SIZE ** 2:
+        return ssim(figma_gray, built_gray, full=True)
+
+    coarse_figma = cv2.resize(figma_gray, coarse_size, interpolation=cv2.INTER_AREA)
+    coarse_built = cv2.resize(built_gray, coarse_size, interpolation=cv2.INTER_AREA)
+    _, coarse_map = ssim(coarse_figma, coarse_built, full=True)
+
+    # Unchanged tiles keep a perfect score in the map
+    ssim_map = np.ones((height, width), dtype=np.float32)
+    score_sum = 0.0
+    for y0 in range(0, height, PYRAMID_TILE_SIZE):
+        y1 = min(y0 + PYRAMID_TILE_SIZE, height)
+        for x0 in range(0, width, PYRAMID_TILE_SIZE):
+            x1 = min(x0 + PYRAMID_TILE_SIZE, width)
+
+            coarse_tile = coarse_map[
+                min(y0 // PYRAMID_DOWNSCALE, coarse_size[1] - 1):-(-y1 // PYRAMID_DOWNSCALE),
+                min(x0 // PYRAMID_DOWNSCALE, coarse_size[0] - 1):-(-x1 // PYRAMID_DOWNSCALE)]
+            if coarse_tile.min() >= PYRAMID_TILE_THRESHOLD:
+                score_sum += float(coarse_tile.mean()) * (y1 - y0) * (x1 - x0)
+                continue
+
+            my0, mx0 = max(0, y0 - PYRAMID_TILE_MARGIN), max(0, x0 - PYRAMID_TILE_MARGIN)
+            my1, mx1 = min(height, y1 + PYRAMID_TILE_MARGIN), min(width, x1 + PYRAMID_TILE_MARGIN)
+            _, tile_map = ssim(figma_gray[my0:my1, mx0:mx1], built_gray[my0:my1, mx0:mx1], full=True)
+            tile_map = tile_map[y0 - my0:y1 - my0, x0 - mx0:x1 - mx0]
+            ssim_map[y0:y1, x0:x1] = tile_map
+            score_sum += float(tile_map.sum())
+
+    return score_sum / (height * width), ssim_map
+
+
+def compute_ssim(figma_gray, built_gray, ssim_mode='full'):
+    """
+    Compute the SSIM score and per-pixel SSIM map of two grayscale images of the same size.
+
+    Args:
+        figma_gray: Grayscale Figma image
+        built_gray: Grayscale built image
+        ssim_mode (str, optional): One of SSIM_MODES
+
+    Returns:
+        tuple: (score, ssim_map)
+    """
+    if ssim_mode == 'full':
+        return ssim(figma_gray, built_gray, full=True)
+    if ssim_mode == 'pyramid':
+        return _pyramid_ssim(figma_gray, built_gray)
+    raise ValueError(f"Unknown SSIM mode: {ssim_mode}")
+
+
+def render_artifacts(figma_img, built_img, regions, artifact_paths, keys=ARTIFACT_KEYS):
+    """
+    Draw and write the requested annotated images of a comparison.
+
+    Only the images in keys are produced, so unneeded copies and the
+    triple-width side-by-side image are never allocated.
+
+    Args:
+        figma_img: BGR Figma image, already resized to the built image
+        built_img: BGR built image
+        regions (list): (contour, missing) pairs of the reported differences
+        artifact_paths (dict): Output paths as returned by build_artifact_paths
+        keys (iterable, optional): Subset of ARTIFACT_KEYS to write
+    """
+    keys = set(keys)
+    need_boxes = bool(keys & {'figma_image', 'built_image', 'comparison_image'})
+    need_filled = bool(keys & {'difference_image', 'comparison_image'})
+
+    with stage('annotate'):
+        if need_boxes:
+            figma_with_boxes = figma_img.copy()
+            built_with_boxes = built_img.copy()
+        if need_filled:
+            filled_after = figma_img.copy()
+
+        for contour, missing in regions:
+            if need_boxes:
+                x, y, w, h = cv2.boundingRect(contour)
+                cv2.rectangle(figma_with_boxes, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                cv2.rectangle(built_with_boxes, (x, y), (x + w, y + h), (0, 0, 255), 2)
+            if need_filled:
+                cv2.drawContours(filled_after, [contour], 0, MISSING_COLOR if missing else EXTRA_COLOR, -1)
+
+        outputs = []
+        if 'figma_image' in keys:
+            outputs.append((artifact_paths['figma_image'], figma_with_boxes))
+        if 'built_image' in keys:
+            outputs.append((artifact_paths['built_image'], built_with_boxes))
+        if 'difference_image' in keys:
+            outputs.append((artifact_paths['difference_image'], filled_after))
+        if 'comparison_image' in keys:
+            outputs.append((artifact_paths['comparison_image'],
+                            np.hstack((figma_with_boxes, built_with_boxes, filled_after))))
+
+    with stage('encode'):
+        for path, image in outputs:
+            cv2.imwrite(path, image)
+
+
+def region_stats(figma_gray, built_gray, boxes):
+    """
+    Compute the grayscale mean and standard deviation of both images over many boxes at once.
+
+    Boxes are grouped into bands of at most REGION_STATS_ROWS rows (a taller
+    box gets a band of its own). Summed-area tables of each band then give
+    the sums of every box in a few vectorized lookups, so memory stays
+    bounded on tall pages.
+
+    Args:
+        figma_gray: Grayscale Figma image
+        built_gray: Grayscale built image of the same size
+        boxes: (N, 4) array-like of x, y, width, height
+
+    Returns:
+        dict: figma_mean, built_mean, figma_std and built_std arrays of length N
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    stats = {key: np.zeros(len(boxes)) for key in ('figma_mean', 'built_mean', 'figma_std', 'built_std')}
+
+    order = np.argsort(boxes[:, 1], kind='stable')
+    start = 0
+    while start < len(order):
+        band_top = boxes[order[start], 1]
+        end = start + 1
+        while end < len(order) and boxes[order[end], 1] + boxes[order[end], 3] - band_top <= REGION_STATS_ROWS:
+            end += 1
+        group = order[start:end]
+        start = end
+
+        x, y, w, h = boxes[group].T
+        left, right = x.min(), (x + w).max()
+        band_bottom = (y + h).max()
+        x0, y0 = x - left, y - band_top
+        x1, y1 = x0 + w, y0 + h
+        pixels = (w * h).astype(np.float64)
+
+        for name, gray in (('figma', figma_gray), ('built', built_gray)):
+            sums, squared_sums = cv2.integral2(
+                np.ascontiguousarray(gray[band_top:band_bottom, left:right]),
+                sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+            total = sums[y1, x1] - sums[y0, x1] - sums[y1, x0] + sums[y0, x0]
+            squared_total = (squared_sums[y1, x1] - squared_sums[y0, x1]
+                             - squared_sums[y1, x0] + squared_sums[y0, x0])
+            mean = total / pixels
+            stats[f'{name}_mean'][group] = mean
+            stats[f'{name}_std'][group] = np.sqrt(np.maximum(squared_total / pixels - mean ** 2, 0.0))
 
-    # Create copies for individual images
-    figma_with_boxes = figma_img.copy()
-    built_with_boxes = built_img.copy()
+    return stats
+
+
+def describe_differences(contours, figma_gray, built_gray, min_contour_area=DEFAULT_MIN_CONTOUR_AREA):
+    """
+    Turn the contours of a thresholded SSIM map into detected differences.
+
+    Args:
+        contours (list): Contours in full-image coordinates
+        figma_gray: Grayscale Figma image, resized to the built image
+        built_gray: Grayscale built image
+        min_contour_area (int, optional): Smallest difference area, in pixels, to report
+
+    Returns:
+        tuple: (regions, detected_differences), regions being the
+            (contour, missing) pairs to draw
+    """
+    # Contours to draw, with whether the element is missing from the implementation
+    regions = []
 
     # List to store detected differences
     detected_differences = []
 
+    kept = []
     for i, c in enumerate(contours):
         area = cv2.contourArea(c)
-        if area > 40:
-            x, y, w, h = cv2.boundingRect(c)
-            
-            # Draw rectangles on both images
-            figma_with_boxes = cv2.rectangle(
-                figma_with_boxes, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            built_with_boxes = cv2.rectangle(
-                built_with_boxes, (x, y), (x + w, y + h), (0, 0, 255), 2)
-
-            # Compare the region in both images
-            figma_region = figma_gray[y:y+h, x:x+w]
-            built_region = built_gray[y:y+h, x:x+w]
-
-            # Calculate region statistics
-            figma_mean = np.mean(figma_region)
-            built_mean = np.mean(built_region)
-            
-            # Determine difference type based on brightness
-            if figma_mean > built_mean:
-                # More white in Figma, use green
-                cv2.drawContours(filled_after, [c], 0, (0, 255, 0), -1)
-                difference_type = "Missing Element"
-                description = "Element present in design but missing in implementation"
-            else:
-                # More white in built, use red
-                cv2.drawContours(filled_after, [c], 0, (0, 0, 255), -1)
-                difference_type = "Extra Element"
-                description = "Element present in implementation but not in design"
-
-            # Analyze the issue in detail
-            issue_analysis = analyze_issue_type(figma_region, built_region, area, x, y, w, h)
-
-            # Add difference information
-            detected_differences.append({
-                'id': i + 1,
-                'type': difference_type,
-                'description': description,
-                'location': f"({x}, {y})",
-                'size': f"{w} × {h}",
-                'area': int(area),
-                'severity': 'High' if area > 1000 else 'Medium' if area > 200 else 'Low',
-                'coordinates': {
-                    'x': x,
-                    'y': y,
-                    'width': w,
-                    'height': h
-                },
-                'issue_analysis': issue_analysis
-            })
-
-    # Create the comparison image
-    comparison = np.hstack((figma_with_boxes, built_with_boxes, filled_after))
-
-    # Generate filenames with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    # Save individual images
-    figma_filename = f'figma_annotated_{timestamp}.jpg'
-    built_filename = f'built_annotated_{timestamp}.jpg'
-    difference_filename = f'difference_map_{timestamp}.jpg'
-    comparison_filename = f'comparison_{timestamp}.jpg'
-    
-    figma_path_saved = os.path.join(output_dir, figma_filename)
-    built_path_saved = os.path.join(output_dir, built_filename)
-    difference_path_saved = os.path.join(output_dir, difference_filename)
-    comparison_path = os.path.join(output_dir, comparison_filename)
-    
-    # Save all images
-    cv2.imwrite(figma_path_saved, figma_with_boxes)
-    cv2.imwrite(built_path_saved, built_with_boxes)
-    cv2.imwrite(difference_path_saved, filled_after)
-    cv2.imwrite(comparison_path, comparison)
+        if area > min_contour_area:
+            kept.append((i, c, area, cv2.boundingRect(c)))
 
-    return {
+    # Region statistics of all differences in one vectorized pass
+    stats = region_stats(figma_gray, built_gray, [box for _, _, _, box in kept])
+
+    for index, (i, c, area, (x, y, w, h)) in enumerate(kept):
+        figma_mean = float(stats['figma_mean'][index])
+        built_mean = float(stats['built_mean'][index])
+        # Determine difference type based on brightness
+        if figma_mean > built_mean:
+            # More white in Figma, drawn in green
+            regions.append((c, True))
+            difference_type = "Missing Element"
+            description = "Element present in design but missing in implementation"
+        else:
+            # More white in built, drawn in red
+            regions.append((c, False))
+            difference_type = "Extra Element"
+            description = "Element present in implementation but not in design"
+
+        # Analyze the issue in detail
+        issue_analysis = analyze_issue_type(
+            figma_mean, built_mean, float(stats['figma_std'][index]), float(stats['built_std'][index]),
+            area, x, y, w, h)
+
+        # Add difference information
+        detected_differences.append({
+            'id': i + 1,
+            'type': difference_type,
+            'description': description,
+            'location': f"({x}, {y})",
+            'size': f"{w} × {h}",
+            'area': int(area),
+            'severity': 'High' if area > 1000 else 'Medium' if area > 200 else 'Low',
+            'coordinates': {
+                'x': x,
+                'y': y,
+                'width': w,
+                'height': h
+            },
+            'issue_analysis': issue_analysis
+        })
+
+    return regions, detected_differences
+
+
+def finish_comparison(score, regions, detected_differences, output_dir, name_prefix,
+                      render, resize_mode, load_images, alignment=None, masks=None):
+    """
+    Write the requested annotated images and build the comparison result.
+
+    Args:
+        score (float): SSIM score
+        regions (list): (contour, missing) pairs as returned by describe_differences
+        detected_differences (list): Differences as returned by describe_differences
+        render (str): Which annotated images to write, one of RENDER_MODES
+        resize_mode (str): Resize mode the comparison used, kept for deferred rendering
+        load_images (callable): Returns the BGR (figma_img, built_img) pair to draw
+            on, the Figma image already resized and aligned; only called if an image is written
+        alignment (dict, optional): As returned by estimate_alignment, reported in the
+            result and kept for deferred rendering
+        masks (dict, optional): As returned by mask_summary, reported in the result
+    """
+    artifact_paths = build_artifact_paths(output_dir, name_prefix)
+    rendered_keys = {
+        'full': ARTIFACT_KEYS,
+        'differences': ('difference_image',),
+        'none': ()
+    }[render]
+    if rendered_keys:
+        with stage('decode'):
+            figma_img, built_img = load_images()
+        render_artifacts(figma_img, built_img, regions, artifact_paths, rendered_keys)
+
+    result = {
         'similarity': f'{score * 100:.2f}',
         'message': f'The images are {score * 100:.2f}% similar based on structural similarity.',
-        'comparison_image': comparison_path,
-        'figma_image': figma_path_saved,
-        'built_image': built_path_saved,
-        'difference_image': difference_path_saved,
+        'comparison_image': artifact_paths['comparison_image'],
+        'figma_image': artifact_paths['figma_image'],
+        'built_image': artifact_paths['built_image'],
+        'difference_image': artifact_paths['difference_image'],
         'detected_differences': detected_differences,
         'total_differences': len(detected_differences)
-    } 
\ No newline at end of file
+    }
+    if alignment is not None:
+        result['alignment'] = alignment
+    if masks is not None:
+        result['masks'] = masks
+    pending_images = [key for key in ARTIFACT_KEYS if key not in rendered_keys]
+    if pending_images:
+        result['pending_images'] = pending_images
+        result['render'] = {
+            'resize_mode': resize_mode,
+            'alignment': alignment,
+            'regions': [{'contour': contour.reshape(-1, 2).tolist(), 'missing': missing}
+                        for contour, missing in regions]
+        }
+    return result
+
+
+def prefiltered_result(match, score, output_dir, name_prefix, resize_mode,
+                       alignment=None, masks=None, hash_distance=0):
+    """
+    Build the result of a pair the prefilter found unchanged, without comparing or rendering.
+
+    All annotated images are left pending, so they can still be rendered on request.
+
+    Args:
+        match (str): 'exact' or 'perceptual'
+        score (float): Similarity reported for the pair
+        hash_distance (int, optional): Largest tile hash distance of a perceptual match
+    """
+    result = finish_comparison(score, [], [], output_dir, name_prefix, 'none', resize_mode,
+                               None, alignment, masks)
+    if match == 'exact':
+        result['message'] = 'The images are identical; the comparison was skipped.'
+    else:
+        result['message'] = (f'The images are perceptually identical ({score * 100:.2f}% similar '
+                             f'at thumbnail scale); the comparison was skipped.')
+    result['prefilter'] = {'match': match, 'hash_distance': hash_distance}
+    return result
+
+
+def compare_images(figma_path, built_path, output_dir, name_prefix='',
+                   min_contour_area=DEFAULT_MIN_CONTOUR_AREA, resize_mode='stretch',
+                   render='full', ssim_mode='full', engine='frame', align='none',
+                   roi=None, ignore_regions=None, ignore_mask=None,
+                   prefilter='none', prefilter_distance=DEFAULT_MAX_HASH_DISTANCE):
+    """
+    Compare two images and generate a comparison result with similarity score.
+    
+    Both images may be given as file paths, encoded bytes or decoded BGR
+    arrays, so callers holding uploads in memory never touch the disk.
+    
+    Args:
+        figma_path (str, bytes or numpy.ndarray): Figma design image
+        built_path (str, bytes or numpy.ndarray): Built screen image
+        output_dir (str): Directory to save the comparison image
+        name_prefix (str, optional): Prefix for the generated file names, so
+            several comparisons can share one output directory
+        min_contour_area (int, optional): Smallest difference area, in pixels, to report
+        resize_mode (str, optional): How the Figma image is fitted, one of RESIZE_MODES
+        render (str, optional): Which annotated images to write, one of RENDER_MODES
+        ssim_mode (str, optional): How the SSIM map is computed, one of SSIM_MODES
+        engine (str, optional): One of ENGINES; 'tiled' bounds memory on tall captures
+        align (str, optional): One of ALIGN_MODES; 'translation' registers the Figma
+            image to the built image before SSIM, so a uniform offset is not reported
+            as differences everywhere
+        roi (list, optional): [x, y, width, height] rectangle of the built image to
+            compare; the rest is never scored
+        ignore_regions (list, optional): [x, y, width, height] rectangles of dynamic
+            content (timestamps, carousels, ads) left out of the comparison
+        ignore_mask (str, bytes or numpy.ndarray, optional): Mask image whose non-zero
+            pixels are left out, stretched to the built image size
+        prefilter (str, optional): One of PREFILTER_MODES; skips the comparison of
+            identical pairs, or of perceptually identical ones with 'perceptual'
+        prefilter_distance (int, optional): Largest number of differing bits in any
+            tile's perceptual hash for a pair to be skipped
+        
+    Returns:
+        dict: Comparison result with similarity score, message, comparison image path, and detected differences.
+            With alignment it holds the estimated shift under 'alignment', and with
+            masks the compared box and ignored pixel count under 'masks'. A pair
+            skipped by the prefilter has no differences, every image pending and
+            the kind of match under 'prefilter'.
+            When some images were not written it also holds pending_images and a
+            render spec (resize_mode, alignment and difference contours) to render them later.
+    """
+    if render not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode: {render}")
+    if ssim_mode not in SSIM_MODES:
+        raise ValueError(f"Unknown SSIM mode: {ssim_mode}")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+    if align not in ALIGN_MODES:
+        raise ValueError(f"Unknown alignment mode: {align}")
+    if prefilter not in PREFILTER_MODES:
+        raise ValueError(f"Unknown prefilter mode: {prefilter}")
+
+    if prefilter != 'none':
+        with stage('prefilter'):
+            identical = source_digest(figma_path) == source_digest(built_path)
+        if identical:
+            return prefiltered_result('exact', 1.0, output_dir, name_prefix, resize_mode)
+
+    if engine == 'tiled':
+        if ssim_mode != 'full':
+            raise ValueError("The tiled engine computes SSIM band by band; use ssim_mode 'full'")
+        from ml.tiled_comparison import compare_images_tiled
+        return compare_images_tiled(
+            figma_path, built_path, output_dir, name_prefix=name_prefix,
+            min_contour_area=min_contour_area, resize_mode=resize_mode, render=render,
+            align=align, roi=roi, ignore_regions=ignore_regions, ignore_mask=ignore_mask,
+            prefilter=prefilter, prefilter_distance=prefilter_distance)
+
+    # Read images
+    with stage('decode'):
+        figma_img = load_image(figma_path)
+        built_img = load_image(built_path)
+
+    # Ensure images are the same size
+    with stage('resize'):
+        figma_img = resize_to_match(figma_img, built_img, resize_mode)
+
+    # Convert images to grayscale
+    with stage('grayscale'):
+        figma_gray = cv2.cvtColor(figma_img, cv2.COLOR_BGR2GRAY)
+        built_gray = cv2.cvtColor(built_img, cv2.COLOR_BGR2GRAY)
+
+    # Register the design to the screen before comparing
+    alignment = None
+    if align == 'translation':
+        with stage('align'):
+            alignment = estimate_alignment(figma_gray, built_gray)
+            figma_img = apply_alignment(figma_img, built_img, alignment)
+            figma_gray = apply_alignment(figma_gray, built_gray, alignment)
+
+    # Leave out what lies outside the region of interest or is ignored
+    with stage('mask'):
+        box, ignored = build_masks(built_gray.shape, roi, ignore_regions, ignore_mask)
+        figma_view, built_view = apply_masks(figma_gray, built_gray, box, ignored)
+
+    if prefilter == 'perceptual':
+        with stage('prefilter'):
+            match = perceptual_match(figma_view, built_view, prefilter_distance)
+        if match is not None:
+            return prefiltered_result(
+                'perceptual', match[1], output_dir, name_prefix, resize_mode,
+                alignment, mask_summary(roi, box, ignored), hash_distance=match[0])
+
+    # Compute SSIM between the two images
+    with stage('ssim'):
+        (score, diff) = compute_ssim(figma_view, built_view, ssim_mode)
+        if ignored is not None:
+            score = masked_ssim_score(diff, ignored)
+
+        # The diff image contains the actual image differences
+        diff = (diff * 255).astype("uint8")
+
+    # Threshold the difference image, followed by finding contours
+    with stage('threshold'):
+        thresh = cv2.threshold(
+            diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    with stage('contours'):
+        contours = cv2.findContours(
+            thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=box[:2])
+        contours = contours[0] if len(contours) == 2 else contours[1]
+
+    with stage('analysis'):
+        regions, detected_differences = describe_differences(
+            contours, figma_gray, built_gray, min_contour_area)
+
+    return finish_comparison(
+        score, regions, detected_differences, output_dir, name_prefix,
+        render, resize_mode, lambda: (figma_img, built_img), alignment,
+        mask_summary(roi, box, ignored))
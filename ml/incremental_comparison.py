@@ -0,0 +1,230 @@
+import hashlib
+import json
+
+import cv2
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+
+from ml.image_comparison import (
+    ALIGN_MODES, DEFAULT_MIN_CONTOUR_AREA, RENDER_MODES, SSIM_BORDER, apply_alignment,
+    apply_masks, build_masks, describe_differences, estimate_alignment, finish_comparison,
+    load_image, mask_summary, resize_to_match)
+from ml.prefilter import source_digest
+
+
+# Side of the tiles whose SSIM is recomputed when any of their pixels changed
+INCREMENTAL_TILE_SIZE = 256
+
+# Context around a recomputed tile, wider than the 7px SSIM window, so its
+# values match those of a full-frame pass
+INCREMENTAL_TILE_MARGIN = 8
+
+# Smallest box overlap (intersection over union) for a difference of a
+# re-comparison to be the same issue as one of its baseline
+ISSUE_MATCH_IOU = 0.5
+
+
+def _baseline_key(box, roi, ignore_regions, ignore_mask):
+    # What decides which pixels are scored; the compared pixels themselves are
+    # checked against the baseline's views
+    material = json.dumps({
+        'box': list(box),
+        'roi': roi,
+        'ignore_regions': ignore_regions,
+        'ignore_mask': None if ignore_mask is None else source_digest(ignore_mask)
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _tile_starts(shape):
+    return (np.arange(0, shape[0], INCREMENTAL_TILE_SIZE),
+            np.arange(0, shape[1], INCREMENTAL_TILE_SIZE))
+
+
+def _scored_pixels(shape, ignored):
+    # skimage leaves a border of the map out of the score; ignored pixels are left out too
+    scored = np.zeros(shape, dtype=bool)
+    scored[SSIM_BORDER:-SSIM_BORDER, SSIM_BORDER:-SSIM_BORDER] = True
+    if ignored is not None:
+        scored &= ~ignored
+    return scored
+
+
+def _tile_scores(ssim_map, scored):
+    """Per-tile sums of the SSIM map over the scored pixels, and the scored pixel counts"""
+    rows, cols = _tile_starts(ssim_map.shape)
+    sums = np.add.reduceat(np.add.reduceat(
+        np.where(scored, ssim_map, 0.0), rows, axis=0), cols, axis=1)
+    counts = np.add.reduceat(np.add.reduceat(
+        scored.astype(np.int64), rows, axis=0), cols, axis=1)
+    return sums, counts
+
+
+def _changed_tiles(baseline, figma_view, built_view):
+    """Tiles whose SSIM values can differ from the baseline's, as a boolean grid"""
+    changed = ((figma_view != baseline['figma_view'])
+               | (built_view != baseline['built_view'])).view(np.uint8)
+    # A changed pixel moves the SSIM values of its 7px window, which may fall in the next tile
+    window = 2 * SSIM_BORDER + 1
+    changed = cv2.dilate(changed, np.ones((window, window), dtype=np.uint8))
+    rows, cols = _tile_starts(changed.shape)
+    return np.maximum.reduceat(np.maximum.reduceat(changed, rows, axis=0), cols, axis=1) > 0
+
+
+def _box_iou(box, boxes):
+    # Intersection over union of one (x, y, w, h) box with an (n, 4) array of boxes
+    x, y, w, h = box
+    overlap_w = np.clip(np.minimum(x + w, boxes[:, 0] + boxes[:, 2]) - np.maximum(x, boxes[:, 0]), 0, None)
+    overlap_h = np.clip(np.minimum(y + h, boxes[:, 1] + boxes[:, 3]) - np.maximum(y, boxes[:, 1]), 0, None)
+    intersection = overlap_w * overlap_h
+    return intersection / (w * h + boxes[:, 2] * boxes[:, 3] - intersection)
+
+
+def match_issues(previous, current):
+    """
+    Match the differences of a re-comparison with those of its baseline.
+
+    Differences are paired greedily by decreasing box overlap, down to
+    ISSUE_MATCH_IOU.
+
+    Args:
+        previous (list): Detected differences of the baseline
+        current (list): Detected differences of the new comparison
+
+    Returns:
+        dict: resolved (the baseline's differences no longer found), persisted
+            (id and previous_id pairs) and introduced (ids of new differences)
+    """
+    def box(difference):
+        coordinates = difference['coordinates']
+        return coordinates['x'], coordinates['y'], coordinates['width'], coordinates['height']
+
+    candidates = []
+    if previous and current:
+        current_boxes = np.array([box(difference) for difference in current], dtype=np.float64)
+        for i, difference in enumerate(previous):
+            overlaps = _box_iou(box(difference), current_boxes)
+            for j in np.nonzero(overlaps >= ISSUE_MATCH_IOU)[0]:
+                candidates.append((float(overlaps[j]), i, int(j)))
+    candidates.sort(key=lambda candidate: -candidate[0])
+
+    matched_previous = {}
+    matched_current = set()
+    for _, i, j in candidates:
+        if i not in matched_previous and j not in matched_current:
+            matched_previous[i] = j
+            matched_current.add(j)
+
+    return {
+        'resolved': [difference for i, difference in enumerate(previous) if i not in matched_previous],
+        'persisted': sorted(({'id': current[j]['id'], 'previous_id': previous[i]['id']}
+                             for i, j in matched_previous.items()), key=lambda pair: pair['id']),
+        'introduced': [difference['id'] for j, difference in enumerate(current) if j not in matched_current]
+    }
+
+
+def compare_incremental(figma_path, built_path, output_dir, baseline=None, name_prefix='',
+                        min_contour_area=DEFAULT_MIN_CONTOUR_AREA, resize_mode='stretch',
+                        render='full', ssim_mode='full', engine='frame', align='none',
+                        roi=None, ignore_regions=None, ignore_mask=None,
+                        prefilter='none', prefilter_distance=None):
+    """
+    Compare two images, reusing the SSIM map of the previous comparison of the same screen.
+
+    Takes the same arguments as compare_images plus the screen's baseline.
+    Only the tiles whose design or built pixels changed since the baseline
+    have their SSIM recomputed; the threshold and contours are then found on
+    the whole merged map. Without a usable baseline every tile is computed.
+    The prefilter options are accepted and ignored, since unchanged tiles are
+    never recomputed anyway.
+
+    Args:
+        baseline (dict, optional): As loaded by BaselineStore.load
+
+    Returns:
+        tuple: (result, new_baseline). The result is that of compare_images plus
+            'baseline': whether a baseline was used, the changed and total tile
+            counts, and the resolved, persisted and introduced issues.
+    """
+    if render not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode: {render}")
+    if align not in ALIGN_MODES:
+        raise ValueError(f"Unknown alignment mode: {align}")
+    if ssim_mode != 'full' or engine != 'frame':
+        raise ValueError("Incremental comparisons use the frame engine with ssim_mode 'full'")
+
+    built_img = load_image(built_path)
+    figma_img = resize_to_match(load_image(figma_path), built_img, resize_mode)
+    figma_gray = cv2.cvtColor(figma_img, cv2.COLOR_BGR2GRAY)
+    built_gray = cv2.cvtColor(built_img, cv2.COLOR_BGR2GRAY)
+
+    alignment = None
+    if align == 'translation':
+        alignment = estimate_alignment(figma_gray, built_gray)
+        figma_img = apply_alignment(figma_img, built_img, alignment)
+        figma_gray = apply_alignment(figma_gray, built_gray, alignment)
+
+    box, ignored = build_masks(built_gray.shape, roi, ignore_regions, ignore_mask)
+    figma_view, built_view = apply_masks(figma_gray, built_gray, box, ignored)
+    key = _baseline_key(box, roi, ignore_regions, ignore_mask)
+    scored = _scored_pixels(built_view.shape, ignored)
+
+    usable = (baseline is not None and baseline['key'] == key
+              and baseline['built_view'].shape == built_view.shape)
+    if usable:
+        diff = baseline['diff'].copy()
+        tile_sums = baseline['tile_sums'].copy()
+        tile_counts = baseline['tile_counts'].copy()
+        changed = _changed_tiles(baseline, figma_view, built_view)
+        height, width = built_view.shape
+        for row, col in zip(*np.nonzero(changed)):
+            y0, x0 = row * INCREMENTAL_TILE_SIZE, col * INCREMENTAL_TILE_SIZE
+            y1, x1 = min(y0 + INCREMENTAL_TILE_SIZE, height), min(x0 + INCREMENTAL_TILE_SIZE, width)
+            my0, mx0 = max(0, y0 - INCREMENTAL_TILE_MARGIN), max(0, x0 - INCREMENTAL_TILE_MARGIN)
+            my1, mx1 = min(height, y1 + INCREMENTAL_TILE_MARGIN), min(width, x1 + INCREMENTAL_TILE_MARGIN)
+            _, tile_map = ssim(figma_view[my0:my1, mx0:mx1], built_view[my0:my1, mx0:mx1], full=True)
+            tile_map = tile_map[y0 - my0:y1 - my0, x0 - mx0:x1 - mx0]
+            diff[y0:y1, x0:x1] = (tile_map * 255).astype('uint8')
+            tile_scored = scored[y0:y1, x0:x1]
+            tile_sums[row, col] = float(tile_map[tile_scored].sum())
+            tile_counts[row, col] = int(tile_scored.sum())
+        changed_tiles = int(changed.sum())
+    else:
+        _, ssim_map = ssim(figma_view, built_view, full=True)
+        diff = (ssim_map * 255).astype('uint8')
+        tile_sums, tile_counts = _tile_scores(ssim_map, scored)
+        del ssim_map
+        changed_tiles = tile_sums.size
+
+    total_count = int(tile_counts.sum())
+    score = float(tile_sums.sum()) / total_count if total_count else 1.0
+
+    thresh = cv2.threshold(diff, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
+    contours = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=box[:2])
+    contours = contours[0] if len(contours) == 2 else contours[1]
+    regions, detected_differences = describe_differences(
+        contours, figma_gray, built_gray, min_contour_area)
+
+    result = finish_comparison(
+        score, regions, detected_differences, output_dir, name_prefix,
+        render, resize_mode, lambda: (figma_img, built_img), alignment,
+        mask_summary(roi, box, ignored))
+
+    issues = match_issues(baseline['differences'] if baseline else [], detected_differences)
+    result['baseline'] = {
+        'used': usable,
+        'changed_tiles': changed_tiles,
+        'total_tiles': tile_sums.size,
+        **issues
+    }
+
+    new_baseline = {
+        'key': key,
+        'differences': detected_differences,
+        'figma_view': figma_view,
+        'built_view': built_view,
+        'diff': diff,
+        'tile_sums': tile_sums,
+        'tile_counts': tile_counts
+    }
+    return result, new_baseline
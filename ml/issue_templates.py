@@ -0,0 +1,219 @@
+"""
+Registry of issue report templates.
+
+Comparisons only record an issue code per difference; the explanation, fix
+code snippet and fix steps are rendered from these templates on demand, so
+comparison responses stay small.
+"""
+
+
+# Templates are str.format strings over x, y, w, h and area
+ISSUE_TEMPLATES = {
+    'missing_component': {
+        'issue_type': 'Missing UI Component',
+        'issue_category': 'Content Issues',
+        'severity': 'High',
+        'explanation': 'A large UI component (area: {area}px²) is present in the design but missing in the implementation. This could be a button, card, section, or other major UI element.',
+        'code_snippet': '''<!-- Add the missing component at position ({x}, {y}) -->
+<div class="missing-component" style="width: {w}px; height: {h}px;">
+    <!-- Replace with actual component content -->
+    <button class="btn btn-primary">Missing Button</button>
+</div>
+
+/* CSS for the missing component */
+.missing-component {{
+    position: absolute;
+    left: {x}px;
+    top: {y}px;
+    width: {w}px;
+    height: {h}px;
+}}''',
+        'fix_steps': [
+            'Identify the missing component from the design',
+            'Add the component to the HTML structure',
+            'Apply appropriate styling to match the design',
+            'Ensure proper positioning and dimensions'
+        ]
+    },
+    'missing_element': {
+        'issue_type': 'Missing Small Element',
+        'issue_category': 'Content Issues',
+        'severity': 'Medium',
+        'explanation': 'A small UI element (area: {area}px²) is missing from the implementation. This could be an icon, text, or decorative element.',
+        'code_snippet': '''<!-- Add the missing small element -->
+<span class="missing-element" style="width: {w}px; height: {h}px;">
+    <!-- Replace with actual element (icon, text, etc.) -->
+    <i class="icon-missing"></i>
+</span>
+
+/* CSS for the missing element */
+.missing-element {{
+    position: absolute;
+    left: {x}px;
+    top: {y}px;
+    width: {w}px;
+    height: {h}px;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+}}''',
+        'fix_steps': [
+            'Identify the missing element from the design',
+            'Add the element to the appropriate container',
+            'Apply correct positioning and styling',
+            'Ensure the element is visible and accessible'
+        ]
+    },
+    'extra_component': {
+        'issue_type': 'Extra UI Component',
+        'issue_category': 'Content Issues',
+        'severity': 'High',
+        'explanation': 'An extra UI component (area: {area}px²) is present in the implementation but not in the design. This should be removed or hidden.',
+        'code_snippet': '''<!-- Remove or hide the extra component -->
+<!-- Find and remove this component from your HTML -->
+<div class="extra-component" style="display: none;">
+    <!-- This component should not be here -->
+</div>
+
+/* CSS to hide the extra component */
+.extra-component {{
+    display: none !important;
+    /* Or use: visibility: hidden; */
+}}''',
+        'fix_steps': [
+            'Identify the extra component in the implementation',
+            'Remove it from the HTML structure if not needed',
+            'Or hide it with CSS if it might be needed later',
+            'Update any related JavaScript functionality'
+        ]
+    },
+    'extra_element': {
+        'issue_type': 'Extra Small Element',
+        'issue_category': 'Content Issues',
+        'severity': 'Medium',
+        'explanation': 'An extra small element (area: {area}px²) is present in the implementation but not in the design.',
+        'code_snippet': '''<!-- Remove or hide the extra element -->
+<!-- Find and remove this element -->
+<span class="extra-element" style="display: none;">
+    <!-- This element should not be here -->
+</span>
+
+/* CSS to hide the extra element */
+.extra-element {{
+    display: none !important;
+}}''',
+        'fix_steps': [
+            'Identify the extra element in the implementation',
+            'Remove it from the HTML if not needed',
+            'Or hide it with CSS',
+            'Check if it affects layout or functionality'
+        ]
+    },
+    'spacing_alignment': {
+        'issue_type': 'Spacing/Alignment Issue',
+        'issue_category': 'Metadata Issues',
+        'severity': 'Low',
+        'explanation': 'A spacing or alignment issue detected (area: {area}px²). This is likely a minor positioning or spacing problem.',
+        'code_snippet': '''/* Fix spacing/alignment issue */
+.element {{
+    margin: 0;
+    padding: 0;
+    /* Adjust spacing as needed */
+    margin-left: {x}px;
+    margin-top: {y}px;
+}}
+
+/* Or use flexbox for better alignment */
+.container {{
+    display: flex;
+    align-items: center;
+    justify-content: space-between;
+    gap: 10px;
+}}''',
+        'fix_steps': [
+            'Check spacing between elements',
+            'Adjust margins and padding',
+            'Use flexbox or grid for alignment',
+            'Ensure consistent spacing throughout'
+        ]
+    },
+    'layout_positioning': {
+        'issue_type': 'Layout/Positioning Issue',
+        'issue_category': 'Metadata Issues',
+        'severity': 'Medium',
+        'explanation': 'A layout or positioning issue detected (area: {area}px²). The element exists but is positioned or sized incorrectly.',
+        'code_snippet': '''/* Fix the positioning/sizing issue */
+.component {{
+    position: absolute;
+    left: {x}px;
+    top: {y}px;
+    width: {w}px;
+    height: {h}px;
+    /* Ensure proper positioning */
+    z-index: 1;
+}}
+
+/* Alternative: Use flexbox/grid for better layout */
+.container {{
+    display: flex;
+    align-items: center;
+    justify-content: center;
+}}''',
+        'fix_steps': [
+            'Check the element\'s positioning in the design',
+            'Update CSS positioning properties',
+            'Verify dimensions match the design',
+            'Test on different screen sizes'
+        ]
+    },
+    'visual_inconsistency': {
+        'issue_type': 'Visual Inconsistency',
+        'issue_category': 'Metadata Issues',
+        'severity': 'Medium',
+        'explanation': 'A visual inconsistency detected (area: {area}px²). The element may have different styling, colors, or visual properties.',
+        'code_snippet': '''/* Fix visual inconsistency */
+.element {{
+    /* Check and update these properties */
+    background-color: #correct-color;
+    border-radius: 4px;
+    box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+    font-size: 14px;
+    line-height: 1.5;
+}}''',
+        'fix_steps': [
+            'Compare visual properties with design',
+            'Update colors, fonts, and styling',
+            'Check for missing CSS properties',
+            'Ensure consistent visual appearance'
+        ]
+    }
+}
+
+
+def issue_record(issue_code):
+    """Return the compact analysis stored with each difference: code, type, category and severity"""
+    template = ISSUE_TEMPLATES[issue_code]
+    return {
+        'issue_code': issue_code,
+        'issue_type': template['issue_type'],
+        'issue_category': template['issue_category'],
+        'severity': template['severity']
+    }
+
+
+def render_issue_details(issue_code, area, x, y, w, h):
+    """
+    Render the full analysis of one issue from its template.
+
+    Returns:
+        dict: The compact record plus explanation, code_snippet and fix_steps
+    """
+    template = ISSUE_TEMPLATES[issue_code]
+    values = {'area': area, 'x': x, 'y': y, 'w': w, 'h': h}
+    details = issue_record(issue_code)
+    details.update({
+        'explanation': template['explanation'].format(**values),
+        'code_snippet': template['code_snippet'].format(**values),
+        'fix_steps': list(template['fix_steps'])
+    })
+    return details
@@ -0,0 +1,107 @@
+import hashlib
+
+import cv2
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+
+
+# How a pair of images is checked before the full comparison:
+#   none       - always compare
+#   exact      - skip pairs whose encoded images are byte-for-byte identical
+#   perceptual - also skip pairs whose perceptual hashes match within a distance
+PREFILTER_MODES = ('none', 'exact', 'perceptual')
+
+# The perceptual hash is computed per tile of this many pixels, so a small
+# change on a tall page still moves the hash of the tile it falls in
+HASH_TILE_SIZE = 256
+# Side of the thumbnail each tile is reduced to before its DCT
+HASH_THUMBNAIL_SIZE = 32
+# Side of the low-frequency DCT block kept, giving 64-bit tile hashes
+HASH_BLOCK_SIZE = 8
+# DCT coefficients are rounded to this step before hashing, about two gray
+# levels of amplitude, so encoding noise on flat tiles does not flip bits
+HASH_QUANTUM = 32
+# Largest number of differing bits in any tile for a pair to count as unchanged
+DEFAULT_MAX_HASH_DISTANCE = 2
+# Largest gray-level difference between any two thumbnail pixels for a pair to
+# count as unchanged. The low-frequency hashes miss small edits such as a new
+# button label; re-encoding noise averages out to a few levels in a thumbnail
+MAX_THUMBNAIL_DELTA = 8
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_digest(source):
+    """Return the SHA-256 hex digest of an image given as a file path, bytes or a decoded array"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    if isinstance(source, np.ndarray):
+        digest = hashlib.sha256(str(source.shape).encode('ascii'))
+        digest.update(np.ascontiguousarray(source).data)
+        return digest.hexdigest()
+    return file_digest(source)
+
+
+def _dct_matrix(size):
+    # Orthonormal DCT-II basis, rows are frequencies
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype(np.float32)
+
+
+_DCT_BLOCK = _dct_matrix(HASH_THUMBNAIL_SIZE)[:HASH_BLOCK_SIZE]
+
+
+def hash_thumbnail(gray):
+    """Downscale a grayscale image so each HASH_TILE_SIZE tile becomes a HASH_THUMBNAIL_SIZE square"""
+    height, width = gray.shape
+    rows = -(-height // HASH_TILE_SIZE)
+    cols = -(-width // HASH_TILE_SIZE)
+    return cv2.resize(gray, (cols * HASH_THUMBNAIL_SIZE, rows * HASH_THUMBNAIL_SIZE),
+                      interpolation=cv2.INTER_AREA)
+
+
+def perceptual_hashes(thumbnail):
+    """
+    Compute the pHash of every tile of a thumbnail built by hash_thumbnail.
+
+    Returns:
+        numpy.ndarray: (tiles, 64) boolean array, one hash per tile
+    """
+    rows = thumbnail.shape[0] // HASH_THUMBNAIL_SIZE
+    cols = thumbnail.shape[1] // HASH_THUMBNAIL_SIZE
+    blocks = np.float32(thumbnail).reshape(rows, HASH_THUMBNAIL_SIZE, cols, HASH_THUMBNAIL_SIZE)
+    # Low-frequency DCT coefficients of every tile at once
+    coefficients = np.einsum('ij,rjck,lk->rcil', _DCT_BLOCK, blocks, _DCT_BLOCK)
+    coefficients = np.round(coefficients.reshape(rows * cols, HASH_BLOCK_SIZE * HASH_BLOCK_SIZE)
+                            / HASH_QUANTUM)
+    return coefficients > np.median(coefficients, axis=1, keepdims=True)
+
+
+def perceptual_match(figma_gray, built_gray, max_distance=DEFAULT_MAX_HASH_DISTANCE):
+    """
+    Check whether two same-size grayscale images are perceptually identical.
+
+    Returns:
+        tuple or None: (hash_distance, similarity) when every tile's hashes differ
+            in at most max_distance bits and no thumbnail pixel differs by more
+            than MAX_THUMBNAIL_DELTA, where similarity is the SSIM of the
+            thumbnails; None when the images must be compared in full
+    """
+    figma_thumbnail = hash_thumbnail(figma_gray)
+    built_thumbnail = hash_thumbnail(built_gray)
+    distance = int((perceptual_hashes(figma_thumbnail) != perceptual_hashes(built_thumbnail))
+                   .sum(axis=1).max())
+    if distance > max_distance:
+        return None
+    if cv2.absdiff(figma_thumbnail, built_thumbnail).max() > MAX_THUMBNAIL_DELTA:
+        return None
+    return distance, min(1.0, float(ssim(figma_thumbnail, built_thumbnail)))
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# ml.image_comparison and ml.prefilter load OpenCV and scikit-image, so they are
+# imported by the methods using them; creating a cache stays cheap at startup
+
+
+# Bump when the comparison output changes so stale entries are never served
+CACHE_FORMAT_VERSION = 4
+
+
+def link_or_copy(source, destination):
+    """Hard-link a file (falling back to a copy) through a temporary name, replacing any existing file"""
+    # Hard links make a hit nearly free and survive eviction of the cache entry.
+    # Going through a temporary name lets an existing destination be replaced.
+    tmp_path = f'{destination}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, destination)
+    # rename() is a no-op when both names already link the same file
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of comparison results.
+
+    Entries are keyed by the hashes of both input images plus the comparison
+    parameters. Each entry is a directory holding result.json and the
+    annotated images that were rendered; the least recently used entries are
+    evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def make_key(self, figma_source, built_source, **params):
+        """Build the cache key for a pair of images (file paths or bytes) and comparison parameters"""
+        from ml.prefilter import source_digest
+
+        if params.get('ignore_mask') is not None:
+            # A mask image is keyed by its content, like the compared images
+            params['ignore_mask'] = source_digest(params['ignore_mask'])
+        material = json.dumps({
+            'version': CACHE_FORMAT_VERSION,
+            'figma': source_digest(figma_source),
+            'built': source_digest(built_source),
+            'params': params
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key, output_dir, name_prefix=''):
+        """
+        Look up a cached result and materialize its images in output_dir.
+
+        Images the comparison did not render get a fresh path in output_dir
+        without a file; the result's render spec describes how to draw them.
+
+        Returns:
+            dict or None: The comparison result with paths inside output_dir, or None on a miss
+        """
+        from ml.image_comparison import ARTIFACT_KEYS, build_artifact_paths
+
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'result.json'), 'r') as f:
+                result = json.load(f)
+            artifact_paths = build_artifact_paths(output_dir, name_prefix)
+            for artifact_key in ARTIFACT_KEYS:
+                if result[artifact_key] is not None:
+                    link_or_copy(os.path.join(entry_dir, result[artifact_key]),
+                                  artifact_paths[artifact_key])
+                result[artifact_key] = artifact_paths[artifact_key]
+        except (OSError, ValueError, KeyError):
+            self._record(hit=False)
+            return None
+
+        # Touch the entry so LRU eviction sees it as recently used
+        now = time.time()
+        os.utime(entry_dir, (now, now))
+        self._record(hit=True)
+        return result
+
+    def put(self, key, result):
+        """Store a comparison result and its annotated images, then enforce the size limit"""
+        from ml.image_comparison import ARTIFACT_KEYS
+
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+
+        # Build the entry in a private directory and rename it into place so
+        # concurrent readers never see a half-written entry
+        tmp_dir = os.path.join(self.cache_dir, f'.tmp-{uuid.uuid4().hex}')
+        os.makedirs(tmp_dir)
+        try:
+            stored = dict(result)
+            pending_images = result.get('pending_images', ())
+            for artifact_key in ARTIFACT_KEYS:
+                if artifact_key in pending_images:
+                    stored[artifact_key] = None
+                    continue
+                filename = f'{artifact_key}.jpg'
+                link_or_copy(result[artifact_key], os.path.join(tmp_dir, filename))
+                stored[artifact_key] = filename
+            with open(os.path.join(tmp_dir, 'result.json'), 'w') as f:
+                json.dump(stored, f)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, _, size in entries)
+        for entry_dir, _, size in sorted(entries, key=lambda entry: entry[1]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        """Return hit/miss counters of this process and the current cache size"""
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(entries),
+            'size_bytes': sum(size for _, _, size in entries),
+            'max_bytes': self.max_bytes
+        }
+
+    def _record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(entry_dir):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                entries.append((entry_dir, os.stat(entry_dir).st_mtime, size))
+            except OSError:
+                continue
+        return entries
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
@@ -0,0 +1,76 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Stages of a comparison, in pipeline order
+STAGES = ('decode', 'resize', 'grayscale', 'align', 'mask', 'prefilter', 'ssim', 'threshold',
+          'contours', 'analysis', 'annotate', 'encode')
+
+_local = threading.local()
+
+# Called as observer(stage, seconds) for every timed stage of every thread, e.g. to feed metrics
+_observer = None
+
+
+def set_stage_observer(observer):
+    """Install the process-wide stage observer, or remove it with None"""
+    global _observer
+    _observer = observer
+
+
+def add_stage_time(name, seconds):
+    """Account time spent in a stage, as stage() does once its block finishes"""
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+    observer = _observer
+    if observer is not None:
+        observer(name, seconds)
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage; free when nothing records or observes"""
+    if getattr(_local, 'timings', None) is None and _observer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(name, time.perf_counter() - start)
+
+
+def start_recording():
+    """
+    Start recording the stages run on this thread, for callers that cannot use record_stages.
+
+    Returns:
+        tuple: (timings, token); timings maps stage names to seconds and the
+            token must be passed to stop_recording
+    """
+    token = getattr(_local, 'timings', None)
+    timings = {}
+    _local.timings = timings
+    return timings, token
+
+
+def stop_recording(token):
+    """Stop the recording started with start_recording, restoring the enclosing one"""
+    _local.timings = token
+
+
+@contextmanager
+def record_stages():
+    """
+    Record the seconds spent in each stage by the comparisons run on this thread within the block.
+
+    Yields:
+        dict: Stage name to seconds, filled in as stages finish
+    """
+    timings, token = start_recording()
+    try:
+        yield timings
+    finally:
+        stop_recording(token)
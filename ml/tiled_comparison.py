@@ -0,0 +1,244 @@
+import tempfile
+import threading
+import tracemalloc
+
+import cv2
+import numpy as np
+from skimage.metrics import structural_similarity as ssim
+
+from ml.image_comparison import (
+    DEFAULT_MIN_CONTOUR_AREA, SSIM_BORDER, apply_alignment, apply_masks, build_masks,
+    describe_differences, estimate_alignment, finish_comparison, load_gray, load_image,
+    mask_summary, prefiltered_result, resize_to_match)
+from ml.prefilter import DEFAULT_MAX_HASH_DISTANCE, perceptual_match
+from ml.stage_timing import stage
+
+
+# Rows of the SSIM map computed at a time
+DEFAULT_BAND_HEIGHT = 512
+
+# Context rows above and below each band, wider than the 7px SSIM window, so
+# band values match those of a full-frame pass
+BAND_MARGIN = 8
+
+
+class PeakMemory:
+    """
+    Measure the peak traced memory (numpy buffers included) while a block runs.
+
+    Tracing is shared by all blocks running in the process at the same time,
+    so with concurrent comparisons the peak covers all of them.
+    """
+
+    _lock = threading.Lock()
+    _active = 0
+    _started_tracing = False
+
+    def __enter__(self):
+        with PeakMemory._lock:
+            if PeakMemory._active == 0:
+                # Leave tracing started by someone else (e.g. a profiler) running
+                PeakMemory._started_tracing = not tracemalloc.is_tracing()
+                if PeakMemory._started_tracing:
+                    tracemalloc.start()
+            PeakMemory._active += 1
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        self.peak_bytes = 0
+        return self
+
+    def __exit__(self, *exc_info):
+        with PeakMemory._lock:
+            self.peak_bytes = max(0, tracemalloc.get_traced_memory()[1] - self._baseline)
+            PeakMemory._active -= 1
+            if PeakMemory._active == 0 and PeakMemory._started_tracing:
+                tracemalloc.stop()
+        return False
+
+
+def otsu_threshold(hist):
+    """Otsu threshold of a 256-bin histogram, computed exactly as cv2.THRESH_OTSU does"""
+    probabilities = hist / hist.sum()
+    mu = float(np.dot(np.arange(256), probabilities))
+    eps = np.finfo(np.float32).eps
+    q1 = mu1 = max_sigma = 0.0
+    threshold = 0
+    for i in range(256):
+        p_i = float(probabilities[i])
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < eps or max(q1, q2) > 1.0 - eps:
+            continue
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) ** 2
+        if sigma > max_sigma:
+            max_sigma = sigma
+            threshold = i
+    return threshold
+
+
+def _ssim_bands(figma_gray, built_gray, diff, band_height, ignored=None):
+    """
+    Fill diff with the uint8 SSIM map band by band; returns the score and the map's histogram.
+
+    Pixels flagged in ignored are left out of the score.
+    """
+    height, width = built_gray.shape
+    hist = np.zeros(256, dtype=np.int64)
+    score_sum = 0.0
+    score_count = (height - 2 * SSIM_BORDER) * (width - 2 * SSIM_BORDER)
+
+    for top in range(0, height, band_height):
+        bottom = min(top + band_height, height)
+        context_top = max(0, top - BAND_MARGIN)
+        context_bottom = min(height, bottom + BAND_MARGIN)
+        _, band = ssim(figma_gray[context_top:context_bottom],
+                       built_gray[context_top:context_bottom], full=True)
+        band = band[top - context_top:bottom - context_top]
+
+        score_top, score_bottom = max(top, SSIM_BORDER), min(bottom, height - SSIM_BORDER)
+        score_values = band[score_top - top:score_bottom - top, SSIM_BORDER:width - SSIM_BORDER]
+        if ignored is not None:
+            kept = ~ignored[score_top:score_bottom, SSIM_BORDER:width - SSIM_BORDER]
+            score_values = score_values[kept]
+            score_count -= kept.size - int(kept.sum())
+        score_sum += float(score_values.sum())
+
+        band_diff = (band * 255).astype('uint8')
+        diff[top:bottom] = band_diff
+        hist += np.bincount(band_diff.ravel(), minlength=256)
+
+    score = score_sum / score_count if score_count else 1.0
+    return score, hist
+
+
+def _band_contours(diff, threshold, band_height):
+    """
+    Find the external contours of the thresholded SSIM map band by band.
+
+    A contour touching the bottom of its window may continue in the next band,
+    so the next window starts at its top row and it is only reported once it
+    is complete. Contours starting below an open contour's top are held back
+    too, since the completed contour may enclose them.
+
+    Contours are returned in the order cv2.findContours gives for the whole
+    map, so difference ids match those of the frame engine.
+    """
+    height = diff.shape[0]
+    contours = []
+    window_top = 0
+    window_bottom = min(band_height, height)
+    # Bottom of the previous window, and the reported contours (with their
+    # boxes) whose lower part falls into the current window
+    previous_bottom = 0
+    reported = []
+
+    while True:
+        _, thresh = cv2.threshold(diff[window_top:window_bottom], threshold, 255, cv2.THRESH_BINARY_INV)
+        found = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                 offset=(0, window_top))
+        found = found[0] if len(found) == 2 else found[1]
+        boxes = [cv2.boundingRect(c) for c in found]
+
+        last_window = window_bottom >= height
+        open_tops = [] if last_window else [y for _, y, _, h in boxes if y + h == window_bottom]
+        next_top = min(open_tops, default=window_bottom)
+
+        for contour, (x, y, w, h) in zip(found, boxes):
+            if y >= next_top and not last_window:
+                # Open, or possibly inside an open contour: redo in the next window
+                continue
+            # Rows above previous_bottom were already searched; a contour there
+            # lying on or inside a reported contour is its cut-off tail, or sat
+            # in its hole and is not external
+            point = (float(contour[0][0][0]), float(contour[0][0][1]))
+            if y + h < previous_bottom and any(
+                    rx <= x and ry <= y and x + w <= rx + rw and y + h <= ry + rh
+                    and cv2.pointPolygonTest(reported_contour, point, False) >= 0
+                    for reported_contour, (rx, ry, rw, rh) in reported):
+                continue
+            contours.append(contour)
+            reported.append((contour, (x, y, w, h)))
+
+        if last_window:
+            # findContours starts each contour at its first pixel in raster
+            # order and lists the contours from the last one found to the first
+            contours.sort(key=lambda contour: (int(contour[0][0][1]), int(contour[0][0][0])), reverse=True)
+            return contours
+
+        previous_bottom = window_bottom
+        reported = [entry for entry in reported if entry[1][1] + entry[1][3] > next_top]
+        window_top = next_top
+        window_bottom = min(window_bottom + band_height, height)
+
+
+def compare_images_tiled(figma_path, built_path, output_dir, name_prefix='',
+                         min_contour_area=DEFAULT_MIN_CONTOUR_AREA, resize_mode='stretch',
+                         render='full', band_height=DEFAULT_BAND_HEIGHT, align='none',
+                         roi=None, ignore_regions=None, ignore_mask=None,
+                         prefilter='none', prefilter_distance=DEFAULT_MAX_HASH_DISTANCE):
+    """
+    Compare two images band by band so memory stays bounded on tall captures.
+
+    Takes the same arguments and returns the same result as compare_images,
+    plus peak_memory_mb. Only the grayscale images are held in memory, the
+    uint8 SSIM map lives in a memory-mapped temporary file and SSIM runs on
+    one band at a time. Contours spanning band seams are merged by carrying
+    them into the next window. The BGR images are only decoded if annotated
+    images are rendered.
+    """
+    with PeakMemory() as peak:
+        # Decoding straight to grayscale also covers the grayscale stage
+        with stage('decode'):
+            built_gray = load_gray(built_path)
+            figma_gray = load_gray(figma_path)
+        with stage('resize'):
+            figma_gray = resize_to_match(figma_gray, built_gray, resize_mode)
+        alignment = None
+        if align == 'translation':
+            with stage('align'):
+                alignment = estimate_alignment(figma_gray, built_gray)
+                figma_gray = apply_alignment(figma_gray, built_gray, alignment)
+        with stage('mask'):
+            box, ignored = build_masks(built_gray.shape, roi, ignore_regions, ignore_mask)
+            figma_view, built_view = apply_masks(figma_gray, built_gray, box, ignored)
+        match = None
+        if prefilter == 'perceptual':
+            with stage('prefilter'):
+                match = perceptual_match(figma_view, built_view, prefilter_distance)
+        if match is not None:
+            result = prefiltered_result(
+                'perceptual', match[1], output_dir, name_prefix, resize_mode,
+                alignment, mask_summary(roi, box, ignored), hash_distance=match[0])
+        else:
+            with tempfile.TemporaryFile() as diff_file:
+                diff = np.memmap(diff_file, dtype=np.uint8, mode='w+', shape=built_view.shape)
+                with stage('ssim'):
+                    score, hist = _ssim_bands(figma_view, built_view, diff, band_height, ignored)
+                with stage('threshold'):
+                    threshold = otsu_threshold(hist)
+                # Thresholding each band is part of the contour pass
+                with stage('contours'):
+                    contours = _band_contours(diff, threshold, band_height)
+                del diff
+            if box[:2] != (0, 0):
+                origin = np.array(box[:2], dtype=np.int32)
+                contours = [contour + origin for contour in contours]
+
+            with stage('analysis'):
+                regions, detected_differences = describe_differences(
+                    contours, figma_gray, built_gray, min_contour_area)
+            del figma_gray, built_gray, figma_view, built_view
+
+            def load_images():
+                built_img = load_image(built_path)
+                figma_img = resize_to_match(load_image(figma_path), built_img, resize_mode)
+                return apply_alignment(figma_img, built_img, alignment), built_img
+
+            result = finish_comparison(
+                score, regions, detected_differences, output_dir, name_prefix,
+                render, resize_mode, load_images, alignment, mask_summary(roi, box, ignored))
+
+    result['peak_memory_mb'] = round(peak.peak_bytes / (1024 * 1024), 2)
+    return result
@@ -0,0 +1,25 @@
+import json
+import os
+
+import pytest
+
+from ml.benchmark_comparison import compare_to_baseline, corpus_cases, run_case
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             'ml', 'benchmarks', 'baseline.json')
+
+with open(BASELINE_PATH, 'r') as f:
+    BASELINE = json.load(f)
+
+
+@pytest.mark.parametrize('case', [case for case in corpus_cases() if case[0] in BASELINE['cases']],
+                         ids=lambda case: case[0])
+def test_committed_baseline_matches_the_current_output(case):
+    settings = BASELINE['settings']
+    result = run_case(*case, repeat=1, render=settings['render'], engine=settings['engine'],
+                      ssim_mode=settings['ssim_mode'])
+
+    # Timings depend on the machine; the similarity and difference count must not
+    report, = compare_to_baseline([result], BASELINE)
+    assert not report['output_changed'], (result, BASELINE['cases'][case[0]])
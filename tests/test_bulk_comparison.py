@@ -0,0 +1,76 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from ml import bulk_comparison
+from ml.bulk_comparison import get_executor, run_bulk_comparison
+
+
+def _png(image):
+    return cv2.imencode('.png', image)[1].tobytes()
+
+
+def _task(name, output_dir, size, changes, **fields):
+    rng = np.random.default_rng(changes)
+    design = np.full((size, size, 3), 240, dtype=np.uint8)
+    built = design.copy()
+    for _ in range(changes):
+        x, y = (int(value) for value in rng.integers(0, size - 40, 2))
+        cv2.rectangle(built, (x, y), (x + 30, y + 30), (20, 20, 20), -1)
+    return {'name': name, 'output_dir': output_dir, 'figma_bytes': _png(design),
+            'built_bytes': _png(built), **fields}
+
+
+@pytest.fixture
+def pool():
+    yield
+    if bulk_comparison._executor is not None:
+        bulk_comparison._reset_executor(bulk_comparison._executor)
+
+
+def test_results_keep_task_order_and_report_failures(tmp_path, pool):
+    output_dir = str(tmp_path)
+    # The large first screen finishes after the small ones
+    tasks = [_task('large', output_dir, 1600, 6, name_prefix='0_'),
+             _task('small', output_dir, 200, 1, name_prefix='1_'),
+             {'name': 'broken', 'output_dir': output_dir, 'figma_bytes': b'not an image',
+              'built_bytes': b'not an image', 'name_prefix': '2_'},
+             _task('medium', output_dir, 400, 3, name_prefix='3_')]
+
+    results = run_bulk_comparison(tasks, max_workers=2)
+
+    assert [result['screen_name'] for result in results] == ['large', 'small', 'broken', 'medium']
+    assert [result['status'] for result in results] == ['success', 'success', 'error', 'success']
+    assert results[2]['error']
+
+
+def test_name_prefix_keeps_artifacts_of_screens_apart(tmp_path, pool):
+    output_dir = str(tmp_path)
+    tasks = [_task(f'screen{index}', output_dir, 300, 2, name_prefix=f'{index}_screen_')
+             for index in range(3)]
+
+    results = run_bulk_comparison(tasks, max_workers=2)
+
+    paths = [result['comparison_image'] for result in results]
+    assert len(set(paths)) == 3
+    assert all(os.path.exists(path) for path in paths)
+
+
+def test_concurrent_callers_share_one_pool(pool):
+    barrier = threading.Barrier(8)
+    executors = []
+
+    def call():
+        barrier.wait()
+        executors.append(get_executor(2))
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(executor) for executor in executors}) == 1
@@ -0,0 +1,174 @@
+import importlib
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from PIL import Image
+
+import ml.figma_service
+from ml.figma_transport import FigmaTransport
+
+
+def _png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'white').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+PNG = _png()
+
+
+class StubServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients that time out close the connection before /slow answers
+        pass
+
+
+class StubFigma(BaseHTTPRequestHandler):
+    """Figma API and CDN stand-in; server.failures maps a path prefix to statuses returned before success"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        for prefix, failures in self.server.failures.items():
+            if self.path.startswith(prefix) and failures:
+                status, headers = failures.pop(0)
+                return self._send(status, {'err': 'stub failure'}, headers=headers)
+
+        if self.path.startswith('/v1/me'):
+            return self._send(200, {'id': 'user'})
+        if self.path.startswith('/v1/files/'):
+            return self._send(200, {'name': 'File', 'version': '1', 'lastModified': 'now',
+                                    'document': {'children': [{'children': [{'id': '1:2'}]}]}})
+        if self.path.startswith('/v1/images/'):
+            port = self.server.server_address[1]
+            return self._send(200, {'images': {'1:2': f'http://127.0.0.1:{port}/cdn/image.png'}})
+        if self.path.startswith('/cdn/'):
+            return self._send(200, PNG, 'image/png')
+        if self.path.startswith('/slow'):
+            time.sleep(1)
+            return self._send(200, {})
+        self._send(404, {})
+
+
+@pytest.fixture
+def stub():
+    server = StubServer(('127.0.0.1', 0), StubFigma)
+    server.failures = {}
+    server.paths = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def figma_service(stub, monkeypatch):
+    """ml.figma_service reloaded with FIGMA_API_URL pointing at the stub"""
+    monkeypatch.setenv('FIGMA_API_URL', f'http://127.0.0.1:{stub.server_address[1]}/v1')
+    yield importlib.reload(ml.figma_service)
+    monkeypatch.delenv('FIGMA_API_URL')
+    importlib.reload(ml.figma_service)
+
+
+@pytest.fixture
+def transport():
+    return FigmaTransport(max_retries=2, backoff_base=0.01)
+
+
+def test_connections_are_reused(figma_service, transport):
+    service = figma_service.FigmaService('token', transport=transport)
+    for _ in range(20):
+        assert service.get_file_info('KEY')[0]
+    stats = transport.stats()
+    assert stats['requests'] == 20
+    assert stats['connections_opened'] == 1
+
+
+def test_rate_limited_request_waits_for_retry_after(stub, figma_service, transport):
+    stub.failures['/v1/images/'] = [(429, {'Retry-After': '1'})]
+    service = figma_service.FigmaService('token', transport=transport)
+
+    start = time.perf_counter()
+    success, image = service.export_image('KEY', '1:2')
+    elapsed = time.perf_counter() - start
+
+    assert success, image
+    assert elapsed >= 1.0
+    stats = transport.stats()
+    assert stats['retries'] == 1
+    assert stats['rate_limited'] == 1
+
+
+def test_server_errors_are_retried(stub, figma_service, transport):
+    stub.failures['/v1/files/'] = [(503, {}), (502, {})]
+    service = figma_service.FigmaService('token', transport=transport)
+
+    assert service.get_file_info('KEY')[0]
+    assert transport.stats()['retries'] == 2
+    assert transport.stats()['status_counts'] == {'503': 1, '502': 1, '200': 1}
+
+
+def test_server_errors_fail_once_retries_run_out(stub, figma_service, transport):
+    stub.failures['/v1/files/'] = [(503, {})] * 3
+    service = figma_service.FigmaService('token', transport=transport)
+
+    success, error = service.get_file_info('KEY')
+
+    assert not success
+    assert '503' in error
+    assert len(stub.paths) == transport.max_retries + 1
+
+
+def test_network_errors_raise_once_retries_run_out(stub, transport):
+    port = stub.server_address[1]
+    stub.shutdown()
+    stub.server_close()
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        transport.get(f'http://127.0.0.1:{port}/v1/me')
+    assert transport.stats()['network_errors'] == transport.max_retries + 1
+
+
+def test_timeouts_raise(stub, transport):
+    with pytest.raises(requests.exceptions.Timeout):
+        transport.get(f'http://127.0.0.1:{stub.server_address[1]}/slow', timeout=(1, 0.2))
+    assert transport.stats()['retries'] == transport.max_retries
+
+
+def test_every_call_sets_a_timeout(figma_service, transport, tmp_path):
+    timeouts = []
+    session_get = transport.session.get
+
+    def recording_get(url, **kwargs):
+        timeouts.append(kwargs.get('timeout'))
+        return session_get(url, **kwargs)
+
+    transport.session.get = recording_get
+    service = figma_service.FigmaService('token', transport=transport)
+    assert service.validate_token()[0]
+    assert service.get_file_version('KEY', depth=2)[0]
+    assert service.export_image('KEY')[0]
+    assert service.export_images_to_files('KEY', {'1:2': str(tmp_path / 'frame.png')})[0]
+
+    assert len(timeouts) >= 6
+    assert all(timeout is not None for timeout in timeouts)
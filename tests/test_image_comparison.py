@@ -0,0 +1,136 @@
+import cv2
+import numpy as np
+import pytest
+
+from ml.benchmark_ssim import synthetic_page
+from ml.image_comparison import MaskError, build_masks, compare_images, estimate_alignment, region_stats
+
+
+def _card(image, x, y, label=0):
+    """Draw a dark card with a few lines of text, textured enough for phase correlation"""
+    cv2.rectangle(image, (x, y), (x + 400, y + 200), 90, -1)
+    for line in range(8):
+        cv2.putText(image, f'Item {label}.{line}', (x + 20, y + 30 + line * 22),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, 255, 1)
+
+
+def _bgr(gray):
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def test_alignment_applies_a_true_shift():
+    design = np.full((1600, 800), 240, dtype=np.uint8)
+    for index, y in enumerate(range(100, 1500, 300)):
+        _card(design, 100 + index * 20, y, index)
+    built = cv2.warpAffine(design, np.float32([[1, 0, 0], [0, 1, 40]]), (800, 1600), borderValue=240)
+
+    alignment = estimate_alignment(design, built)
+
+    assert (alignment['dx'], alignment['dy'], alignment['applied']) == (0, 40, True)
+
+
+def test_alignment_ignores_a_plain_page():
+    page = np.full((1600, 800), 240, dtype=np.uint8)
+    cv2.rectangle(page, (0, 0), (800, 60), 200, -1)
+
+    assert not estimate_alignment(page, page.copy())['applied']
+
+
+def test_duplicated_element_is_reported_not_aligned_away(tmp_path):
+    design = np.full((1600, 800), 240, dtype=np.uint8)
+    _card(design, 100, 200)
+    built = design.copy()
+    _card(built, 100, 500)
+
+    # The correlation peak matches the design's card onto the copy
+    alignment = estimate_alignment(design, built)
+    assert alignment['dy'] == 300 and not alignment['applied']
+
+    result = compare_images(_bgr(design), _bgr(built), str(tmp_path), render='none', align='translation')
+    boxes = [difference['coordinates'] for difference in result['detected_differences']]
+    assert any(abs(box['y'] - 500) <= 5 for box in boxes)
+    assert not any(box['y'] < 450 for box in boxes)
+
+
+@pytest.mark.parametrize('boxes', [
+    [(0, 0, 1, 1)],
+    [(0, 0, 300, 2000)],
+    [(10, 20, 30, 40), (250, 1900, 50, 100), (299, 1999, 1, 1)],
+    [(0, 1990, 300, 10), (0, 0, 300, 10), (120, 500, 60, 1400)],
+    # Many boxes spanning several bands, some taller than a band
+    [(x, y, 1 + (x * 7) % 60, 1 + (y * 3) % 700) for x in range(0, 240, 40) for y in range(0, 1300, 90)],
+])
+def test_region_stats_match_numpy_on_each_box(boxes):
+    rng = np.random.default_rng(len(boxes))
+    figma = rng.integers(0, 256, (2000, 300), dtype=np.uint8)
+    built = rng.integers(0, 256, (2000, 300), dtype=np.uint8)
+
+    stats = region_stats(figma, built, boxes)
+
+    for index, (x, y, w, h) in enumerate(boxes):
+        for name, gray in (('figma', figma), ('built', built)):
+            region = gray[y:y + h, x:x + w].astype(np.float64)
+            assert stats[f'{name}_mean'][index] == pytest.approx(region.mean(), abs=1e-9)
+            assert stats[f'{name}_std'][index] == pytest.approx(region.std(), abs=1e-6)
+
+
+def _page_with_changes(*boxes):
+    design = np.full((600, 400, 3), 240, dtype=np.uint8)
+    cv2.putText(design, 'Header', (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (30, 30, 30), 3)
+    built = design.copy()
+    for x, y in boxes:
+        cv2.rectangle(built, (x, y), (x + 50, y + 50), (0, 0, 200), -1)
+    return design, built
+
+
+def test_ignored_region_reports_nothing_and_keeps_the_score(tmp_path):
+    ignore_regions = [[280, 430, 80, 80]]
+    design, built = _page_with_changes((300, 450))
+
+    result = compare_images(design, built, str(tmp_path), render='none', ignore_regions=ignore_regions)
+
+    assert result['detected_differences'] == []
+    assert float(result['similarity']) == 100.0
+
+    # With a change outside it too, the score is that of the outside change alone
+    design, with_ignored = _page_with_changes((300, 450), (60, 200))
+    _, without_ignored = _page_with_changes((60, 200))
+    masked = compare_images(design, with_ignored, str(tmp_path), render='none', ignore_regions=ignore_regions)
+    reference = compare_images(design, without_ignored, str(tmp_path), render='none',
+                               ignore_regions=ignore_regions)
+    assert masked['similarity'] == reference['similarity']
+    assert float(masked['similarity']) < 100.0
+    assert [difference['coordinates'] for difference in masked['detected_differences']] == \
+        [difference['coordinates'] for difference in reference['detected_differences']]
+
+
+def test_region_of_interest_limits_the_comparison(tmp_path):
+    design, built = _page_with_changes((300, 450), (60, 200))
+
+    result = compare_images(design, built, str(tmp_path), render='none', roi=[0, 150, 200, 150])
+
+    assert len(result['detected_differences']) == 1
+    box = result['detected_differences'][0]['coordinates']
+    assert box['x'] <= 60 < box['x'] + box['width']
+    assert box['y'] <= 200 < box['y'] + box['height']
+    assert result['masks']['roi'] == [0, 150, 200, 150]
+
+
+@pytest.mark.parametrize('roi', [[5000, 5000, 10, 10], [395, 0, 100, 100], [-50, -50, 52, 52]])
+def test_region_of_interest_outside_the_image_is_rejected(roi):
+    with pytest.raises(MaskError):
+        build_masks((600, 400), roi=roi)
+
+
+@pytest.mark.parametrize('width, height, seed', [(1440, 3000, 1), (800, 2400, 2), (390, 2000, 3)])
+def test_pyramid_ssim_finds_the_differences_of_full_ssim(width, height, seed, tmp_path):
+    design, built = synthetic_page(width, height, seed=seed)
+
+    full = compare_images(design, built, str(tmp_path), render='none', ssim_mode='full')
+    pyramid = compare_images(design, built, str(tmp_path), render='none', ssim_mode='pyramid')
+
+    assert abs(float(full['similarity']) - float(pyramid['similarity'])) <= 0.1
+    assert len(full['detected_differences']) == len(pyramid['detected_differences']) > 0
+    for expected, found in zip(full['detected_differences'], pyramid['detected_differences']):
+        for key, value in expected['coordinates'].items():
+            assert abs(found['coordinates'][key] - value) <= 4
@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from ml.baseline_store import BaselineStore
+from ml.image_comparison import compare_images
+from ml.incremental_comparison import compare_incremental
+
+
+def _page():
+    design = np.full((1200, 800, 3), 240, dtype=np.uint8)
+    for y in range(40, 1160, 140):
+        cv2.rectangle(design, (40, y), (760, y + 100), (200, 200, 200), -1)
+        cv2.putText(design, f'Row {y}', (60, y + 60), cv2.FONT_HERSHEY_SIMPLEX, 1, (40, 40, 40), 2)
+    return design
+
+
+def _with_boxes(image, *boxes):
+    image = image.copy()
+    for x, y in boxes:
+        cv2.rectangle(image, (x, y), (x + 60, y + 40), (0, 0, 200), -1)
+    return image
+
+
+def _rerun(store, design, built, output_dir):
+    baseline = store.load('session', 'home')
+    result, new_baseline = compare_incremental(design, built, output_dir, baseline, render='none')
+    store.save('session', 'home', new_baseline)
+    return result
+
+
+def test_incremental_result_matches_a_full_comparison(tmp_path):
+    store = BaselineStore(str(tmp_path / 'baselines'))
+    design = _page()
+    _rerun(store, design, _with_boxes(design, (100, 100), (500, 700)), str(tmp_path))
+
+    built = _with_boxes(design, (500, 700), (300, 1000))
+    result = _rerun(store, design, built, str(tmp_path))
+    full = compare_images(design, built, str(tmp_path), render='none')
+
+    assert result['baseline']['used']
+    assert result['baseline']['changed_tiles'] < result['baseline']['total_tiles']
+    assert result['similarity'] == full['similarity']
+    assert [difference['coordinates'] for difference in result['detected_differences']] == \
+        [difference['coordinates'] for difference in full['detected_differences']]
+
+
+def test_issues_are_matched_against_the_baseline(tmp_path):
+    store = BaselineStore(str(tmp_path / 'baselines'))
+    design = _page()
+    first = _rerun(store, design, _with_boxes(design, (100, 100), (500, 700)), str(tmp_path))
+    second = _rerun(store, design, _with_boxes(design, (500, 700), (300, 1000)), str(tmp_path))
+
+    def find(result, x, y):
+        return next(difference for difference in result['detected_differences']
+                    if abs(difference['coordinates']['x'] - x) <= 5
+                    and abs(difference['coordinates']['y'] - y) <= 5)
+
+    issues = second['baseline']
+    assert [difference['id'] for difference in issues['resolved']] == [find(first, 100, 100)['id']]
+    assert issues['persisted'] == [{'id': find(second, 500, 700)['id'],
+                                    'previous_id': find(first, 500, 700)['id']}]
+    assert issues['introduced'] == [find(second, 300, 1000)['id']]
+
+
+def test_locked_runs_comparisons_of_a_screen_one_at_a_time(tmp_path):
+    store = BaselineStore(str(tmp_path / 'baselines'))
+    intervals = []
+
+    def hold():
+        with store.locked('session', 'home'):
+            start = time.monotonic()
+            time.sleep(0.1)
+            intervals.append((start, time.monotonic()))
+
+    threads = [threading.Thread(target=hold) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    intervals.sort()
+    assert all(end <= next_start for (_, end), (next_start, _) in zip(intervals, intervals[1:]))
+    assert not os.path.exists(str(tmp_path / 'baselines' / 'session' / 'home.lock'))
+
+
+def test_lock_of_a_dead_process_is_taken_over(tmp_path):
+    store = BaselineStore(str(tmp_path / 'baselines'))
+    os.makedirs(tmp_path / 'baselines' / 'session')
+    (tmp_path / 'baselines' / 'session' / 'home.lock').write_text(str(2 ** 22 + 1))
+
+    with store.locked('session', 'home', timeout=1):
+        pass
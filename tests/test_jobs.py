@@ -0,0 +1,105 @@
+import json
+import os
+import time
+
+from backend.jobs import JobQueue
+
+
+def _wait_finished(jobs, job_id, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = jobs.get(job_id)
+        if job and job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f'job {job_id} did not finish: {jobs.get(job_id)}')
+
+
+def _persist(jobs_dir, job_id, **fields):
+    """Write a job record as a previous server run would have left it"""
+    os.makedirs(jobs_dir, exist_ok=True)
+    job = {
+        'job_id': job_id, 'kind': 'echo', 'status': 'queued', 'payload': {'value': 1},
+        'secret_keys': [], 'submitted_by': None, 'progress': {'completed': 0, 'total': 0},
+        'result': None, 'error': None, 'created_at': '2024-01-01T00:00:00',
+        'started_at': None, 'finished_at': None, **fields
+    }
+    with open(os.path.join(jobs_dir, f'{job_id}.json'), 'w') as f:
+        json.dump(job, f)
+
+
+def _echo(payload, progress):
+    progress(1, 1)
+    return payload
+
+
+def test_restarted_queue_runs_persisted_queued_job(tmp_path):
+    jobs_dir = str(tmp_path / 'jobs')
+    _persist(jobs_dir, 'a' * 32)
+
+    jobs = JobQueue(jobs_dir, num_workers=1)
+    jobs.register('echo', _echo)
+    jobs.start()
+
+    job = _wait_finished(jobs, 'a' * 32)
+    assert job['status'] == 'completed'
+    assert job['result'] == {'value': 1}
+
+
+def test_restarted_queue_fails_interrupted_running_job(tmp_path):
+    jobs_dir = str(tmp_path / 'jobs')
+    _persist(jobs_dir, 'b' * 32, status='running')
+
+    jobs = JobQueue(jobs_dir, num_workers=1)
+    jobs.register('echo', _echo)
+    jobs.start()
+
+    job = jobs.get('b' * 32)
+    assert job['status'] == 'failed'
+    assert 'restart' in job['error']
+
+
+def test_secrets_are_not_persisted(tmp_path):
+    jobs_dir = str(tmp_path / 'jobs')
+    jobs = JobQueue(jobs_dir, num_workers=1)
+    jobs.register('echo', lambda payload, progress: {'token_seen': payload['token'] == 'SECRET'})
+
+    job_id = jobs.submit('echo', {'value': 2}, secrets={'token': 'SECRET'})
+    job = _wait_finished(jobs, job_id)
+
+    assert job['result'] == {'token_seen': True}
+    with open(os.path.join(jobs_dir, f'{job_id}.json')) as f:
+        assert 'SECRET' not in f.read()
+
+
+def test_restarted_queue_fails_job_whose_secrets_were_lost(tmp_path):
+    jobs_dir = str(tmp_path / 'jobs')
+    # Submitted by a process that is gone, taking the token with it
+    _persist(jobs_dir, 'c' * 32, secret_keys=['token'], submitted_by=2 ** 22 + 1)
+
+    jobs = JobQueue(jobs_dir, num_workers=1)
+    jobs.register('echo', _echo)
+    jobs.start()
+
+    job = jobs.get('c' * 32)
+    assert job['status'] == 'failed'
+    assert 'submit it again' in job['error']
+
+
+def test_purge_deletes_old_finished_jobs_only(tmp_path):
+    jobs_dir = str(tmp_path / 'jobs')
+    _persist(jobs_dir, 'd' * 32, status='completed')
+    _persist(jobs_dir, 'e' * 32, status='queued')
+    _persist(jobs_dir, 'f' * 32, status='failed')
+    for name in ('d' * 32, 'e' * 32):
+        open(os.path.join(jobs_dir, f'{name}.lock'), 'w').close()
+    # Only the failed job finished recently
+    old = time.time() - 3600
+    for name in os.listdir(jobs_dir):
+        if not name.startswith('f'):
+            os.utime(os.path.join(jobs_dir, name), (old, old))
+
+    jobs = JobQueue(jobs_dir, num_workers=1)
+
+    assert jobs.purge(max_age=60) == 1
+    assert sorted(os.listdir(jobs_dir)) == ['e' * 32 + '.json', 'e' * 32 + '.lock', 'f' * 32 + '.json']
@@ -0,0 +1,75 @@
+import os
+
+from backend.metrics import MetricsRegistry
+
+
+def _registry(metrics_dir):
+    registry = MetricsRegistry(str(metrics_dir))
+    requests = registry.counter('requests_total', 'Requests', ('route',))
+    duration = registry.histogram('duration_seconds', 'Duration', buckets=(0.1, 1.0))
+    return registry, requests, duration
+
+
+def test_render_sums_the_snapshots_of_all_processes(tmp_path):
+    first, first_requests, first_duration = _registry(tmp_path)
+    second, second_requests, second_duration = _registry(tmp_path)
+    first_requests.inc(route='/upload')
+    first_duration.observe(0.05)
+    second_requests.inc(2, route='/upload')
+    second_requests.inc(route='/metrics')
+    second_duration.observe(0.5)
+    first.flush()
+    second.flush()
+
+    lines = first.render().splitlines()
+
+    assert 'requests_total{route="/upload"} 3' in lines
+    assert 'requests_total{route="/metrics"} 1' in lines
+    assert 'duration_seconds_bucket{le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{le="1.0"} 2' in lines
+    assert 'duration_seconds_count 2' in lines
+
+
+def test_render_reports_flushed_values_only(tmp_path):
+    registry, requests, _ = _registry(tmp_path)
+    requests.inc(route='/upload')
+    registry.flush()
+    requests.inc(route='/upload')
+
+    # Other processes only see the last snapshot, so neither does this one
+    assert 'requests_total{route="/upload"} 1' in registry.render().splitlines()
+
+
+def test_forked_worker_counts_only_its_own_values(tmp_path):
+    registry, requests, _ = _registry(tmp_path)
+    requests.inc(route='/upload')
+
+    pid = os.fork()
+    if pid == 0:
+        requests.inc(route='/upload')
+        registry.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    registry.flush()
+
+    assert 'requests_total{route="/upload"} 2' in registry.render().splitlines()
+    assert len(os.listdir(tmp_path)) == 2
+
+
+def test_forked_worker_leaves_out_callback_counts_of_the_parent(tmp_path):
+    registry = MetricsRegistry(str(tmp_path))
+    counts = {'hit': 5, 'miss': 1}
+    registry.callback_counter('lookups_total', 'Lookups', ('result',),
+                              lambda: {(outcome,): count for outcome, count in counts.items()})
+
+    pid = os.fork()
+    if pid == 0:
+        counts['hit'] += 2
+        registry.flush()
+        os._exit(0)
+    os.waitpid(pid, 0)
+    registry.flush()
+
+    lines = registry.render().splitlines()
+    assert 'lookups_total{result="hit"} 7' in lines
+    assert 'lookups_total{result="miss"} 1' in lines
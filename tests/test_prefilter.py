@@ -0,0 +1,58 @@
+import cv2
+import numpy as np
+import pytest
+
+from ml.image_comparison import compare_images
+from ml.prefilter import perceptual_match
+
+
+def _page(label='Continue'):
+    page = np.full((1600, 400, 3), 245, dtype=np.uint8)
+    for index in range(12):
+        cv2.putText(page, f'Line of body text {index}', (20, 80 + index * 110),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (40, 40, 40), 2)
+    cv2.rectangle(page, (120, 1450), (280, 1500), (200, 120, 30), -1)
+    cv2.putText(page, label, (140, 1485), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    return page
+
+
+def _reencoded(image, quality=90):
+    return cv2.imdecode(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1],
+                        cv2.IMREAD_COLOR)
+
+
+def _gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+@pytest.fixture
+def design():
+    return _page()
+
+
+def test_near_identical_pair_is_short_circuited(design, tmp_path):
+    built = _reencoded(design)
+    assert not np.array_equal(design, built)
+
+    assert perceptual_match(_gray(design), _gray(built)) is not None
+    result = compare_images(design, built, str(tmp_path), prefilter='perceptual')
+    assert result['prefilter']['match'] == 'perceptual'
+    assert result['detected_differences'] == []
+
+
+@pytest.mark.parametrize('change', ['label', 'button_color', 'moved_line'])
+def test_small_real_change_is_compared_in_full(design, change, tmp_path):
+    built = design.copy()
+    if change == 'label':
+        built = _page('Cancel')
+    elif change == 'button_color':
+        cv2.rectangle(built, (120, 1450), (280, 1500), (30, 120, 200), -1)
+        cv2.putText(built, 'Continue', (140, 1485), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    else:
+        built[730:760] = design[720:750]
+    built = _reencoded(built)
+
+    assert perceptual_match(_gray(design), _gray(built)) is None
+    result = compare_images(design, built, str(tmp_path), prefilter='perceptual')
+    assert 'prefilter' not in result
+    assert result['detected_differences']
@@ -0,0 +1,79 @@
+import os
+import shutil
+
+from ml import result_cache
+from ml.image_comparison import ARTIFACT_KEYS
+from ml.result_cache import ResultCache, link_or_copy
+
+
+def test_link_or_copy_leaves_no_temporary_files(tmp_path):
+    source = tmp_path / 'render.png'
+    source.write_bytes(b'png')
+    destination = tmp_path / 'session' / 'figma_design.png'
+    destination.parent.mkdir()
+
+    # The second call links a file that already shares the source's inode
+    link_or_copy(str(source), str(destination))
+    link_or_copy(str(source), str(destination))
+
+    assert destination.read_bytes() == b'png'
+    assert os.listdir(destination.parent) == ['figma_design.png']
+
+
+def _result(session_dir, content=b'jpeg'):
+    """A comparison result whose annotated images are files of the given content"""
+    os.makedirs(session_dir, exist_ok=True)
+    result = {'similarity': 90.0, 'detected_differences': []}
+    for artifact_key in ARTIFACT_KEYS:
+        path = os.path.join(session_dir, f'{artifact_key}.jpg')
+        with open(path, 'wb') as f:
+            f.write(content)
+        result[artifact_key] = path
+    return result
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    entry_bytes = 1000 * len(ARTIFACT_KEYS)
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=2 * entry_bytes + 500)
+    for index, key in enumerate(('first', 'second')):
+        cache.put(key, _result(str(tmp_path / key), b'x' * 1000))
+        os.utime(cache._entry_dir(key), (index, index))
+    # Reading the first entry makes the second the least recently used
+    os.makedirs(tmp_path / 'session')
+    assert cache.get('first', str(tmp_path / 'session')) is not None
+
+    cache.put('third', _result(str(tmp_path / 'third'), b'x' * 1000))
+
+    assert sorted(os.listdir(cache.cache_dir)) == ['first', 'third']
+    assert cache.stats()['size_bytes'] <= cache.max_bytes
+
+
+def test_format_version_bump_invalidates_entries(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    key = cache.make_key(b'figma', b'built', render='full')
+    cache.put(key, _result(str(tmp_path / 'session')))
+
+    monkeypatch.setattr(result_cache, 'CACHE_FORMAT_VERSION', result_cache.CACHE_FORMAT_VERSION + 1)
+    new_key = cache.make_key(b'figma', b'built', render='full')
+    os.makedirs(tmp_path / 'later')
+
+    assert new_key != key
+    assert cache.get(key, str(tmp_path / 'later')) is not None
+    assert cache.get(new_key, str(tmp_path / 'later')) is None
+
+
+def test_hit_outlives_the_session_that_stored_it(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    cache.put('key', _result(str(tmp_path / 'first_session'), b'annotated'))
+    # The storage collector deletes the first session's directory
+    shutil.rmtree(tmp_path / 'first_session')
+    os.makedirs(tmp_path / 'second_session')
+
+    result = cache.get('key', str(tmp_path / 'second_session'), name_prefix='0_home_')
+
+    for artifact_key in ARTIFACT_KEYS:
+        path = result[artifact_key]
+        assert os.path.dirname(path) == str(tmp_path / 'second_session')
+        assert os.path.basename(path).startswith('0_home_')
+        with open(path, 'rb') as f:
+            assert f.read() == b'annotated'
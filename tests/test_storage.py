@@ -0,0 +1,81 @@
+import os
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from backend.results_db import ResultsDB
+from backend.storage import StorageManager
+from ml.benchmark_ssim import synthetic_page
+from ml.deferred_render import PENDING_SUFFIX, defer_rendering, render_pending
+from ml.image_comparison import compare_images
+
+
+def test_collectors_run_in_each_pass(tmp_path):
+    storage = StorageManager(str(tmp_path / 'uploads'))
+    storage.add_collector('things', lambda: 3)
+    storage.add_collector('broken', lambda: 1 / 0)
+
+    collected = storage.collect()['last_gc']['collected']
+
+    assert collected == {'things': 3, 'broken': None}
+    assert storage.stats()['last_gc']['collected'] == collected
+
+
+def test_results_db_purge_deletes_old_comparisons(tmp_path):
+    results_db = ResultsDB(str(tmp_path / 'results.sqlite3'))
+    difference = {'id': 1, 'severity': 'high', 'issue_type': 'color'}
+    old_id = results_db.record('session', 'single', [('screen', {'similarity': 0.9,
+                                                                 'detected_differences': [difference]})])
+    with results_db._transaction() as connection:
+        connection.execute('UPDATE comparisons SET created_at = ? WHERE comparison_id = ?',
+                           (time.time() - 3600, old_id))
+    new_id = results_db.record('session', 'single', [('screen', {'similarity': 1.0})])
+
+    assert results_db.purge(max_age=60) == 1
+    assert results_db.latest_comparison('session') == new_id
+    assert results_db.count_differences(old_id) == 0
+
+
+@pytest.fixture
+def deferred(tmp_path):
+    """A real comparison run with render='none' whose images were deferred, plus an eager run of it"""
+    design, built = synthetic_page(600, 900, seed=1)
+    figma_path, built_path = str(tmp_path / 'figma.png'), str(tmp_path / 'built.png')
+    cv2.imwrite(figma_path, design)
+    cv2.imwrite(built_path, built)
+    output_dir = tmp_path / 'comparison'
+    output_dir.mkdir()
+
+    result = compare_images(figma_path, built_path, str(output_dir), name_prefix='deferred_', render='none')
+    defer_rendering(result, figma_path, built_path)
+    eager = compare_images(figma_path, built_path, str(output_dir), name_prefix='eager_', render='full')
+    return result, eager
+
+
+def test_render_pending_renders_every_deferred_image(deferred):
+    result, eager = deferred
+    assert result['detected_differences']
+    assert 'render' not in result
+    assert 'comparison_image' in result['pending_images']
+    assert all(os.path.exists(result[key] + PENDING_SUFFIX) for key in result['pending_images'])
+
+    assert render_pending(result['comparison_image']) is True
+
+    for key in result['pending_images']:
+        assert not os.path.exists(result[key] + PENDING_SUFFIX)
+        rendered = cv2.imread(result[key])
+        assert rendered is not None
+        assert np.array_equal(rendered, cv2.imread(eager[key])), key
+    assert render_pending(result['comparison_image']) is False
+
+
+def test_render_pending_drops_sidecars_when_originals_are_gone(deferred, tmp_path):
+    result, _ = deferred
+    os.remove(tmp_path / 'built.png')
+
+    assert render_pending(result['comparison_image']) is False
+    for key in result['pending_images']:
+        assert not os.path.exists(result[key])
+        assert not os.path.exists(result[key] + PENDING_SUFFIX)
@@ -0,0 +1,34 @@
+import cv2
+import numpy as np
+
+from ml.image_comparison import compare_images
+from ml.tiled_comparison import compare_images_tiled
+
+
+def _page_pair(width=720, height=2400, regions=300, seed=0):
+    """A plain page and a copy with many shapes drawn on it, several across band seams"""
+    rng = np.random.default_rng(seed)
+    design = np.full((height, width), 235, dtype=np.uint8)
+    built = design.copy()
+    for _ in range(regions):
+        x, y = int(rng.integers(0, width - 40)), int(rng.integers(0, height - 80))
+        w, h = int(rng.integers(6, 40)), int(rng.integers(6, 80))
+        cv2.rectangle(built, (x, y), (x + w, y + h), int(rng.integers(0, 120)), -1)
+    for y in range(128, height, 256):
+        cv2.circle(built, (int(rng.integers(60, width - 60)), y), 30, 20, 3)
+    return design, built
+
+
+def _differences(result):
+    return [(difference['id'], difference['coordinates']) for difference in result['detected_differences']]
+
+
+def test_tiled_engine_reports_the_same_ids_as_frame(tmp_path):
+    design, built = _page_pair()
+    frame = compare_images(cv2.cvtColor(design, cv2.COLOR_GRAY2BGR), cv2.cvtColor(built, cv2.COLOR_GRAY2BGR),
+                           str(tmp_path), render='none')
+
+    for band_height in (128, 512):
+        tiled = compare_images_tiled(design, built, str(tmp_path), render='none', band_height=band_height)
+        assert len(tiled['detected_differences']) > 100
+        assert _differences(tiled) == _differences(frame)
@@ -0,0 +1,50 @@
+import importlib
+import io
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+
+def _png(image):
+    return io.BytesIO(cv2.imencode('.png', image)[1].tobytes())
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # The app keeps its uploads under the working directory it is imported from
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        app = importlib.import_module('backend.app').app
+        app.config['TESTING'] = True
+        yield app.test_client()
+    finally:
+        os.chdir(cwd)
+
+
+def _upload(client, **form):
+    page = np.full((200, 300, 3), 240, dtype=np.uint8)
+    data = {'session_id': 'masks', 'figma_image': (_png(page), 'figma.png'),
+            'built_image': (_png(page), 'built.png')}
+    data.update(form)
+    return client.post('/upload', data=data, content_type='multipart/form-data')
+
+
+def test_masks_are_applied(client):
+    response = _upload(client, roi='[10, 10, 100, 100]', ignore_regions='[[20, 20, 30, 30]]')
+    assert response.status_code == 200, response.get_json()
+
+
+@pytest.mark.parametrize('form', [
+    {'roi': 'not json'},
+    {'ignore_regions': '[[1, 2'},
+    {'roi': '[1, 2, 3]'},
+    {'ignore_regions': '[["a", 0, 10, 10]]'},
+    {'roi': '[5000, 5000, 10, 10]'},
+])
+def test_invalid_masks_are_client_errors(client, form):
+    response = _upload(client, **form)
+    assert response.status_code == 400
+    assert response.get_json()['error']
@@ -0,0 +1,20 @@
+"""
+WSGI entry point for production servers, e.g. gunicorn --preload wsgi:app
+
+Importing this module loads the comparison and Figma modules up front, and
+with them OpenCV, scikit-image, numpy, Pillow and requests. A server that
+imports it before forking its workers (gunicorn --preload, or python main.py)
+then shares these modules between all workers copy-on-write, and workers
+start without importing them again. Serve backend.app:app instead to start
+faster and load them on first use or through /ready.
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from backend.app import app, warm_modules  # noqa: E402
+
+# The app imports these lazily; load them before the server forks its workers
+warm_modules()